@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Per-module performance report from the b2.statistics tables in the job logs
+#
+# Every steering script ends with print(b2.statistics), so each log holds the
+# calls, memory and time of every module. This tool merges the tables of all
+# logs in an output directory and ranks the modules by their total time:
+#
+#   ./b2stats.py ../data/v7
+#   ./b2stats.py ../data/v7 --compare ../data/v6 --csv v7_vs_v6.csv
+import argparse
+import csv
+import glob
+import json
+import multiprocessing as mp
+import os
+from collections import defaultdict
+
+import joblog
+
+def percentile(values, q):
+    """
+    Return the q-th percentile of values using linear interpolation.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+def read_statistics(path):
+    """
+    Return the statistics rows of one log, or an empty list if unreadable.
+    """
+    try:
+        with open(path, errors = 'replace') as f:
+            return joblog.parse_statistics(f.read())
+    except OSError:
+        return []
+
+def collect(outdir, nworkers = None):
+    """
+    Return the statistics tables of all logs in outdir, skipping logs without one.
+    """
+    logs = sorted(glob.glob(os.path.join(outdir, '*.log')))
+    with mp.Pool(nworkers) as pool:
+        tables = pool.map(read_statistics, logs, chunksize = 32)
+    return [table for table in tables if any(row['name'] == 'Total' for row in table)]
+
+def aggregate(tables):
+    """
+    Merge statistics tables into one row per module, ranked by total time.
+
+    Times per event are in ms. The mean is the total time over all events,
+    the p95 is taken over the per-job averages.
+    """
+    modules = defaultdict(lambda: dict(njobs = 0, calls = 0, time = 0.0, per_event = [], memory = []))
+    total_events = 0
+    for table in tables:
+        events = [row['calls'] for row in table if row['name'] == 'Total'][0]
+        total_events += events
+        for row in table:
+            m = modules[row['name']]
+            m['njobs'] += 1
+            m['calls'] += row['calls']
+            m['time'] += row['time']
+            m['memory'].append(row['memory'])
+            if events > 0:
+                m['per_event'].append(1000 * row['time'] / events)
+
+    total_time = modules['Total']['time'] if 'Total' in modules else 0
+    report = []
+    for name, m in modules.items():
+        report.append(dict(module = name,
+                           njobs = m['njobs'],
+                           calls = m['calls'],
+                           total_time = m['time'],
+                           fraction = m['time'] / total_time if total_time > 0 else None,
+                           time_per_event = 1000 * m['time'] / total_events if total_events > 0 else None,
+                           time_per_event_p95 = percentile(m['per_event'], 95),
+                           memory_mean = sum(m['memory']) / len(m['memory']),
+                           memory_max = max(m['memory'])))
+    return sorted(report, key = lambda row: (row['module'] != 'Total', -row['total_time']))
+
+def compare(report, reference):
+    """
+    Return the report with the time per event of a reference campaign added.
+    """
+    ref = {row['module']: row for row in reference}
+    rows = []
+    for row in report:
+        row = dict(row)
+        other = ref.get(row['module'])
+        row['ref_time_per_event'] = None if other is None else other['time_per_event']
+        if other is not None and row['time_per_event'] is not None and other['time_per_event']:
+            row['ratio'] = row['time_per_event'] / other['time_per_event']
+        else:
+            row['ratio'] = None
+        rows.append(row)
+    # Modules which only exist in the reference
+    for name, other in ref.items():
+        if name not in {row['module'] for row in report}:
+            rows.append(dict(module = name, ref_time_per_event = other['time_per_event'], ratio = None))
+    return rows
+
+def fmt(value, spec):
+    return '-' if value is None else format(value, spec)
+
+def print_report(rows, top = 20):
+    """
+    Print the hottest modules as a table.
+    """
+    diff = 'ratio' in rows[0] if rows else False
+    header = '%-40s %6s %12s %7s %10s %10s %8s' % ('Module', 'Jobs', 'Time(s)', 'Frac', 'ms/event', 'p95', 'MaxMB')
+    if diff:
+        header += ' %10s %7s' % ('ref', 'ratio')
+    print(header)
+    print('=' * len(header))
+    for row in rows[:top + 1]:
+        line = '%-40s %6s %12s %7s %10s %10s %8s' % (
+            row['module'][:40], fmt(row.get('njobs'), 'd'), fmt(row.get('total_time'), '.1f'),
+            fmt(row.get('fraction'), '.1%'), fmt(row.get('time_per_event'), '.3f'),
+            fmt(row.get('time_per_event_p95'), '.3f'), fmt(row.get('memory_max'), '.0f'))
+        if diff:
+            line += ' %10s %7s' % (fmt(row['ref_time_per_event'], '.3f'), fmt(row['ratio'], '.2f'))
+        print(line)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Rank basf2 modules by the time spent in them')
+    parser.add_argument('outdir', help = 'output dir with the job logs')
+    parser.add_argument('--compare', default = None, help = 'output dir of a reference campaign')
+    parser.add_argument('--csv', default = None, help = 'write the report to this CSV file')
+    parser.add_argument('--json', default = None, help = 'write the report to this JSON file')
+    parser.add_argument('--top', type = int, default = 20, help = 'number of modules to print')
+    parser.add_argument('--nworkers', type = int, default = None, help = 'number of processes reading logs')
+    args = parser.parse_args()
+
+    tables = collect(args.outdir, args.nworkers)
+    print('Found statistics in %d logs of %s' % (len(tables), args.outdir))
+    rows = aggregate(tables)
+    if args.compare is not None:
+        reference = collect(args.compare, args.nworkers)
+        print('Found statistics in %d logs of %s' % (len(reference), args.compare))
+        rows = compare(rows, aggregate(reference))
+    print_report(rows, args.top)
+
+    if args.csv is not None:
+        fields = []
+        for row in rows:
+            fields += [k for k in row if k not in fields]
+        with open(args.csv, 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent = 1)
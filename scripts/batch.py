@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+
+# Batch submission engine used by submit.py
+#
+# mdst files are turned into tasks, tasks are grouped into jobs (one or more
+# files per basf2 process) and the jobs are handed to a thread pool which
+# calls bsub concurrently. Failed bsub calls are retried with an exponential
+# backoff and the LSF job ids are recorded on the jobs.
+import hashlib
+import os
+import signal
+import re
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BSUB_JOB_ID = re.compile(r'Job <(\d+)> is submitted')
+
+# LSF job states in terms of the ledger states
+LSF_STATES = {'PEND': 'submitted', 'PSUSP': 'submitted', 'WAIT': 'submitted',
+              'RUN': 'running', 'USUSP': 'running', 'SSUSP': 'running',
+              'DONE': 'done', 'EXIT': 'failed'}
+
+def process_start(pid):
+    """
+    Return the start time of a process in clock ticks since boot, None if unknown.
+
+    Together with the pid it identifies a process, as pids are reused.
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Field 22, counted after the command name, which may hold spaces
+    return int(stat.rsplit(')', 1)[1].split()[19])
+
+class Task:
+    """
+    One mdst file together with the output and log file it is processed into.
+
+    Files packed into one job share the output and log of the job.
+    """
+    def __init__(self, mdstpath, outdir, root = None, log = None):
+        base = os.path.basename(mdstpath)
+        self.mdst = mdstpath
+        self.root = root or os.path.join(outdir, base + '.root')
+        self.log = log or os.path.join(outdir, base + '.log')
+
+    def __repr__(self):
+        return f'Task({self.mdst!r})'
+
+class Job:
+    """
+    One batch job processing one or more tasks.
+    """
+    def __init__(self, name, tasks, command, log):
+        self.name = name
+        self.tasks = tasks
+        self.command = command
+        self.log = log
+        self.job_id = None
+        self.attempts = 0
+        self.error = ''
+        self.returncode = None
+        self.seconds = 0.0
+        # LSF report of an array element, which LSF does not append to the job log
+        self.report = None
+
+    def __repr__(self):
+        return f'Job({self.name!r}, ntasks={len(self.tasks)}, job_id={self.job_id!r})'
+
+BASF2_TEMPLATE = 'basf2 {b2opt} {script} {inputs} {output}'
+
+def basf2_command(script, inputs, output, b2opt = '', template = BASF2_TEMPLATE):
+    """
+    Return the command line processing the inputs into one output.
+
+    The template may use {script}, {inputs}, {output} and {b2opt}.
+    """
+    command = template.format(script = shlex.quote(script),
+                              inputs = ' '.join(shlex.quote(i) for i in inputs),
+                              output = shlex.quote(output),
+                              b2opt = b2opt)
+    return ' '.join(command.split())
+
+def chunks(items, size):
+    """
+    Split a list into consecutive chunks of at most size elements.
+    """
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def pack_name(mdsts):
+    """
+    Return a name for a packed job which only depends on its input files.
+    """
+    h = hashlib.sha1('\n'.join(sorted(mdsts)).encode()).hexdigest()[:10]
+    return f'pack_{h}'
+
+def make_jobs(script, groups, outdir, b2opt = '', prefix = 'job', template = BASF2_TEMPLATE):
+    """
+    Turn groups of mdst files into jobs, one basf2 process per group.
+
+    A job with one file keeps the old behaviour and writes <mdst>.root and
+    <mdst>.log. The files of a larger group are all passed to the steering
+    script and processed into pack_<hash>.root and pack_<hash>.log, the hash
+    being derived from the file list so resubmitting the same group reuses
+    the same names.
+    """
+    jobs = []
+    for i, group in enumerate(groups):
+        name = f'{prefix}{i:05d}'
+        if len(group) == 1:
+            tasks = [Task(group[0], outdir)]
+        else:
+            base = os.path.join(outdir, pack_name(group))
+            tasks = [Task(mdst, outdir, root = base + '.root', log = base + '.log') for mdst in group]
+        command = basf2_command(script, group, tasks[0].root, b2opt, template)
+        jobs.append(Job(name, tasks, command, tasks[0].log))
+    return jobs
+
+class LSFBackend:
+    """
+    Submit jobs to LSF with bsub.
+    """
+    def __init__(self, queue = 's', bsub = 'bsub', timeout = 60):
+        self.queue = queue
+        self.bsub = bsub
+        self.timeout = timeout
+
+    def _run(self, args):
+        """
+        Run bsub and return the job id it reports.
+        """
+        proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                                universal_newlines = True)
+        try:
+            out, err = proc.communicate(timeout = self.timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise RuntimeError(f'{self.bsub} timed out after {self.timeout}s')
+        match = BSUB_JOB_ID.search(out)
+        if proc.returncode != 0 or match is None:
+            raise RuntimeError(f'{self.bsub} failed ({proc.returncode}): {(err or out).strip()}')
+        return match.group(1)
+
+    def submit(self, job):
+        """
+        Submit a single job and return its job id.
+        """
+        os.makedirs(os.path.dirname(job.log) or '.', exist_ok = True)
+        return self._run([self.bsub, '-q', self.queue, '-J', job.name, '-oo', job.log,
+                          'sh', '-c', job.command])
+
+    def submit_array(self, name, jobs, listdir):
+        """
+        Submit jobs as one LSF job array and return the array job id.
+
+        The command of every element is written to listdir/<name>.lst and each
+        element picks its line with $LSB_JOBINDEX. The element logs go to
+        listdir/<name>.<index>.log, the basf2 output goes to the job logs.
+        """
+        os.makedirs(listdir, exist_ok = True)
+        listfile = os.path.join(listdir, name + '.lst')
+        with open(listfile, 'w') as f:
+            for job in jobs:
+                f.write(f'{job.command} > {shlex.quote(job.log)} 2>&1\n')
+        log = os.path.join(listdir, name + '.%I.log')
+        element = f'sh -c "$(sed -n "${{LSB_JOBINDEX}}p" {shlex.quote(listfile)})"'
+        return self._run([self.bsub, '-q', self.queue, '-J', f'{name}[1-{len(jobs)}]', '-oo', log,
+                          'sh', '-c', element])
+
+    def status(self, job_ids, bjobs = 'bjobs', chunk = 500):
+        """
+        Return the state of the given jobs as known to bjobs.
+
+        Jobs which bjobs does not know anymore are left out. Raises OSError if
+        bjobs fails for another reason, so no job is taken for lost.
+        """
+        states = {}
+        for ids in chunks(list(job_ids), chunk):
+            proc = subprocess.Popen([bjobs, '-a', '-noheader', '-o', "jobid stat jobindex delimiter=','"] + ids,
+                                    stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                                    universal_newlines = True)
+            out, err = proc.communicate(timeout = self.timeout)
+            if proc.returncode != 0 and 'not found' not in err:
+                raise OSError(f'{bjobs} failed: {err.strip()}')
+            for line in out.splitlines():
+                fields = line.strip().split(',')
+                if len(fields) != 3 or fields[1] not in LSF_STATES:
+                    continue
+                job_id = fields[0] if fields[2] in ('', '0') else f'{fields[0]}[{fields[2]}]'
+                states[job_id] = LSF_STATES[fields[1]]
+        return states
+
+class Submitter:
+    """
+    Submit jobs concurrently with bounded retries.
+
+    nworkers bsub calls run at the same time, consecutive calls are at least
+    min_interval seconds apart and a failed call is retried up to retries times,
+    waiting backoff * 2^attempt seconds (at most max_backoff) in between.
+    """
+    def __init__(self, backend, nworkers = 8, retries = 3, backoff = 1.0,
+                 max_backoff = 60.0, min_interval = 0.0):
+        self.backend = backend
+        self.nworkers = nworkers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._last_call = 0.0
+
+    def _throttle(self):
+        if self.min_interval <= 0:
+            return
+        with self._lock:
+            wait = self._last_call + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_call = time.monotonic()
+
+    def _call(self, job, submit):
+        """
+        Call submit() with retries and return the job id, or None on failure.
+        """
+        for attempt in range(self.retries + 1):
+            job.attempts += 1
+            self._throttle()
+            try:
+                return submit()
+            except (OSError, RuntimeError) as e:
+                job.error = str(e)
+            if attempt < self.retries:
+                time.sleep(min(self.max_backoff, self.backoff * 2 ** attempt))
+        return None
+
+    def _submit_job(self, job):
+        job.job_id = self._call(job, lambda: self.backend.submit(job))
+        return [job]
+
+    def _submit_array(self, name, jobs, listdir):
+        array_id = self._call(jobs[0], lambda: self.backend.submit_array(name, jobs, listdir))
+        for i, job in enumerate(jobs):
+            job.attempts = jobs[0].attempts
+            job.error = jobs[0].error
+            job.job_id = None if array_id is None else f'{array_id}[{i + 1}]'
+            job.report = os.path.join(listdir, f'{name}.{i + 1}.log')
+        return jobs
+
+    def submit(self, jobs, array_size = 0, listdir = None, callback = None):
+        """
+        Submit all jobs and return them with job_id set (None if failed).
+
+        With array_size > 0 the jobs are submitted as LSF job arrays of at most
+        array_size elements, the array lists are written into listdir.
+        callback is called with the list of jobs handled after each bsub call.
+        """
+        with ThreadPoolExecutor(max_workers = self.nworkers) as pool:
+            if array_size > 0:
+                futures = [pool.submit(self._submit_array, f'{group[0].name}_array', group, listdir)
+                           for group in chunks(jobs, array_size)]
+            else:
+                futures = [pool.submit(self._submit_job, job) for job in jobs]
+            for future in as_completed(futures):
+                done = future.result()
+                if callback is not None:
+                    callback(done)
+        return jobs
+
+class LocalRunner:
+    """
+    Run jobs on this machine instead of LSF.
+
+    At most nworkers jobs run at the same time, each in its own process group
+    with its output going to the job log. A job running longer than timeout
+    seconds is killed together with its children.
+    """
+    def __init__(self, nworkers = None, timeout = None):
+        self.nworkers = nworkers or os.cpu_count() or 1
+        self.timeout = timeout
+
+    def run_one(self, job, started = None):
+        """
+        Run one job to completion and set its returncode.
+
+        started is called with the job once its process runs.
+        """
+        os.makedirs(os.path.dirname(job.log) or '.', exist_ok = True)
+        start = time.monotonic()
+        job.attempts += 1
+        with open(job.log, 'w') as log:
+            proc = subprocess.Popen(['sh', '-c', job.command], stdout = log, stderr = subprocess.STDOUT,
+                                    stdin = subprocess.DEVNULL, start_new_session = True)
+            start = process_start(proc.pid)
+            job.job_id = f'local:{proc.pid}' if start is None else f'local:{proc.pid}:{start}'
+            if started is not None:
+                started(job)
+            try:
+                job.returncode = proc.wait(timeout = self.timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+                job.returncode = -signal.SIGKILL
+                job.error = f'timed out after {self.timeout}s'
+                log.write(f'\n[LocalRunner] Killed: {job.error}\n')
+        if job.returncode != 0 and not job.error:
+            job.error = f'exit code {job.returncode}'
+        job.seconds = time.monotonic() - start
+        return [job]
+
+    def run(self, jobs, callback = None, started = None):
+        """
+        Run all jobs and return them with returncode set.
+
+        callback is called with the list of jobs finished after each job,
+        started with each job once its process runs (one call at a time).
+        """
+        if started is not None:
+            lock = threading.Lock()
+            def on_start(job, started = started):
+                with lock:
+                    started(job)
+            started = on_start
+        with ThreadPoolExecutor(max_workers = self.nworkers) as pool:
+            futures = [pool.submit(self.run_one, job, started) for job in jobs]
+            for future in as_completed(futures):
+                done = future.result()
+                if callback is not None:
+                    callback(done)
+        return jobs
+
+    def status(self, job_ids):
+        """
+        Return 'running' for the local jobs whose process is still alive.
+
+        A job id local:<pid>:<start> only matches the process started at that
+        time, not a later one which got the same pid.
+        """
+        states = {}
+        for job_id in job_ids:
+            if not job_id.startswith('local:'):
+                continue
+            fields = job_id.split(':')
+            try:
+                pid = int(fields[1])
+                os.kill(pid, 0)
+            except (OSError, ValueError):
+                continue
+            if len(fields) > 2 and fields[2] != str(process_start(pid)):
+                continue
+            states[job_id] = 'running'
+        return states
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+# Reproducible performance benchmarks of the reconstruction and its tools
+#
+# With basf2 set up, every steering script of STEERING runs on the same
+# small input and the first --events events, and the events per second of the
+# event loop (from the b2.statistics table of the log), peak RSS, output bytes
+# per event and candidates per event are recorded:
+#
+#   ./bench.py --input ../data/bench/mini.mdst --events 2000
+#
+# Without basf2 (or with --stub) the steering scripts run against stub
+# basf2 modules instead, which only record the path: this times the Python
+# side of the path construction and counts the modules. In both modes the
+# post-processing tools of TOOLS run on a fixed synthetic campaign
+# (synthetic.py, seeded). Every benchmark is a separate process, so peak RSS
+# is its own.
+#
+# Each run is appended to --history (bench_history.json). A result is
+# flagged when it is worse than the median of the last --baseline runs on
+# the same host, mode and input by more than --tolerance (rate, memory,
+# bytes per event), or when the candidates per event changed; the exit code
+# is then 1.
+import argparse
+import datetime
+import json
+import os
+import platform
+import runpy
+import shutil
+import subprocess
+import sys
+import time
+import types
+
+import joblog
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STEERING = ['sigma_v6.py', 'sigma_v7.py', 'recon_lambdac.py']
+
+# name -> arguments of a script of this dir and its output ({syn}: synthetic
+# campaign, {work}: scratch dir); the tools after merge read its dataset
+TOOLS = [
+    ('merge', ['merge.py', '{syn}', '{work}/pq', '--tree', 'good,lambda_c'], '{work}/pq'),
+    ('columnar', ['columnar.py', '{syn}', '{work}/columnar', '--tree', 'good'], '{work}/columnar'),
+    ('histograms', ['histograms.py', '{syn}', '--tree', 'good', '--out', '{work}/hists.npz'], '{work}/hists.npz'),
+    ('cutscan', ['cutscan.py', '{work}/pq', '--tree', 'lambda_c', '--scan', 'sigma_Sigma_mva >', '0', '0.9', '0.1',
+                 '--scan', 'M >=', '2.22', '2.26', '0.01', '--json', '{work}/cutscan.json'], '{work}/cutscan.json'),
+    ('optimize', ['optimize.py', '{work}/pq', '--cache', '{work}/optimize'], '{work}/optimize'),
+    ('best', ['best.py', '{work}/pq', '{work}/best', '--tree', 'good'], '{work}/best'),
+    ('sampling', ['sampling.py', '{work}/pq', '{work}/sampled', '--fraction', '0.05'], '{work}/sampled'),
+    ('kinematics', ['kinematics.py', '{work}/pq', '--tree', 'lambda_c'], None),
+    ('mva', ['mva.py', '{work}/pq', '--out', '{work}/bdt.npz', '--ntrees', '20'], '{work}/bdt.npz'),
+]
+
+# metric -> higher is better (None: any change is flagged)
+METRICS = {
+    'events_per_s': True,
+    'peak_rss_mb': False,
+    'bytes_per_event': False,
+    'candidates_per_event': None,
+    'modules': None,
+}
+
+def install_stubs():
+    """
+    Put stand-ins for basf2 and the modules the steering scripts import into sys.modules.
+
+    The analysis functions add a record to the path they get, and process()
+    keeps the path, so a steering script builds its path without running it.
+    The tests in tests/ check the paths built with these stubs.
+    """
+    class Path:
+        def __init__(self):
+            self.modules = []
+            # (module or function name, positional arguments, keyword arguments)
+            self.calls = []
+
+        def add_module(self, module, **kwargs):
+            self.modules.append(module if isinstance(module, str) else type(module).__name__)
+            self.calls.append((self.modules[-1], (), kwargs))
+
+        def add_path(self, path):
+            self.modules += path.modules
+            self.calls += path.calls
+
+    def recorder(name):
+        def record(*args, path = None, **kwargs):
+            if path is not None:
+                path.modules.append(name)
+                path.calls.append((name, args, kwargs))
+            return []
+        return record
+
+    def module(name, **attrs):
+        m = types.ModuleType(name)
+        m.__dict__.update(attrs)
+        sys.modules[name] = m
+        return m
+
+    class Module:
+        def __init__(self, *args, **kwargs):
+            pass
+
+    processed = []
+    module('basf2', create_path = Path, process = lambda path, *args, **kwargs: processed.append(path),
+           statistics = '', Module = Module, B2INFO = print, B2WARNING = print,
+           B2FATAL = lambda message: sys.exit(message), processed = processed)
+    ma = module('modularAnalysis')
+    ma.__getattr__ = recorder
+    module('b2biiConversion', convertBelleMdstToBelleIIMdst = recorder('B2BIIConvert'),
+           setupB2BIIDatabase = lambda *args, **kwargs: None)
+    module('b2biiMonitors')
+
+    class Variables:
+        def addAlias(self, alias, variable):
+            pass
+
+    def create_aliases_for_selected(list_of_variables, decay_string, prefix = None):
+        return [f'{p}_{v}' for p in prefix or [] for v in list_of_variables]
+
+    def create_aliases(list_of_variables, wrapper, prefix):
+        return [f'{prefix}_{v}' for v in list_of_variables]
+
+    variables = module('variables', variables = Variables())
+    variables.utils = module('variables.utils', create_aliases_for_selected = create_aliases_for_selected,
+                             create_aliases = create_aliases)
+    variables.collections = module('variables.collections')
+    variables.collections.__getattr__ = lambda name: []
+    module('ROOT', Belle2 = types.SimpleNamespace(), std = types.SimpleNamespace())
+    return processed
+
+def stub_run(script, input_file, output_file):
+    """
+    Build the path of a steering script with the stubs and print its size.
+    """
+    processed = install_stubs()
+    sys.path.insert(0, HERE)
+    sys.argv = [script, input_file, output_file]
+    start = time.perf_counter()
+    runpy.run_path(os.path.join(HERE, script), run_name = '__main__')
+    seconds = time.perf_counter() - start
+    modules = sum(len(path.modules) for path in processed)
+    print('BENCH ' + json.dumps(dict(seconds = seconds, modules = modules)))
+
+def run_measured(usage_file, cmd):
+    """
+    Run a command, writing its wall time, peak RSS (kB) and exit code to usage_file.
+    """
+    start = time.perf_counter()
+    p = subprocess.Popen(cmd)
+    # wait4 gives the resource usage of this child alone
+    _, status, usage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    with open(usage_file, 'w') as f:
+        json.dump(dict(seconds = time.perf_counter() - start, maxrss = usage.ru_maxrss,
+                       returncode = p.returncode), f)
+    return p.returncode
+
+def measure(cmd, cwd, log):
+    """
+    Run a command and return its wall time, peak RSS (MB), exit code and output.
+
+    A child starts with the peak RSS of the process it was forked from, so the
+    command is started by a fresh interpreter running run_measured().
+    """
+    usage_file = log + '.usage'
+    with open(log, 'w') as f:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', usage_file] + cmd,
+                       cwd = cwd, stdout = f, stderr = subprocess.STDOUT)
+    with open(usage_file) as f:
+        usage = json.load(f)
+    with open(log) as f:
+        output = f.read()
+    return usage['seconds'], usage['maxrss'] / 1024, usage['returncode'], output
+
+def size(path):
+    """
+    Return the bytes of a file or of all files below a directory.
+    """
+    if path is None or not os.path.exists(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(d, name)) for d, _, names in os.walk(path) for name in names)
+
+def count_candidates(path):
+    """
+    Return the entries of all trees of a ROOT file.
+    """
+    import uproot
+    with uproot.open(path) as f:
+        return sum(f[key].num_entries for key, classname in f.classnames().items() if classname == 'TTree')
+
+def bench_steering(script, input_file, events, work, stub):
+    output = os.path.join(work, script.replace('.py', '.root'))
+    log = os.path.join(work, script.replace('.py', '.log'))
+    if stub:
+        cmd = [sys.executable, os.path.abspath(__file__), '--stub_run', script, input_file, output]
+    else:
+        cmd = ['basf2', '-n', str(events), script, input_file, output]
+    seconds, rss, code, text = measure(cmd, HERE, log)
+    result = dict(seconds = round(seconds, 3), peak_rss_mb = round(rss, 1), returncode = code)
+    if code != 0:
+        return result
+    if stub:
+        line = [l for l in text.splitlines() if l.startswith('BENCH ')][-1]
+        result['modules'] = json.loads(line[6:])['modules']
+        result['path_seconds'] = round(json.loads(line[6:])['seconds'], 4)
+    else:
+        # Events processed and event loop time from the Total row of b2.statistics, as b2stats.py reads them
+        total = [row for row in joblog.parse_statistics(text) if row['name'] == 'Total']
+        if not total or total[0]['calls'] == 0:
+            result['error'] = 'no statistics in the log'
+            return result
+        processed = total[0]['calls']
+        result['events'] = processed
+        result['events_per_s'] = round(processed / total[0]['time'], 2) if total[0]['time'] > 0 else None
+        result['bytes_per_event'] = round(size(output) / processed, 1)
+        result['candidates_per_event'] = round(count_candidates(output) / processed, 4)
+    return result
+
+def bench_tool(args, output, syn, work, events):
+    fill = lambda s: s.format(syn = syn, work = work)
+    output = fill(output) if output else None
+    if output is not None and os.path.exists(output):
+        shutil.rmtree(output) if os.path.isdir(output) else os.remove(output)
+    cmd = [sys.executable] + [fill(a) for a in args]
+    seconds, rss, code, _ = measure(cmd, HERE, os.path.join(work, args[0].replace('.py', '.log')))
+    result = dict(seconds = round(seconds, 3), peak_rss_mb = round(rss, 1), returncode = code)
+    if code == 0:
+        result['events_per_s'] = round(events / seconds, 2)
+        if output is not None:
+            result['bytes_per_event'] = round(size(output) / events, 1)
+    return result
+
+def synthetic_campaign(outdir, nfiles, nevents):
+    """
+    Write the fixed synthetic campaign (once) and return its number of events.
+    """
+    import reconstruction
+    import synthetic
+    if not os.path.isdir(outdir) or len(os.listdir(outdir)) != nfiles:
+        shutil.rmtree(outdir, ignore_errors = True)
+        synthetic.generate(outdir, [reconstruction.SIGMA_V7, dict(reconstruction.LAMBDAC, four_vectors = True)],
+                           nfiles, nevents, seed = 0)
+    return nfiles * nevents
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return values[n // 2] if n % 2 else (values[n // 2 - 1] + values[n // 2]) / 2
+
+def compare(entry, history, baseline, tolerance):
+    """
+    Return the flags of the results of entry against the previous comparable runs.
+    """
+    same = [h for h in history if all(h.get(k) == entry[k] for k in ('host', 'mode', 'input', 'events'))]
+    same = same[-baseline:]
+    flags = []
+    for name, result in entry['results'].items():
+        if result.get('returncode'):
+            flags.append(f'{name}: failed with exit code {result["returncode"]}')
+            continue
+        for metric, higher in METRICS.items():
+            previous = [h['results'][name][metric] for h in same
+                        if metric in h['results'].get(name, {}) and not h['results'][name].get('returncode')]
+            if metric not in result or not previous:
+                continue
+            ref, value = median(previous), result[metric]
+            if higher is None:
+                if abs(value - ref) > 1e-3 * max(abs(ref), 1e-9):
+                    flags.append(f'{name}: {metric} changed from {ref} to {value}')
+            elif (value < ref * (1 - tolerance)) if higher else (value > ref * (1 + tolerance)):
+                flags.append(f'{name}: {metric} {value} vs {ref} ({100 * (value / ref - 1):+.0f}%)')
+    return flags
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = HERE, capture_output = True,
+                              text = True).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5 and sys.argv[1] == '--stub_run':
+        stub_run(*sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 3 and sys.argv[1] == '--measure':
+        sys.exit(run_measured(sys.argv[2], sys.argv[3:]))
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the steering scripts and the tools')
+    parser.add_argument('--input', default = 'mini.mdst', help = 'small fixed Belle mdst (basf2 mode)')
+    parser.add_argument('--events', type = int, default = 1000, help = 'events processed per steering script')
+    parser.add_argument('--stub', action = 'store_true', default = False, help = 'use the basf2 stubs even with basf2')
+    parser.add_argument('--only', nargs = '+', default = None, help = 'benchmarks to run (default all)')
+    parser.add_argument('--synthetic_files', type = int, default = 4, help = 'files of the synthetic campaign')
+    parser.add_argument('--synthetic_events', type = int, default = 20000, help = 'events per synthetic file')
+    parser.add_argument('--work', default = 'bench_work', help = 'scratch dir')
+    parser.add_argument('--history', default = 'bench_history.json', help = 'JSON history of the runs')
+    parser.add_argument('--baseline', type = int, default = 5, help = 'previous runs the median is taken of')
+    parser.add_argument('--tolerance', type = float, default = 0.15, help = 'allowed relative change')
+    args = parser.parse_args()
+
+    stub = args.stub or shutil.which('basf2') is None
+    work = os.path.abspath(args.work)
+    os.makedirs(work, exist_ok = True)
+    syn = os.path.join(work, 'synthetic')
+    events = synthetic_campaign(syn, args.synthetic_files, args.synthetic_events)
+    selected = lambda name: args.only is None or name in args.only
+
+    entry = dict(time = datetime.datetime.now().isoformat(timespec = 'seconds'), host = platform.node(),
+                 mode = 'stub' if stub else 'basf2', commit = git_commit(),
+                 input = 'stub' if stub else os.path.abspath(args.input), events = args.events,
+                 synthetic = [args.synthetic_files, args.synthetic_events], results = {})
+    print('Benchmarks in %s mode, commit %s' % (entry['mode'], entry['commit']))
+    for script in STEERING:
+        if selected(script):
+            entry['results'][script] = bench_steering(script, os.path.abspath(args.input), args.events, work, stub)
+            print('%-20s %s' % (script, entry['results'][script]))
+    for name, tool_args, output in TOOLS:
+        if selected(name):
+            entry['results'][name] = bench_tool(tool_args, output, syn, work, events)
+            print('%-20s %s' % (name, entry['results'][name]))
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    entry['flags'] = compare(entry, history, args.baseline, args.tolerance)
+    history.append(entry)
+    with open(args.history, 'w') as f:
+        json.dump(history, f, indent = 1)
+
+    for flag in entry['flags']:
+        print('REGRESSION ' + flag)
+    print('%d benchmarks, %d flagged, history in %s' % (len(entry['results']), len(entry['flags']), args.history))
+    sys.exit(1 if entry['flags'] else 0)
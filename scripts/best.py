@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# Best-candidate selection on the columnar output
+#
+# The same rankings as the rank/keep options of the reconstruction.py
+# configurations, applied afterwards to a Parquet dataset of merge.py or
+# columnar.py: candidates are grouped by (experiment, run, event), ordered
+# by the ranking and only the first --keep of each event are written out.
+#
+#   ./best.py ../data/v7.parquet ../data/v7_best.parquet --tree good --rank dM --keep 1
+#
+# In a notebook, best_mask(df, 'dM') gives the same selection for a DataFrame.
+# __ncandidates__ keeps the number of candidates before the selection.
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from reconstruction import SIGMA_MASS, LAMBDAC_MASS
+
+EVENT = ['__experiment__', '__run__', '__event__']
+
+# name -> (columns to try, higher is better); dM is |M - nominal mass|
+RANKINGS = {
+    'chiProb': (['chiProb'], True),
+    'dM': (['M'], False),
+    'Sigma_mva': (['sigma_Sigma_mva', 'Sigma_mva'], True),
+}
+
+def rank_column(columns, rank):
+    """
+    Return the column a ranking needs and whether higher is better.
+    """
+    candidates, highest = RANKINGS.get(rank, ([rank], True))
+    for column in candidates:
+        if column in columns:
+            return column, highest
+    raise KeyError(f'No column for ranking {rank}, tried {candidates}')
+
+def score(values, rank, tree):
+    if rank == 'dM':
+        mass = LAMBDAC_MASS if tree.startswith('lambda_c') else SIGMA_MASS
+        return np.abs(values - mass)
+    return values
+
+def best_mask(arrays, rank = 'dM', keep = 1, highest = None, tree = 'good'):
+    """
+    Return the mask of the best keep candidates of each event.
+
+    arrays is a dict of numpy arrays or a DataFrame with the event columns.
+    Candidates with a NaN score come last.
+    """
+    column, default = rank_column(list(arrays.keys()), rank)
+    highest = default if highest is None else highest
+    values = score(np.asarray(arrays[column], dtype = np.float64), rank, tree)
+    key = np.where(np.isnan(values), np.inf, -values if highest else values)
+    exp, run, event = (np.asarray(arrays[c]) for c in EVENT)
+    order = np.lexsort((key, event, run, exp))
+    n = len(order)
+    if n == 0:
+        return np.zeros(0, bool)
+    new_event = np.ones(n, bool)
+    new_event[1:] = ((exp[order][1:] != exp[order][:-1]) | (run[order][1:] != run[order][:-1]) |
+                     (event[order][1:] != event[order][:-1]))
+    start = np.maximum.accumulate(np.where(new_event, np.arange(n), 0))
+    mask = np.zeros(n, bool)
+    mask[order] = np.arange(n) - start < keep
+    return mask
+
+def select_file(path, dest, rank, keep, highest, tree):
+    """
+    Write the best candidates of one Parquet file, reading it row group by row group.
+
+    Returns the number of candidates before and after.
+    """
+    import pyarrow.parquet as pq
+    f = pq.ParquetFile(path)
+    column, _ = rank_column(f.schema_arrow.names, rank)
+    keys = f.read(columns = EVENT + [column]).to_pydict()
+    mask = best_mask({c: np.asarray(v) for c, v in keys.items()}, rank, keep, highest, tree)
+    os.makedirs(os.path.dirname(dest), exist_ok = True)
+    start = 0
+    with pq.ParquetWriter(dest, f.schema_arrow, compression = 'zstd') as writer:
+        for i in range(f.num_row_groups):
+            table = f.read_row_group(i)
+            writer.write_table(table.filter(mask[start:start + table.num_rows]))
+            start += table.num_rows
+    return len(mask), int(mask.sum())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Keep the best candidates of each event')
+    parser.add_argument('dataset', help = 'Parquet dataset dir (merge.py or columnar.py)')
+    parser.add_argument('outdir', help = 'dataset dir to write')
+    parser.add_argument('--tree', default = 'good', help = 'tree name')
+    parser.add_argument('--rank', default = 'dM', help = 'ranking: %s or any column' % ', '.join(RANKINGS))
+    parser.add_argument('--keep', type = int, default = 1, help = 'candidates kept per event')
+    parser.add_argument('--lowest', action = 'store_true', default = False,
+                        help = 'lower values are better (for a column ranking)')
+    args = parser.parse_args()
+
+    highest = False if args.lowest else None
+    indir = os.path.join(args.dataset, args.tree)
+    files = sorted(glob.glob(os.path.join(indir, '**', '*.parquet'), recursive = True))
+    before = after = 0
+    for path in files:
+        dest = os.path.join(args.outdir, args.tree, os.path.relpath(path, indir))
+        n, k = select_file(path, dest, args.rank, args.keep, highest, args.tree)
+        before += n
+        after += k
+    print('Kept %d of %d candidates (%.1f%%) in %d files' %
+          (after, before, 100 * after / max(before, 1), len(files)))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Local cache of the Belle File Search Engine
+#
+# The mdst lists are stored in a small SQLite database indexed by query and
+# run number. A miss fetches the whole run range of the experiment once, so
+# later slices of the same experiment are answered locally by a range query.
+# The cache can be prebuilt with
+#
+#   ./catalogue.py build --exp 55 --event_type Any
+#
+# or filled from a saved listing (e.g. the montecarlo.php page) with
+#
+#   ./catalogue.py import --exp 55 listing.html
+import argparse
+import os
+import re
+import sqlite3
+import time
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'sigma_selection', 'catalogue.sqlite')
+DEFAULT_TTL = 7 * 24 * 3600
+RUN_MIN = 1
+RUN_MAX = 9999
+
+MDST_PATH = re.compile(r'(/[^\s<>"\']+\.mdst)')
+EXP_RUN = re.compile(r'e(\d+)r(\d+)')
+
+def mc_url(exp, run_start = RUN_MIN, run_end = RUN_MAX, event_type = 'Any',
+           data_type = 'Any', belle_level = 'caseB', stream = 0):
+    """
+    Return the File Search Engine URL of an MC query.
+    """
+    return (f'http://bweb3.cc.kek.jp/montecarlo.php?ex={exp}&rs={run_start}&re={run_end}'
+            f'&ty={event_type}&dt={data_type}&bl={belle_level}&st={stream}')
+
+def query_key(is_data, exp, event_type = 'Any', data_type = 'Any', belle_level = 'caseB', stream = 0):
+    """
+    Return the cache key of a query, i.e. everything but the run range.
+    """
+    kind = 'data' if is_data else 'mc'
+    return f'{kind}:{exp}:{event_type}:{data_type}:{belle_level}:{stream}'
+
+def parse_listing(text):
+    """
+    Return the mdst paths found in a File Search Engine page, in order.
+    """
+    paths = []
+    seen = set()
+    for path in MDST_PATH.findall(text):
+        if path not in seen:
+            seen.add(path)
+            paths.append(path)
+    return paths
+
+def run_number(path):
+    """
+    Return the run number encoded in an mdst file name (None if absent).
+    """
+    match = EXP_RUN.search(os.path.basename(path))
+    return None if match is None else int(match.group(2))
+
+def fetch_b2c(url):
+    """
+    Fetch a file list with b2biiConversion, only available inside basf2.
+    """
+    import b2biiConversion as b2c
+    return b2c.parse_process_url(url)
+
+class Catalogue:
+    """
+    SQLite cache of mdst file lists with run range queries.
+    """
+    def __init__(self, path = DEFAULT_PATH, ttl = DEFAULT_TTL, fetch = fetch_b2c):
+        self.path = path
+        self.ttl = ttl
+        self.fetch = fetch
+        self.nfetches = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (key TEXT, run INTEGER, seq INTEGER, path TEXT);
+            CREATE INDEX IF NOT EXISTS files_key_run ON files (key, run);
+            CREATE TABLE IF NOT EXISTS fetches (key TEXT, run_start INTEGER, run_end INTEGER, time REAL);
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def covered(self, key, run_start, run_end):
+        """
+        Return True if a fresh fetch of key covers the run range.
+        """
+        row = self.db.execute('SELECT COUNT(*) FROM fetches WHERE key = ? AND run_start <= ? '
+                              'AND run_end >= ? AND time >= ?',
+                              (key, run_start, run_end, time.time() - self.ttl)).fetchone()
+        return row[0] > 0
+
+    def store(self, key, paths, run_start = RUN_MIN, run_end = RUN_MAX):
+        """
+        Replace the cached files of key in the run range with paths.
+
+        Paths outside the run range are left out, as the fetch covers only the range.
+        """
+        with self.db:
+            self.db.execute('DELETE FROM files WHERE key = ? AND run BETWEEN ? AND ?',
+                            (key, run_start, run_end))
+            self.db.execute('DELETE FROM fetches WHERE key = ? AND run_start >= ? AND run_end <= ?',
+                            (key, run_start, run_end))
+            rows = []
+            for seq, path in enumerate(paths):
+                run = run_number(path)
+                if run is None:
+                    print(f'[Catalogue] No run number in {path}, not cached')
+                    continue
+                if not run_start <= run <= run_end:
+                    continue
+                rows.append((key, run, seq, path))
+            self.db.executemany('INSERT INTO files VALUES (?, ?, ?, ?)', rows)
+            self.db.execute('INSERT INTO fetches VALUES (?, ?, ?, ?)',
+                            (key, run_start, run_end, time.time()))
+        return len(rows)
+
+    def lookup(self, key, run_start, run_end):
+        """
+        Return the cached files of key in the run range.
+        """
+        rows = self.db.execute('SELECT path FROM files WHERE key = ? AND run BETWEEN ? AND ? '
+                               'ORDER BY run, seq', (key, run_start, run_end))
+        return [row[0] for row in rows]
+
+    def get_mc(self, exp, run_start = RUN_MIN, run_end = RUN_MAX, event_type = 'Any',
+               data_type = 'Any', belle_level = 'caseB', stream = 0):
+        """
+        Return the MC mdst files of a query, fetching the whole experiment on a miss.
+        """
+        key = query_key(False, exp, event_type, data_type, belle_level, stream)
+        if not self.covered(key, run_start, run_end):
+            url = mc_url(exp, RUN_MIN, RUN_MAX, event_type, data_type, belle_level, stream)
+            print(f'[Catalogue] Getting mdst from {url}')
+            self.nfetches += 1
+            self.store(key, self.fetch(url))
+        return self.lookup(key, run_start, run_end)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Build or inspect the mdst catalogue cache')
+    parser.add_argument('command', choices = ['build', 'import', 'list'])
+    parser.add_argument('listing', nargs = '?', help = 'saved File Search Engine page (for import)')
+    parser.add_argument('--catalogue', default = DEFAULT_PATH, help = 'catalogue file')
+    parser.add_argument('--exp', type = int, required = True, help = 'exp no.')
+    parser.add_argument('--run_start', type = int, default = RUN_MIN, help = 'run number start')
+    parser.add_argument('--run_end', type = int, default = RUN_MAX, help = 'run number end')
+    parser.add_argument('--event_type', default = 'Any', help = 'event type')
+    parser.add_argument('--data_type', default = 'Any', help = 'data type')
+    parser.add_argument('--belle_level', default = 'caseB', help = 'belle level')
+    parser.add_argument('--stream', type = int, default = 0, help = 'stream number')
+    args = parser.parse_intermixed_args()
+
+    cat = Catalogue(args.catalogue)
+    key = query_key(False, args.exp, args.event_type, args.data_type, args.belle_level, args.stream)
+    if args.command == 'build':
+        cat.ttl = 0
+        files = cat.get_mc(args.exp, args.run_start, args.run_end, args.event_type,
+                           args.data_type, args.belle_level, args.stream)
+        print(f'{len(files)} files cached for {key}')
+    elif args.command == 'import':
+        assert args.listing is not None, 'Need a listing file to import'
+        with open(args.listing, errors = 'replace') as f:
+            n = cat.store(key, parse_listing(f.read()), args.run_start, args.run_end)
+        print(f'{n} files imported for {key}')
+    else:
+        for path in cat.lookup(key, args.run_start, args.run_end):
+            print(path)
+    cat.close()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# Convert the ntuples of a campaign to Parquet
+#
+# VariablesToNtuple writes every variable as a double. The converter reads
+# the per-job ROOT trees in chunks and rewrites them as compressed Parquet
+# files with typed columns: int8 for flags (isSignal, charge, ...), int32 for
+# PDG codes, float32 for everything else. Parquet keeps min/max statistics
+# per row group, so readers can skip row groups and files a cut excludes.
+#
+#   ./columnar.py ../data/v7 ../data/v7.parquet --tree good
+#
+# writes ../data/v7.parquet/good/part-00000.parquet, ... which pandas reads
+# with pd.read_parquet('../data/v7.parquet/good', columns = [...]).
+import argparse
+import glob
+import os
+
+import numpy as np
+
+FLAGS = ['isSignal', 'goodBelleGamma', 'clusterReg', 'charge']
+PDG = ['PDG']
+# Columns keeping double precision
+DOUBLES = ['__weight__']
+
+def column_type(name, dtype):
+    """
+    Return the numpy type a column is stored as.
+    """
+    if dtype.kind in 'iub':
+        return dtype
+    if any(name.endswith(flag) for flag in FLAGS):
+        return np.dtype(np.int8)
+    if any(name.endswith(pdg) for pdg in PDG):
+        return np.dtype(np.int32)
+    if name in DOUBLES:
+        return dtype
+    return np.dtype(np.float32)
+
+def cast(arrays):
+    """
+    Return the columns converted to their storage types.
+
+    Integer columns have no NaN; a missing value (no MC match) becomes 0.
+    """
+    columns = {}
+    for name, values in arrays.items():
+        dtype = column_type(name, values.dtype)
+        if dtype.kind in 'iu' and values.dtype.kind == 'f':
+            values = np.nan_to_num(values, nan = 0.0)
+        columns[name] = values.astype(dtype, copy = False)
+    return columns
+
+def to_table(arrays):
+    import pyarrow as pa
+    return pa.table(cast(arrays))
+
+def iterate(path, tree, step_size = '100 MB', columns = None):
+    """
+    Yield the columns of a ROOT tree in chunks of numpy arrays.
+    """
+    import uproot
+    with uproot.open(path) as f:
+        if tree not in f:
+            return
+        t = f[tree]
+        if t.num_entries == 0:
+            return
+        for arrays in t.iterate(columns, step_size = step_size, library = 'np'):
+            yield arrays
+
+class PartWriter:
+    """
+    Write tables to Parquet files of about rows_per_file rows each.
+    """
+    def __init__(self, outdir, rows_per_file = 5000000, row_group_size = 100000,
+                 compression = 'zstd', prefix = 'part'):
+        self.outdir = outdir
+        self.rows_per_file = rows_per_file
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.prefix = prefix
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+        self.paths = []
+        os.makedirs(outdir, exist_ok = True)
+
+    def write(self, table):
+        import pyarrow.parquet as pq
+        if self.schema is None:
+            self.schema = table.schema
+        elif not table.schema.equals(self.schema):
+            raise ValueError('Schema differs from the first file: %s' %
+                             sorted(set(table.schema.names) ^ set(self.schema.names)))
+        if self.writer is None:
+            path = os.path.join(self.outdir, '%s-%05d.parquet' % (self.prefix, len(self.paths)))
+            self.writer = pq.ParquetWriter(path, self.schema, compression = self.compression,
+                                           write_statistics = True)
+            self.paths.append(path)
+            self.rows = 0
+        self.writer.write_table(table, row_group_size = self.row_group_size)
+        self.rows += table.num_rows
+        if self.rows >= self.rows_per_file:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+def convert(paths, tree, outdir, step_size = '100 MB', **kwargs):
+    """
+    Convert one tree of several ROOT files to Parquet files in outdir/tree.
+
+    Returns the Parquet files written and the number of candidates.
+    """
+    writer = PartWriter(os.path.join(outdir, tree), **kwargs)
+    entries = 0
+    try:
+        for path in paths:
+            for arrays in iterate(path, tree, step_size):
+                table = to_table(arrays)
+                writer.write(table)
+                entries += table.num_rows
+    finally:
+        writer.close()
+    return writer.paths, entries
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Convert ntuples to Parquet')
+    parser.add_argument('indir', help = 'output dir of a campaign with the ROOT files')
+    parser.add_argument('outdir', help = 'Parquet dataset dir')
+    parser.add_argument('--tree', default = 'good', help = 'comma separated tree names')
+    parser.add_argument('--rows_per_file', type = int, default = 5000000, help = 'candidates per Parquet file')
+    parser.add_argument('--row_group_size', type = int, default = 100000, help = 'candidates per row group')
+    parser.add_argument('--compression', default = 'zstd', help = 'Parquet compression codec')
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.indir, '*.root')))
+    print('Converting %d files' % len(files))
+    for tree in args.tree.split(','):
+        parts, entries = convert(files, tree, args.outdir, rows_per_file = args.rows_per_file,
+                                 row_group_size = args.row_group_size, compression = args.compression)
+        size = sum(os.path.getsize(p) for p in parts)
+        print('%s: %d candidates in %d files, %.1f MB' % (tree, entries, len(parts), size / 1e6))
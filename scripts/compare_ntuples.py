@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# Check that two versions of a selection keep the same candidates
+#
+# Candidates are matched by event and by the values of all columns the two
+# ntuples have in common (rounded to --digits), ignoring the candidate
+# bookkeeping columns which change with the list sizes. Run both steering
+# scripts on the same reference mdst and compare:
+#
+#   ./compare_ntuples.py old.root --new new.root --tree good
+import argparse
+import sys
+from collections import Counter
+
+import uproot
+
+BOOKKEEPING = ['__candidate__', '__ncandidates__', '__weight__']
+
+def read_rows(paths, tree, columns, digits):
+    """
+    Return a Counter of the rounded candidate rows in the given files.
+    """
+    rows = Counter()
+    for path in paths:
+        arrays = uproot.open(path)[tree].arrays(columns, library = 'np')
+        values = [arrays[c].round(digits) if arrays[c].dtype.kind == 'f' else arrays[c] for c in columns]
+        rows.update(zip(*[v.tolist() for v in values]))
+    return rows
+
+def common_columns(path_a, path_b, tree):
+    a = set(uproot.open(path_a)[tree].keys())
+    b = set(uproot.open(path_b)[tree].keys())
+    return sorted((a & b) - set(BOOKKEEPING))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compare the candidates of two ntuples')
+    parser.add_argument('old', nargs = '+', help = 'ntuple(s) of the reference selection, then --new')
+    parser.add_argument('--new', nargs = '+', required = True, help = 'ntuple(s) of the new selection')
+    parser.add_argument('--tree', default = 'good', help = 'tree name')
+    parser.add_argument('--digits', type = int, default = 5, help = 'decimals kept when comparing floats')
+    args = parser.parse_args()
+
+    columns = common_columns(args.old[0], args.new[0], args.tree)
+    old = read_rows(args.old, args.tree, columns, args.digits)
+    new = read_rows(args.new, args.tree, columns, args.digits)
+    only_old = old - new
+    only_new = new - old
+    print('Compared %d columns' % len(columns))
+    print('old: %d candidates, new: %d candidates' % (sum(old.values()), sum(new.values())))
+    print('only in old: %d, only in new: %d' % (sum(only_old.values()), sum(only_new.values())))
+    for label, rows in [('old', only_old), ('new', only_new)]:
+        for row in list(rows)[:5]:
+            print(f'  only in {label}:', dict(zip(columns, row)))
+    sys.exit(0 if not only_old and not only_new else 1)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# Cut-flow instrumentation of the reconstruction path
+#
+# Each reconstruction stage of a steering script is wrapped like
+#
+#   cf = cutflow.CutFlow(output_file)
+#   with cf.stage('Sigma+:loose', mp, out = 'Sigma+:loose', inputs = ['p+:berger', 'pi0:loose'], combine = True):
+#       ma.reconstructDecay('Sigma+:loose -> p+:berger pi0:loose', '...', path = mp)
+#   ...
+#   cf.finish(mp)
+#
+# which puts small Python modules before and after the stage counting the
+# candidates going in and out and the time spent in between. The counts are
+# written next to the output file as <output>.cutflow.json and can be merged
+# over a campaign with
+#
+#   ./cutflow.py ../data/v7
+import argparse
+import glob
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import basf2 as b2
+    from ROOT import Belle2
+except ImportError:
+    # Merging the side-car files does not need basf2
+    b2 = None
+
+def list_size(name):
+    """
+    Return the number of candidates in a particle list of the current event.
+    """
+    plist = Belle2.PyStoreObj(name)
+    return plist.obj().getListSize() if plist.isValid() else 0
+
+def new_counters():
+    return OrderedDict(events = 0, events_out = 0, cand_in = 0, cand_out = 0, time = 0.0)
+
+class CutFlow:
+    """
+    Candidate counts and timing of the stages of one reconstruction path.
+    """
+    def __init__(self, output_file):
+        self.path = output_file + '.cutflow.json'
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, name, path, out, inputs = None, combine = False):
+        """
+        Count the candidates around the modules added to path inside the block.
+
+        The candidates in are the sizes of the inputs lists (default: out itself,
+        for stages working in place), multiplied when combine is True to get
+        the number of combinations a combiner has to try. With out None the
+        stage counts events: the modules inside it drop events, and an event is
+        out if it reaches the end of the stage.
+        """
+        counters = self.stages.setdefault(name, new_counters())
+        begin = StageBegin(counters, None if out is None else inputs or [out], combine)
+        path.add_module(begin)
+        yield
+        path.add_module(StageEnd(counters, begin, out))
+
+    def finish(self, path):
+        """
+        Add the module writing the side-car file at the end of the job.
+        """
+        path.add_module(CutFlowWriter(self))
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(dict(stages = self.stages), f, indent = 1)
+
+if b2 is not None:
+    class StageBegin(b2.Module):
+        """
+        Count the candidates going into a stage and start its clock.
+        """
+        def __init__(self, counters, inputs, combine):
+            super().__init__()
+            self.counters = counters
+            self.inputs = inputs
+            self.combine = combine
+            self.start = 0.0
+
+        def event(self):
+            sizes = [1] if self.inputs is None else [list_size(name) for name in self.inputs]
+            if self.combine:
+                n = 1
+                for size in sizes:
+                    n *= size
+            else:
+                n = sum(sizes)
+            self.counters['events'] += 1
+            self.counters['cand_in'] += n
+            self.start = time.perf_counter()
+
+    class StageEnd(b2.Module):
+        """
+        Count the candidates coming out of a stage and stop its clock.
+        """
+        def __init__(self, counters, begin, out):
+            super().__init__()
+            self.counters = counters
+            self.begin = begin
+            self.out = out
+
+        def event(self):
+            self.counters['time'] += time.perf_counter() - self.begin.start
+            # An event stage only gets here for the events its modules keep
+            n = 1 if self.out is None else list_size(self.out)
+            self.counters['cand_out'] += n
+            self.counters['events_out'] += n > 0
+
+    class CutFlowWriter(b2.Module):
+        """
+        Write the cut flow of the job when it ends.
+        """
+        def __init__(self, cutflow):
+            super().__init__()
+            self.cutflow = cutflow
+
+        def terminate(self):
+            self.cutflow.save()
+
+def merge(paths):
+    """
+    Sum the stages of several side-car files, keeping the stage order.
+    """
+    stages = OrderedDict()
+    for path in paths:
+        try:
+            with open(path) as f:
+                data = json.load(f, object_pairs_hook = OrderedDict)
+        except (OSError, ValueError):
+            print(f'[cutflow] Cannot read {path}, skipped')
+            continue
+        for name, counters in data['stages'].items():
+            total = stages.setdefault(name, new_counters())
+            for key, value in counters.items():
+                total[key] += value
+    return stages
+
+def print_cutflow(stages):
+    """
+    Print the merged cut flow as a table.
+    """
+    header = '%-24s %10s %14s %14s %10s %9s %10s' % ('Stage', 'Events', 'Cand in', 'Cand out',
+                                                  'Out/event', 'Pass', 'ms/event')
+    print(header)
+    print('=' * len(header))
+    for name, c in stages.items():
+        events = max(c['events'], 1)
+        print('%-24s %10d %14d %14d %10.2f %9.1f%% %10.3f' %
+              (name, c['events'], c['cand_in'], c['cand_out'], c['cand_out'] / events,
+               100 * c['events_out'] / events, 1000 * c['time'] / events))
+
+def print_gate(stages, name = 'event gate'):
+    """
+    Print the pass rate of the event gate and the time it saves.
+
+    The events it drops would have cost the time per event of the stages after it.
+    """
+    if name not in stages:
+        return
+    names = list(stages)
+    gate = stages[name]
+    dropped = gate['events'] - gate['events_out']
+    after = sum(1000 * c['time'] / max(c['events'], 1) for c in list(stages.values())[names.index(name) + 1:])
+    print('%s: %.1f%% of %d events pass, saving ~%.1f s (%.3f ms per dropped event)' %
+          (name, 100 * gate['events_out'] / max(gate['events'], 1), gate['events'],
+           dropped * after / 1000, after))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Merge the cut flows of a campaign')
+    parser.add_argument('outdir', help = 'output dir with the *.cutflow.json files')
+    parser.add_argument('--json', default = None, help = 'write the merged cut flow to this file')
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.outdir, '*.cutflow.json')))
+    print('Merging %d cut flows' % len(files))
+    stages = merge(files)
+    print_cutflow(stages)
+    print_gate(stages)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(dict(files = len(files), stages = stages), f, indent = 1)
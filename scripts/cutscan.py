@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# Evaluate many cut configurations on the loose ntuples at once
+#
+# Each configuration is a where expression of ntuple.py. The candidates are
+# read once, file by file in a process pool; in every chunk each distinct
+# predicate is evaluated once and the configurations only combine the masks,
+# counting the signal (isSignal == 1) and background candidates they keep.
+# The report gives S, B, the signal efficiency and S/sqrt(B) of every
+# configuration:
+#
+#   ./cutscan.py ../data/lambdac.parquet --tree lambda_c \
+#       --cut 'M >= 2.24 and M <= 2.34' \
+#       --scan 'sigma_Sigma_mva >' 0.1 0.5 0.1 --scan 'M >=' 2.22 2.26 0.01
+#
+# scans the product of the --scan thresholds on top of the --cut expressions.
+# --model scores the candidates with a weightfile of mva.py first, so cuts
+# on the new score (column mva) need no basf2 rerun. With a sample_weight
+# column (sampling.py) the counts are weighted.
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+
+import numpy as np
+
+import ntuple
+
+SIGNAL = 'isSignal'
+WEIGHT = 'sample_weight'
+
+def frange(start, stop, step):
+    """
+    Return the values from start to stop (included) in steps.
+    """
+    n = int(round((stop - start) / step)) + 1
+    return [round(start + i * step, 10) for i in range(n)]
+
+def grid(base, scans):
+    """
+    Return named configurations for all combinations of the scanned thresholds.
+
+    scans is a list of ('column op', values).
+    """
+    configs = {}
+    for values in itertools.product(*[v for _, v in scans]):
+        terms = [f'{prefix} {value}' for (prefix, _), value in zip(scans, values)]
+        configs[' and '.join(terms) or 'all'] = ' and '.join(base + terms)
+    return configs
+
+class Scan:
+    """
+    Signal and background counts of several cut configurations.
+    """
+    def __init__(self, configs, model = None):
+        self.configs = configs
+        self.preds = {name: ntuple.parse_where(where) for name, where in configs.items()}
+        self.model = model
+        self.signal = np.zeros(len(configs))
+        self.background = np.zeros(len(configs))
+        self.total_signal = 0.0
+        self.total_background = 0.0
+
+    def columns(self, available):
+        needed = {SIGNAL} | {p[0] for preds in self.preds.values() for p in preds}
+        needed.discard('mva')
+        if self.model is not None:
+            needed.update(self.model.names)
+        if WEIGHT in available:
+            needed.add(WEIGHT)
+        return sorted(needed)
+
+    def fill(self, arrays):
+        if self.model is not None:
+            arrays['mva'] = self.model.predict(arrays)
+        n = len(arrays[SIGNAL])
+        weight = np.asarray(arrays[WEIGHT], np.float64) if WEIGHT in arrays else np.ones(n)
+        signal = np.asarray(arrays[SIGNAL]) == 1
+        ws = np.where(signal, weight, 0.0)
+        wb = np.where(signal, 0.0, weight)
+        self.total_signal += ws.sum()
+        self.total_background += wb.sum()
+        cache = {}
+        for i, preds in enumerate(self.preds.values()):
+            mask = np.ones(n, bool)
+            for pred in preds:
+                if pred not in cache:
+                    column, op, value = pred
+                    cache[pred] = ntuple.OPS[op](arrays[column], value)
+                mask &= cache[pred]
+            self.signal[i] += ws @ mask
+            self.background[i] += wb @ mask
+
+    def __iadd__(self, other):
+        self.signal += other.signal
+        self.background += other.background
+        self.total_signal += other.total_signal
+        self.total_background += other.total_background
+        return self
+
+    def report(self):
+        rows = []
+        for i, (name, where) in enumerate(self.configs.items()):
+            s, b = self.signal[i], self.background[i]
+            rows.append(dict(config = name, where = where, signal = s, background = b,
+                             efficiency = s / self.total_signal if self.total_signal else None,
+                             background_efficiency = b / self.total_background if self.total_background else None,
+                             significance = s / np.sqrt(b) if b > 0 else None))
+        return rows
+
+def scan_part(args):
+    source, tree, configs, model_path = args
+    model = None
+    if model_path is not None:
+        import mva
+        model = mva.load(model_path)
+    scan = Scan(configs, model)
+    nt = ntuple.Ntuple(source, tree, nthreads = 1)
+    for chunk in nt.iterate(scan.columns(nt.columns())):
+        scan.fill(chunk)
+    return scan
+
+def run(source, tree, configs, model_path = None, nworkers = None):
+    """
+    Scan all configurations over the files of source, one file per worker.
+    """
+    nt = ntuple.Ntuple(source, tree)
+    scan = Scan(configs)
+    with mp.Pool(nworkers) as pool:
+        for part in pool.imap_unordered(scan_part, [(p, tree, configs, model_path) for p in nt.parts()]):
+            scan += part
+    return scan
+
+def print_report(rows, top = 20):
+    header = '%-50s %12s %12s %8s %8s %9s' % ('Configuration', 'S', 'B', 'Eff', 'B eff', 'S/sqrt(B)')
+    print(header)
+    print('=' * len(header))
+    for row in rows[:top]:
+        print('%-50s %12.1f %12.1f %8s %8s %9s' % (
+            row['config'][:50], row['signal'], row['background'],
+            '-' if row['efficiency'] is None else '%.3f' % row['efficiency'],
+            '-' if row['background_efficiency'] is None else '%.4f' % row['background_efficiency'],
+            '-' if row['significance'] is None else '%.2f' % row['significance']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Evaluate many cut configurations in one pass')
+    parser.add_argument('source', help = 'dir of ROOT files or Parquet dataset')
+    parser.add_argument('--tree', default = 'good', help = 'tree name')
+    parser.add_argument('--cut', action = 'append', default = [], help = 'cut applied to all configurations')
+    parser.add_argument('--scan', nargs = 4, action = 'append', default = [],
+                        metavar = ('"COLUMN OP"', 'START', 'STOP', 'STEP'), help = 'threshold to scan')
+    parser.add_argument('--config', default = None, help = 'JSON file with name -> where configurations')
+    parser.add_argument('--model', default = None, help = 'mva.py weightfile scoring the column mva')
+    parser.add_argument('--nworkers', type = int, default = None, help = 'number of processes')
+    parser.add_argument('--top', type = int, default = 20, help = 'number of configurations printed')
+    parser.add_argument('--json', default = None, help = 'write all results to this file')
+    args = parser.parse_args()
+
+    if args.config is not None:
+        with open(args.config) as f:
+            configs = json.load(f)
+    else:
+        scans = [(prefix, frange(float(a), float(b), float(c))) for prefix, a, b, c in args.scan]
+        configs = grid(args.cut, scans)
+    print('Scanning %d configurations' % len(configs))
+    scan = run(args.source, args.tree, configs, args.model, args.nworkers)
+    rows = sorted(scan.report(), key = lambda row: -(row['significance'] or 0))
+    print('Total: S = %.1f, B = %.1f' % (scan.total_signal, scan.total_background))
+    print_report(rows, args.top)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent = 1)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# Standard Sigma+/pi0/gamma histograms in one pass over the ntuples
+#
+# Every histogram of SPECS is filled for every selection of MASKS while the
+# campaign is read once, chunk by chunk: each column is binned once per
+# chunk and the bin indices are counted once per mask. Histogram books of
+# several files or processes add up, and are saved as .npz so the notebook
+# only renders them:
+#
+#   ./histograms.py ../data/v6 --tree good --out ../data/v6_hists.npz
+#
+#   book = histograms.HistBook.load('../data/v6_hists.npz')
+#   histograms.plot(book, 'pi0_M', masks = ['all', 'pi0_isSignal == 1'])
+import argparse
+import json
+import multiprocessing as mp
+
+import numpy as np
+
+import ntuple
+
+# name -> (columns, bins, ranges); two columns make a 2D histogram (x, y)
+SPECS = {
+    'M': (['M'], [200], [(1.17, 1.21)]),
+    'pi0_M': (['pi0_M'], [200], [(0.11, 0.16)]),
+    'pi0_p': (['pi0_p'], [200], [(0.0, 1.0)]),
+    'gamma1_E': (['gamma1_E'], [200], [(0.0, 0.5)]),
+    'distance': (['distance'], [200], [(0.0, 3.0)]),
+    'significanceOfDistance': (['significanceOfDistance'], [200], [(0.0, 20.0)]),
+    'significance_vs_distance': (['significanceOfDistance', 'distance'], [100, 100], [(0.0, 10.0), (0.0, 2.0)]),
+}
+
+# name -> where predicate of ntuple.py (None: all candidates)
+MASKS = {
+    'all': None,
+    'cosa > 0': 'cosa > 0',
+    'pi0_isSignal == 1': 'pi0_isSignal == 1',
+    'isSignal == 1': 'isSignal == 1',
+}
+
+def bin_index(values, bins, lo, hi):
+    """
+    Return the bin of each value (right edge included, like np.histogram) and
+    whether it is inside the range.
+    """
+    scaled = (values - lo) * (bins / (hi - lo))
+    inside = (scaled >= 0) & (scaled <= bins)
+    index = np.where(inside, scaled, 0).astype(np.int64)
+    index[index == bins] = bins - 1
+    return index, inside
+
+class HistBook:
+    """
+    Histograms of SPECS for every selection of MASKS.
+    """
+    def __init__(self, specs = SPECS, masks = MASKS):
+        self.specs = specs
+        self.masks = masks
+        self.entries = 0
+        self.counts = {(name, mask): np.zeros(bins) for name, (_, bins, _) in specs.items() for mask in masks}
+
+    def columns(self):
+        """
+        Return the columns needed to fill the book.
+        """
+        needed = {c for columns, _, _ in self.specs.values() for c in columns}
+        for where in self.masks.values():
+            needed.update(p[0] for p in ntuple.parse_where(where))
+        return sorted(needed)
+
+    def fill(self, arrays):
+        """
+        Add one chunk of candidates.
+        """
+        n = len(next(iter(arrays.values())))
+        self.entries += n
+        masks = {}
+        for mask, where in self.masks.items():
+            preds = ntuple.parse_where(where)
+            masks[mask] = ntuple.select(arrays, preds) if preds else np.ones(n, bool)
+        for name, (columns, bins, ranges) in self.specs.items():
+            flat = np.zeros(n, np.int64)
+            inside = np.ones(n, bool)
+            for column, nbins, (lo, hi) in zip(columns, bins, ranges):
+                index, ok = bin_index(arrays[column], nbins, lo, hi)
+                flat = flat * nbins + index
+                inside &= ok
+            size = int(np.prod(bins))
+            for mask, selected in masks.items():
+                counts = np.bincount(flat[inside & selected], minlength = size)
+                self.counts[name, mask] += counts.reshape(bins)
+
+    def fill_ntuple(self, nt):
+        """
+        Fill the book from an ntuple.Ntuple in one pass.
+        """
+        for chunk in nt.iterate(self.columns()):
+            self.fill(chunk)
+        return self
+
+    def __iadd__(self, other):
+        for key, counts in other.counts.items():
+            self.counts[key] += counts
+        self.entries += other.entries
+        return self
+
+    def edges(self, name):
+        _, bins, ranges = self.specs[name]
+        return [np.linspace(lo, hi, b + 1) for b, (lo, hi) in zip(bins, ranges)]
+
+    def save(self, path):
+        meta = dict(specs = self.specs, masks = self.masks, entries = self.entries)
+        arrays = {f'{i}': self.counts[key] for i, key in enumerate(self.counts)}
+        arrays['keys'] = np.array(json.dumps([list(key) for key in self.counts]))
+        arrays['meta'] = np.array(json.dumps(meta))
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            specs = {name: (columns, bins, [tuple(r) for r in ranges])
+                     for name, (columns, bins, ranges) in meta['specs'].items()}
+            book = cls(specs, meta['masks'])
+            book.entries = meta['entries']
+            for i, key in enumerate(json.loads(str(data['keys']))):
+                book.counts[tuple(key)] = data[f'{i}']
+        return book
+
+def fill_file(args):
+    path, tree = args
+    book = HistBook()
+    return book.fill_ntuple(ntuple.Ntuple([path], tree, nthreads = 1))
+
+def fill_files(paths, tree = 'good', nworkers = None):
+    """
+    Fill the default book from ROOT files, one file per worker process.
+    """
+    book = HistBook()
+    with mp.Pool(nworkers) as pool:
+        for part in pool.imap_unordered(fill_file, [(path, tree) for path in paths]):
+            book += part
+    return book
+
+def plot(book, name, masks = None, ax = None, density = False):
+    """
+    Draw one histogram of the book for the given masks (default all).
+    """
+    import matplotlib.pyplot as plt
+    ax = ax or plt.gca()
+    columns = book.specs[name][0]
+    edges = book.edges(name)
+    for mask in masks or list(book.masks):
+        counts = book.counts[name, mask]
+        if len(columns) == 2:
+            ax.pcolormesh(edges[0], edges[1], counts.T)
+            ax.set_ylabel(columns[1])
+            ax.set_title(mask)
+            break
+        if density and counts.sum() > 0:
+            counts = counts / counts.sum() / np.diff(edges[0])
+        ax.stairs(counts, edges[0], label = mask)
+    ax.set_xlabel(columns[0])
+    if len(columns) == 1:
+        ax.legend()
+    return ax
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Fill the standard histograms of a campaign')
+    parser.add_argument('source', help = 'output dir with the ROOT files, or a merge.py dataset')
+    parser.add_argument('--tree', default = 'good', help = 'tree name')
+    parser.add_argument('--out', required = True, help = 'histogram file (.npz) to write')
+    parser.add_argument('--nworkers', type = int, default = None, help = 'number of processes (ROOT files)')
+    args = parser.parse_args()
+
+    nt = ntuple.Ntuple(args.source, args.tree)
+    if nt.parquet:
+        book = HistBook().fill_ntuple(nt)
+    else:
+        book = fill_files(nt.files, args.tree, args.nworkers)
+    book.save(args.out)
+    print('Filled %d histograms x %d masks from %d candidates' % (len(book.specs), len(book.masks), book.entries))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Parse the log files written by the basf2 jobs
+#
+# A log holds the output of the steering script, which ends with the
+# b2.statistics table, and for LSF jobs the job report appended by LSF:
+#
+#   Successfully completed.            (or: Exited with exit code 139.)
+#   Resource usage summary:
+#       CPU time :     123.45 sec.
+#       Max Memory :   512 MB
+#
+# The elements of a job array get their report in a file of their own,
+# jobs/<array name>.<index>.log, which is read together with the log.
+import os
+import re
+
+STATISTICS_HEADER = re.compile(r'^Name\s*\|\s*Calls\s*\|')
+STATISTICS_ROW = re.compile(r'^\s*(\S.*?)\s*\|\s*(\d+)\s*\|\s*(-?[\d.]+)\s*\|\s*([\d.]+)\s*\|'
+                            r'\s*([\d.]+)\s*\+-\s*([\d.]+)\s*$')
+EXIT_CODE = re.compile(r'Exited with exit code (\d+)')
+CPU_TIME = re.compile(r'CPU time\s*:\s*([\d.]+) sec')
+MAX_MEMORY = re.compile(r'Max Memory\s*:\s*([\d.]+) MB')
+EXEC_HOST = re.compile(r'Job was executed on host\(s\) <(?:\d+\*)?([^>]+)>')
+FATAL_MARKERS = ['[FATAL]', 'Segmentation violation', 'segmentation violation',
+                 'TERM_MEMLIMIT', 'TERM_RUNLIMIT', '[LocalRunner] Killed']
+
+def parse_statistics(text):
+    """
+    Return the rows of the last b2.statistics table in text.
+
+    Every row is a dict with name, calls, memory (MB), time (s) and the mean
+    and spread of the time per call (ms). The Total row is included.
+    """
+    tables = []
+    rows = None
+    for line in text.splitlines():
+        if STATISTICS_HEADER.match(line):
+            rows = []
+            tables.append(rows)
+            continue
+        if rows is None:
+            continue
+        match = STATISTICS_ROW.match(line)
+        if match is not None:
+            name, calls, memory, seconds, per_call, per_call_err = match.groups()
+            rows.append(dict(name = name, calls = int(calls), memory = float(memory),
+                             time = float(seconds), time_per_call = float(per_call),
+                             time_per_call_err = float(per_call_err)))
+            if name == 'Total':
+                rows = None
+    return tables[-1] if tables else []
+
+def parse_log(path, report = None):
+    """
+    Return a summary of one job log.
+
+    status is 'done', 'failed' or 'running' (no end of job found yet). events
+    and time come from the Total row of the statistics, cpu_time and
+    max_memory from the LSF report when present. report is the file LSF
+    writes the report of an array element to, read after the log unless it
+    is older than the log (left over from an earlier submission).
+    """
+    with open(path, errors = 'replace') as f:
+        text = f.read()
+    if report is not None and os.path.exists(report) and os.path.getmtime(report) >= os.path.getmtime(path):
+        with open(report, errors = 'replace') as f:
+            text += '\n' + f.read()
+    summary = dict(path = path, status = 'running', exit_code = None, events = None,
+                   time = None, events_per_second = None, cpu_time = None,
+                   max_memory = None, host = None, modules = parse_statistics(text))
+    total = [row for row in summary['modules'] if row['name'] == 'Total']
+    if total:
+        summary['events'] = total[0]['calls']
+        summary['time'] = total[0]['time']
+        if total[0]['time'] > 0:
+            summary['events_per_second'] = total[0]['calls'] / total[0]['time']
+    match = EXIT_CODE.search(text)
+    if match is not None:
+        summary['exit_code'] = int(match.group(1))
+    elif 'Successfully completed.' in text:
+        summary['exit_code'] = 0
+    match = CPU_TIME.search(text)
+    if match is not None:
+        summary['cpu_time'] = float(match.group(1))
+    match = MAX_MEMORY.search(text)
+    if match is not None:
+        summary['max_memory'] = float(match.group(1))
+    match = EXEC_HOST.search(text)
+    if match is not None:
+        summary['host'] = match.group(1)
+
+    if summary['exit_code'] not in (None, 0) or any(m in text for m in FATAL_MARKERS):
+        summary['status'] = 'failed'
+    elif summary['exit_code'] == 0 or total:
+        summary['status'] = 'done'
+    return summary
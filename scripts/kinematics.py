@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+# Batched kinematics of the candidates from their daughter four-vectors
+#
+# With four_vectors = True in a configuration of reconstruction.py the
+# ntuples carry px, py, pz and E of the daughters (sigma_*, pi_plus_* and
+# pi_minus_* for Lambda_c+ -> Sigma+ pi+ pi-, p_* and pi0_* for
+# Sigma+ -> p+ pi0; float32 after columnar.py). Invariant masses, Dalitz
+# variables, helicity angles and mass hypotheses can then be changed
+# offline, for all candidates at once:
+#
+#   arrays = nt.iterate(kinematics.columns(['sigma', 'pi_plus', 'pi_minus']))
+#   sigma, pip, pim = (kinematics.four_vector(arrays, d) for d in ['sigma', 'pi_plus', 'pi_minus'])
+#   d = kinematics.dalitz(kinematics.with_mass(sigma, SIGMA_MASS), pip, pim)
+#
+# Four-vectors are (n, 4) float64 arrays (px, py, pz, E); the products are
+# taken in double precision. Check against the basf2 Dalitz columns and
+# time against a plain Python loop with
+#
+#   ./kinematics.py ../data/lambdac --tree lambda_c
+#   ./kinematics.py --benchmark 1000000
+import argparse
+import math
+import time
+
+import numpy as np
+
+from reconstruction import FOUR_VECTOR as COMPONENTS
+
+def columns(prefixes):
+    """
+    Return the four-vector columns of the daughters with the given prefixes.
+    """
+    return [f'{prefix}_{c}' for prefix in prefixes for c in COMPONENTS]
+
+def four_vector(arrays, prefix):
+    """
+    Return the (n, 4) four-vectors of one daughter from the ntuple columns.
+    """
+    return np.stack([np.asarray(arrays[f'{prefix}_{c}'], np.float64) for c in COMPONENTS], axis = -1)
+
+def mass2(*p):
+    """
+    Return the squared invariant mass of the sum of the four-vectors.
+    """
+    total = p[0]
+    for q in p[1:]:
+        total = total + q
+    return total[..., 3] ** 2 - np.einsum('...i,...i->...', total[..., :3], total[..., :3])
+
+def mass(*p):
+    """
+    Return the invariant mass of the sum of the four-vectors (negative m^2 gives 0).
+    """
+    return np.sqrt(np.maximum(mass2(*p), 0.0))
+
+def with_mass(p, m):
+    """
+    Return the four-vectors with the same momentum and the mass m (a new mass hypothesis).
+    """
+    q = np.array(p, np.float64)
+    q[..., 3] = np.sqrt(np.einsum('...i,...i->...', q[..., :3], q[..., :3]) + np.square(m))
+    return q
+
+def boost(p, frame):
+    """
+    Return the four-vectors p in the rest frame of the four-vectors frame.
+    """
+    beta = frame[..., :3] / frame[..., 3:]
+    b2 = np.einsum('...i,...i->...', beta, beta)
+    gamma = 1.0 / np.sqrt(1.0 - b2)
+    bp = np.einsum('...i,...i->...', beta, p[..., :3])
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        g2 = np.where(b2 > 0, (gamma - 1.0) / b2, 0.0)
+    q = np.empty(np.broadcast_shapes(p.shape, frame.shape))
+    q[..., :3] = p[..., :3] + (g2 * bp - gamma * p[..., 3])[..., None] * beta
+    q[..., 3] = gamma * (p[..., 3] - bp)
+    return q
+
+def unboost(p, frame):
+    """
+    Return the four-vectors p, given in the rest frame of frame, in the frame frame is given in.
+    """
+    return boost(p, frame * np.array([-1.0, -1.0, -1.0, 1.0]))
+
+def cos_angle(a, b):
+    """
+    Return the cosine of the angle between the momenta of a and b.
+    """
+    dot = np.einsum('...i,...i->...', a[..., :3], b[..., :3])
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return dot / np.sqrt(np.einsum('...i,...i->...', a[..., :3], a[..., :3]) *
+                             np.einsum('...i,...i->...', b[..., :3], b[..., :3]))
+
+def helicity(a, b, mother):
+    """
+    Return cos(theta) of a in the rest frame of the resonance a + b, with
+    respect to the flight direction of the resonance in the mother frame.
+    """
+    resonance = a + b
+    # In the resonance frame the mother moves against the resonance direction
+    return -cos_angle(boost(a, resonance), boost(mother, resonance))
+
+def dalitz(sigma, pi_plus, pi_minus):
+    """
+    Return the Dalitz variables of Lambda_c+ -> Sigma+ pi+ pi- as in the ntuple.
+    """
+    return dict(m_sigma_pi_plus = mass(sigma, pi_plus),
+                m_sigma_pi_minus = mass(sigma, pi_minus),
+                m_pi_pi = mass(pi_plus, pi_minus))
+
+def lambdac(arrays, sigma_mass = None):
+    """
+    Return the recomputed Lambda_c+ variables of a chunk of the lambda_c tree.
+
+    With sigma_mass the Sigma+ four-vector gets the nominal mass first, as
+    the Sigma+ mass constraint of the Lambda_c+ fit would give.
+    """
+    sigma, pi_plus, pi_minus = (four_vector(arrays, d) for d in ['sigma', 'pi_plus', 'pi_minus'])
+    if sigma_mass is not None:
+        sigma = with_mass(sigma, sigma_mass)
+    lambda_c = sigma + pi_plus + pi_minus
+    result = dalitz(sigma, pi_plus, pi_minus)
+    result['M'] = mass(lambda_c)
+    result['cos_helicity_pi_pi'] = helicity(pi_plus, pi_minus, lambda_c)
+    result['cos_helicity_sigma_pi'] = helicity(sigma, pi_plus, lambda_c)
+    return result
+
+def lambdac_loop(arrays, sigma_mass = None):
+    """
+    lambdac() one candidate at a time, the reference for the benchmark.
+    """
+    def m(*vectors):
+        e = sum(v[3] for v in vectors)
+        px, py, pz = (sum(v[i] for v in vectors) for i in range(3))
+        return math.sqrt(max(e * e - px * px - py * py - pz * pz, 0.0))
+
+    def to_frame(v, f):
+        bx, by, bz = f[0] / f[3], f[1] / f[3], f[2] / f[3]
+        b2 = bx * bx + by * by + bz * bz
+        g = 1.0 / math.sqrt(1.0 - b2)
+        bp = bx * v[0] + by * v[1] + bz * v[2]
+        g2 = (g - 1.0) / b2 if b2 > 0 else 0.0
+        k = g2 * bp - g * v[3]
+        return (v[0] + k * bx, v[1] + k * by, v[2] + k * bz, g * (v[3] - bp))
+
+    def hel(a, b, mother):
+        r = tuple(x + y for x, y in zip(a, b))
+        a, mother = to_frame(a, r), to_frame(mother, r)
+        dot = a[0] * mother[0] + a[1] * mother[1] + a[2] * mother[2]
+        na = math.sqrt(a[0] ** 2 + a[1] ** 2 + a[2] ** 2)
+        nm = math.sqrt(mother[0] ** 2 + mother[1] ** 2 + mother[2] ** 2)
+        return -dot / (na * nm)
+
+    n = len(arrays['sigma_E'])
+    result = {name: np.empty(n) for name in ['m_sigma_pi_plus', 'm_sigma_pi_minus', 'm_pi_pi', 'M',
+                                              'cos_helicity_pi_pi', 'cos_helicity_sigma_pi']}
+    for i in range(n):
+        s, pp, pm = (tuple(float(arrays[f'{d}_{c}'][i]) for c in COMPONENTS)
+                     for d in ['sigma', 'pi_plus', 'pi_minus'])
+        if sigma_mass is not None:
+            s = s[:3] + (math.sqrt(s[0] ** 2 + s[1] ** 2 + s[2] ** 2 + sigma_mass ** 2),)
+        lc = tuple(a + b + c for a, b, c in zip(s, pp, pm))
+        result['m_sigma_pi_plus'][i] = m(s, pp)
+        result['m_sigma_pi_minus'][i] = m(s, pm)
+        result['m_pi_pi'][i] = m(pp, pm)
+        result['M'][i] = m(lc)
+        result['cos_helicity_pi_pi'][i] = hel(pp, pm, lc)
+        result['cos_helicity_sigma_pi'][i] = hel(s, pp, lc)
+    return result
+
+def benchmark(n, loop_n = 100000, seed = 0):
+    """
+    Time lambdac() against lambdac_loop() on n random candidates and check they agree.
+    """
+    import synthetic
+    rng = np.random.default_rng(seed)
+    arrays = synthetic.lambdac_four_vectors(rng.uniform(2.24, 2.34, n), rng)
+    arrays = {name: values.astype(np.float32) for name, values in arrays.items()}
+    start = time.perf_counter()
+    fast = lambdac(arrays)
+    fast_seconds = time.perf_counter() - start
+    loop_n = min(loop_n, n)
+    start = time.perf_counter()
+    slow = lambdac_loop({name: values[:loop_n] for name, values in arrays.items()})
+    slow_seconds = time.perf_counter() - start
+    diff = max(float(np.nanmax(np.abs(fast[name][:loop_n] - slow[name]))) for name in slow)
+    print('NumPy: %d candidates in %.3f s (%.2e candidates/s)' % (n, fast_seconds, n / fast_seconds))
+    print('Loop:  %d candidates in %.3f s (%.2e candidates/s)' % (loop_n, slow_seconds, loop_n / slow_seconds))
+    print('Speed-up %.0fx, largest difference %.2e' % ((n / fast_seconds) / (loop_n / slow_seconds), diff))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Recompute the Lambda_c+ kinematics from the daughter four-vectors')
+    parser.add_argument('source', nargs = '?', help = 'dir of ROOT files or Parquet dataset')
+    parser.add_argument('--tree', default = 'lambda_c', help = 'tree name')
+    parser.add_argument('--benchmark', type = int, default = None, metavar = 'N',
+                        help = 'time N random candidates against a Python loop')
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        benchmark(args.benchmark)
+        exit(0)
+    if args.source is None:
+        parser.error('give a source or --benchmark')
+
+    import ntuple
+    nt = ntuple.Ntuple(args.source, args.tree)
+    stored = ['m_sigma_pi_plus', 'm_sigma_pi_minus', 'm_pi_pi']
+    n, diff = 0, {name: 0.0 for name in stored}
+    start = time.perf_counter()
+    for chunk in nt.iterate(columns(['sigma', 'pi_plus', 'pi_minus']) + stored):
+        result = lambdac(chunk)
+        n += len(chunk['sigma_E'])
+        for name in stored:
+            diff[name] = max(diff[name], float(np.nanmax(np.abs(result[name] - chunk[name]), initial = 0.0)))
+    seconds = time.perf_counter() - start
+    print('Recomputed %d candidates in %.2f s (%.2e candidates/s including reading)' % (n, seconds, n / seconds))
+    for name in stored:
+        print('  %-18s largest difference to the ntuple %.2e GeV' % (name, diff[name]))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# Submission ledger kept next to the outputs
+#
+# Every state change of an mdst file is appended as one JSON line to
+# outdir/ledger.jsonl. Entries are keyed by the mdst path and a hash of the
+# steering script and basf2 options, so a changed script is never mistaken
+# for a finished one. Replaying the file gives the latest state per file.
+import hashlib
+import json
+import os
+import time
+
+import batch
+import joblog
+
+SUBMITTED = 'submitted'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+STATES = [SUBMITTED, RUNNING, DONE, FAILED]
+
+def steering_key(script, b2opt = '', command = ''):
+    """
+    Return a short hash of the steering script content, the basf2 options and
+    the command template.
+    """
+    h = hashlib.sha1()
+    with open(script, 'rb') as f:
+        h.update(f.read())
+    h.update(b'\0' + b2opt.encode())
+    h.update(b'\0' + command.encode())
+    return h.hexdigest()[:12]
+
+def disk_state(rootpath, logpath, report = None):
+    """
+    Guess the state of one file from its output and log (and LSF report) on disk.
+
+    Returns None if neither file exists yet.
+    """
+    if not os.path.exists(logpath):
+        return RUNNING if os.path.exists(rootpath) else None
+    status = joblog.parse_log(logpath, report)['status']
+    if status == 'done' and not (os.path.exists(rootpath) and os.path.getsize(rootpath) > 0):
+        return FAILED
+    return {'done': DONE, 'failed': FAILED, 'running': RUNNING}[status]
+
+class Ledger:
+    """
+    Append-only JSON lines ledger of the submitted mdst files.
+    """
+    def __init__(self, outdir, key, name = 'ledger.jsonl'):
+        self.path = os.path.join(outdir, name)
+        self.key = key
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """
+        Replay the ledger file and keep the latest entry per mdst file.
+        """
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a killed submission
+                    continue
+                if entry.get('key') == self.key:
+                    self.entries[entry['mdst']] = entry
+
+    def ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def state(self, mdst):
+        entry = self.entries.get(mdst)
+        return None if entry is None else entry['state']
+
+    def record(self, tasks, state, job_id = None, **extra):
+        """
+        Append a new state for the given tasks.
+        """
+        assert state in STATES, f'Unknown state {state}'
+        now = time.time()
+        with open(self.path, 'a') as f:
+            if f.tell() > 0 and not self.ends_with_newline():
+                # Do not glue the first entry to a line cut short by a killed submission
+                f.write('\n')
+            for task in tasks:
+                # The attempt and report of a job stay until its resubmission sets new ones
+                previous = self.entries.get(task.mdst, {})
+                entry = dict(mdst = task.mdst, key = self.key, state = state,
+                             job_id = job_id, time = now, root = task.root, log = task.log,
+                             attempt = previous.get('attempt', 1), report = previous.get('report'))
+                entry.update(extra)
+                f.write(json.dumps(entry) + '\n')
+                self.entries[task.mdst] = entry
+
+    def tasks(self, outdir, states = STATES):
+        """
+        Return the tasks of the files in the given states.
+        """
+        return [batch.Task(e['mdst'], outdir, root = e.get('root'), log = e.get('log'))
+                for e in self.entries.values() if e['state'] in states]
+
+    def reconcile(self, tasks, adopt = False):
+        """
+        Update the ledger with what is found on disk and return the states.
+
+        Files the ledger has never seen under this key are left pending even if
+        their output is done on disk, since it may come from another script.
+        With adopt, or when the ledger is still empty (e.g. a campaign submitted
+        before the ledger existed), such outputs are recorded as done.
+        """
+        adopt = adopt or not self.entries
+        states = {}
+        for task in tasks:
+            entry = self.entries.get(task.mdst)
+            old = None if entry is None else entry['state']
+            new = disk_state(task.root, task.log, None if entry is None else entry.get('report'))
+            if entry is not None and new is not None and os.path.exists(task.log) \
+               and os.path.getmtime(task.log) < entry['time']:
+                # Left over from before the latest submission
+                new = None
+            if new is not None and new != old and old != DONE:
+                if entry is not None or (new == DONE and adopt):
+                    job_id = None if entry is None else entry.get('job_id')
+                    self.record([task], new, job_id = job_id)
+            states[task.mdst] = self.state(task.mdst)
+        return states
+
+    def pending(self, tasks, adopt = False):
+        """
+        Return the tasks which are neither done nor in flight.
+        """
+        states = self.reconcile(tasks, adopt = adopt)
+        return [t for t in tasks if states[t.mdst] in (None, FAILED)]
+
+    def summary(self, tasks):
+        """
+        Return the number of tasks per state.
+        """
+        counts = {state: 0 for state in STATES + [None]}
+        for task in tasks:
+            counts[self.state(task.mdst)] += 1
+        return counts
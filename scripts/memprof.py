@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+# Memory and CPU sampling of the basf2 jobs
+#
+# memprof.py runs a command, passes its output through, and samples the RSS
+# and CPU use of the command and its children every --interval seconds into
+# <output>.mem.csv, next to the <output>.log of the job:
+#
+#   ./submit.py sigma_v7.py ../data/v7 --exp 55 --command "$(./memprof.py --template)"
+#
+# which makes every job run
+#
+#   python3 memprof.py --output <output> -- basf2 <b2opt> <script> <inputs> <output>
+#
+# Every sample is written at once, so the series of a job killed for its
+# memory ends at the kill. Samples are tagged with the phase of the job,
+# taken from its output (PHASES): setup until basf2 starts the event loop,
+# events until the statistics are printed, end afterwards. Over a campaign,
+#
+#   ./memprof.py --summary ../data/v7
+#
+# prints the peak memory of the jobs, the averages per phase, the growth of
+# the RSS during the event loop and the memory per module of b2.statistics.
+# To try it without basf2, run the dummy allocating job:
+#
+#   ./memprof.py --interval 0.1 --output /tmp/dummy.root -- python3 memprof.py --dummy 300 3
+import argparse
+import glob
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import batch
+
+SUFFIX = '.mem.csv'
+TEMPLATE = 'python3 memprof.py --output {output} -- ' + batch.BASF2_TEMPLATE
+# Output line -> phase starting with it
+PHASES = [
+    (re.compile(r'Starting event processing'), 'events'),
+    (re.compile(r'^Name\s*\|\s*Calls\s*\|'), 'end'),
+]
+PAGE = os.sysconf('SC_PAGE_SIZE')
+TICK = os.sysconf('SC_CLK_TCK')
+
+def series_path(output):
+    """
+    Return the time series file of a job output (<base>.root -> <base>.mem.csv).
+    """
+    base = output[:-len('.root')] if output.endswith('.root') else output
+    return base + SUFFIX
+
+def proc_stat(pid):
+    """
+    Return (parent pid, CPU seconds, RSS bytes) of a process from /proc.
+    """
+    with open(f'/proc/{pid}/stat') as f:
+        # The command name may contain spaces: split after it
+        fields = f.read().rsplit(')', 1)[1].split()
+    return int(fields[1]), (int(fields[11]) + int(fields[12])) / TICK, int(fields[21]) * PAGE
+
+def tree_usage(root):
+    """
+    Return the summed CPU seconds and RSS bytes of a process and all its descendants.
+    """
+    stats = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                stats[int(entry)] = proc_stat(entry)
+            except (OSError, IndexError, ValueError):
+                # Gone in between
+                continue
+    if root not in stats:
+        return None
+    children = {}
+    for pid, (ppid, _, _) in stats.items():
+        children.setdefault(ppid, []).append(pid)
+    cpu = rss = 0
+    todo = [root]
+    while todo:
+        pid = todo.pop()
+        cpu += stats[pid][1]
+        rss += stats[pid][2]
+        todo += children.get(pid, [])
+    return cpu, rss
+
+class Sampler:
+    """
+    Run a command and write the time series of its RSS and CPU use.
+    """
+    def __init__(self, cmd, series, interval = 5.0):
+        self.cmd = cmd
+        self.series = series
+        self.interval = interval
+        self.phase = 'setup'
+
+    def follow(self, stream):
+        """
+        Pass the output of the command through and track its phase.
+        """
+        out = sys.stdout.buffer
+        for line in iter(stream.readline, b''):
+            out.write(line)
+            out.flush()
+            text = line.decode(errors = 'replace')
+            for pattern, phase in PHASES:
+                if pattern.search(text):
+                    self.phase = phase
+
+    def run(self):
+        """
+        Run the command to its end and return its exit code.
+        """
+        proc = subprocess.Popen(self.cmd, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+        # The batch system signals this process: pass the signals on
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR2):
+            signal.signal(signum, lambda signum, frame: proc.send_signal(signum))
+        reader = threading.Thread(target = self.follow, args = (proc.stdout,), daemon = True)
+        reader.start()
+        os.makedirs(os.path.dirname(self.series) or '.', exist_ok = True)
+        with open(self.series, 'w') as f:
+            f.write('# interval %g s, command: %s\n' % (self.interval, ' '.join(self.cmd)))
+            f.write('t,rss_mb,cpu_percent,phase\n')
+            start = time.time()
+            last = None
+            while proc.poll() is None:
+                usage = tree_usage(proc.pid)
+                now = time.time()
+                if usage is not None:
+                    cpu, rss = usage
+                    # The first sample has no interval to take the CPU use over: left empty
+                    percent = ''
+                    if last is not None and now > last[1]:
+                        percent = '%.0f' % max(100 * (cpu - last[0]) / (now - last[1]), 0)
+                    f.write('%.1f,%.1f,%s,%s\n' % (now - start, rss / 2 ** 20, percent, self.phase))
+                    f.flush()
+                    last = cpu, now
+                try:
+                    proc.wait(self.interval)
+                except subprocess.TimeoutExpired:
+                    pass
+        reader.join(5)
+        # Killed by a signal: exit like a shell would
+        return proc.returncode if proc.returncode >= 0 else 128 - proc.returncode
+
+def read_series(path):
+    """
+    Return the samples of a time series file as a list of (t, rss_mb, cpu_percent, phase).
+
+    cpu_percent is None for the first sample.
+    """
+    samples = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#') or line.startswith('t,'):
+                continue
+            try:
+                t, rss, cpu, phase = line.rstrip('\n').split(',')
+                samples.append((float(t), float(rss), float(cpu) if cpu else None, phase))
+            except ValueError:
+                # Last line of a killed job
+                continue
+    return samples
+
+def job_summary(samples):
+    """
+    Return the peak RSS, the averages per phase and the RSS growth in the event loop of one job.
+    """
+    if not samples:
+        return None
+    peak = max(samples, key = lambda s: s[1])
+    phases = {}
+    for i, (t, rss, cpu, phase) in enumerate(samples):
+        p = phases.setdefault(phase, dict(samples = 0, rss = 0.0, cpu = [], start = t, end = t))
+        p['samples'] += 1
+        p['rss'] += rss
+        if cpu is not None:
+            p['cpu'].append(cpu)
+        p['end'] = samples[i + 1][0] if i + 1 < len(samples) else t
+    for p in phases.values():
+        p['rss'] /= p['samples']
+        p['cpu'] = sum(p['cpu']) / len(p['cpu']) if p['cpu'] else None
+        p['duration'] = p['end'] - p['start']
+    # Least squares slope of the RSS over the event loop, in MB per hour
+    loop = [(t, rss) for t, rss, _, phase in samples if phase == 'events']
+    growth = None
+    if len(loop) > 2:
+        n = len(loop)
+        mt = sum(t for t, _ in loop) / n
+        mr = sum(r for _, r in loop) / n
+        var = sum((t - mt) ** 2 for t, _ in loop)
+        if var > 0:
+            growth = 3600 * sum((t - mt) * (r - mr) for t, r in loop) / var
+    return dict(peak = peak[1], peak_time = peak[0], peak_phase = peak[3], duration = samples[-1][0],
+                last_phase = samples[-1][3], phases = phases, growth = growth)
+
+def summarize(outdir, top = 10):
+    """
+    Print the memory summary of the jobs of an output dir.
+    """
+    import joblog
+    paths = sorted(glob.glob(os.path.join(outdir, '*' + SUFFIX)))
+    jobs = {}
+    for path in paths:
+        summary = job_summary(read_series(path))
+        if summary is not None:
+            jobs[path] = summary
+    if not jobs:
+        print('No memory series in %s' % outdir)
+        return
+    peaks = sorted(j['peak'] for j in jobs.values())
+    quantile = lambda q: peaks[min(int(q * len(peaks)), len(peaks) - 1)]
+    print('%d jobs, peak RSS median %.0f MB, 90%% %.0f MB, max %.0f MB' %
+          (len(peaks), quantile(0.5), quantile(0.9), peaks[-1]))
+
+    print()
+    header = '%-8s %6s %12s %10s %12s' % ('Phase', 'Jobs', 'Mean RSS MB', 'Mean CPU%', 'Mean time s')
+    print(header)
+    print('=' * len(header))
+    for phase in ['setup', 'events', 'end']:
+        ps = [j['phases'][phase] for j in jobs.values() if phase in j['phases']]
+        if ps:
+            cpu = [p['cpu'] for p in ps if p['cpu'] is not None]
+            print('%-8s %6d %12.0f %10s %12.1f' % (phase, len(ps), sum(p['rss'] for p in ps) / len(ps),
+                                                   '%.0f' % (sum(cpu) / len(cpu)) if cpu else '-',
+                                                   sum(p['duration'] for p in ps) / len(ps)))
+    growth = [j['growth'] for j in jobs.values() if j['growth'] is not None]
+    if growth:
+        print('RSS growth in the event loop: mean %.1f MB/h, max %.1f MB/h' % (sum(growth) / len(growth), max(growth)))
+
+    print()
+    header = '%-40s %9s %8s %10s %8s' % ('Job', 'Peak MB', 'At', 'Growth/h', 'Ended')
+    print(header)
+    print('=' * len(header))
+    for path, j in sorted(jobs.items(), key = lambda item: -item[1]['peak'])[:top]:
+        print('%-40s %9.0f %8s %10s %8s' % (os.path.basename(path)[:-len(SUFFIX)][-40:], j['peak'], j['peak_phase'],
+                                            '-' if j['growth'] is None else '%.1f' % j['growth'], j['last_phase']))
+
+    # Memory per module, as b2.statistics reports it in the logs
+    modules = {}
+    for path in jobs:
+        log = path[:-len(SUFFIX)] + '.log'
+        if not os.path.exists(log):
+            continue
+        with open(log, errors = 'replace') as f:
+            rows = joblog.parse_statistics(f.read())
+        for row in rows:
+            if row['name'] != 'Total':
+                modules.setdefault(row['name'], []).append(row['memory'])
+    if modules:
+        print()
+        header = '%-40s %6s %14s %12s' % ('Module', 'Jobs', 'Mean memory MB', 'Max memory MB')
+        print(header)
+        print('=' * len(header))
+        for name, memory in sorted(modules.items(), key = lambda item: -sum(item[1]) / len(item[1]))[:top]:
+            print('%-40s %6d %14.1f %12.1f' % (name[:40], len(memory), sum(memory) / len(memory), max(memory)))
+
+def dummy(megabytes, seconds):
+    """
+    Behave like a basf2 job which allocates megabytes during an event loop of seconds.
+    """
+    print('Dummy job allocating %d MB' % megabytes, flush = True)
+    time.sleep(seconds / 4)
+    print('[INFO] Starting event processing, random seed is set to dummy', flush = True)
+    blocks = []
+    steps = 20
+    for _ in range(steps):
+        blocks.append(bytearray(megabytes * 2 ** 20 // steps))
+        time.sleep(seconds / 2 / steps)
+    print('Name | Calls | Memory(MB) | Time(s) | Time(ms)/Call', flush = True)
+    print('Dummy | 20 | %d | %.2f | 0.1 +- 0.0' % (megabytes, seconds / 2), flush = True)
+    print('Total | 20 | %d | %.2f | 0.1 +- 0.0' % (megabytes, seconds / 2), flush = True)
+    blocks.clear()
+    time.sleep(seconds / 4)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Sample the RSS and CPU of a job, or summarize a campaign')
+    parser.add_argument('--interval', type = float, default = 5.0, help = 'seconds between samples')
+    parser.add_argument('--output', default = None, help = 'output file of the job, the series goes next to it')
+    parser.add_argument('--summary', default = None, metavar = 'OUTDIR', help = 'summarize the jobs of a campaign')
+    parser.add_argument('--template', action = 'store_true', default = False,
+                        help = 'print the submit.py --command template running the jobs with memprof.py')
+    parser.add_argument('--dummy', nargs = 2, type = float, default = None, metavar = ('MB', 'SECONDS'),
+                        help = 'run as a dummy job allocating MB')
+    parser.add_argument('cmd', nargs = argparse.REMAINDER, help = '-- command to run')
+    args = parser.parse_args()
+
+    if args.template:
+        print(TEMPLATE)
+    elif args.dummy is not None:
+        dummy(int(args.dummy[0]), args.dummy[1])
+    elif args.summary is not None:
+        summarize(args.summary)
+    else:
+        cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+        if not cmd or args.output is None:
+            parser.error('give --output and the command after --')
+        sys.exit(Sampler(cmd, series_path(args.output), args.interval).run())
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+# Merge the per-job outputs of a campaign into a partitioned Parquet dataset
+#
+# The ROOT files of an output dir are read by a process pool, checked and
+# converted with the column types of columnar.py, and appended to
+#
+#   <dataset>/<tree>/exp=<exp>/runs=<first>-<last>/part-<session>-<n>.parquet
+#
+# one directory per experiment and block of --run_block runs. A file is
+# skipped when it cannot be opened (crashed job), has no candidates trees,
+# misses one of the requested trees, has columns differing from the first
+# merged file, or belongs to a job which is still running or failed
+# according to its log. <dataset>/manifest.json records every input file
+# with its state and entry counts and every part file, so running again
+# only appends the files which finished in between:
+#
+#   ./merge.py ../data/v7 ../data/v7.parquet --tree good
+#   pd.read_parquet('../data/v7.parquet/good', columns = ['M', 'isSignal'])
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+import columnar
+import ledger
+
+MANIFEST = 'manifest.json'
+
+OK = 'ok'
+EMPTY = 'empty'
+CORRUPT = 'corrupt'
+MISSING_TREE = 'missing_tree'
+BAD_SCHEMA = 'bad_schema'
+NOT_DONE = 'not_done'
+
+def load_manifest(dataset):
+    try:
+        with open(os.path.join(dataset, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict(schemas = {}, inputs = {}, parts = {})
+
+def save_manifest(dataset, manifest):
+    path = os.path.join(dataset, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(path + '.tmp', path)
+
+def fingerprint(path):
+    st = os.stat(path)
+    return dict(size = st.st_size, mtime = st.st_mtime)
+
+def partition(exp, run, run_block):
+    lo = run // run_block * run_block
+    return f'exp={exp}/runs={lo:05d}-{lo + run_block - 1:05d}'
+
+def split(arrays, run_block):
+    """
+    Split the columns of one tree by experiment and run block.
+    """
+    keys = np.stack([arrays['__experiment__'], arrays['__run__'] // run_block])
+    parts = {}
+    for exp, block in np.unique(keys, axis = 1).T:
+        mask = (keys[0] == exp) & (keys[1] == block)
+        parts[partition(int(exp), int(block) * run_block, run_block)] = \
+            {name: values[mask] for name, values in arrays.items()}
+    return parts
+
+def read_output(path, trees, run_block):
+    """
+    Read and check one output file.
+
+    Returns the path, the state, the entries per tree and the tables per tree
+    and partition. Runs in a worker process.
+    """
+    import uproot
+    log = path[:-len('.root')] + '.log'
+    if os.path.exists(log) and ledger.disk_state(path, log) != ledger.DONE:
+        return path, NOT_DONE, {}, {}
+    try:
+        with uproot.open(path) as f:
+            names = {key.split(';')[0] for key in f.keys()}
+            if not names:
+                return path, EMPTY, {}, {}
+            if not set(trees) <= names:
+                return path, MISSING_TREE, {}, {}
+            arrays = {tree: f[tree].arrays(library = 'np') for tree in trees}
+    except Exception:
+        return path, CORRUPT, {}, {}
+
+    entries = {}
+    tables = {}
+    for tree, columns in arrays.items():
+        entries[tree] = len(columns['__event__']) if '__event__' in columns else 0
+        if entries[tree] == 0:
+            continue
+        if '__experiment__' not in columns or '__run__' not in columns:
+            return path, BAD_SCHEMA, {}, {}
+        tables[tree] = {key: columnar.to_table(part) for key, part in split(columns, run_block).items()}
+    return path, OK, entries, tables
+
+def new_session():
+    """
+    Return a unique name for the parts written by one merge or compaction.
+
+    The time orders the sessions, the random suffix keeps two runs started
+    in the same second apart.
+    """
+    return '%s-%s' % (time.strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+
+def schema_of(table):
+    return [[field.name, str(field.type)] for field in table.schema]
+
+def merge(outdir, dataset, trees, run_block = 100, nworkers = None, **kwargs):
+    """
+    Append the new outputs of outdir to the dataset and return the manifest.
+    """
+    os.makedirs(dataset, exist_ok = True)
+    manifest = load_manifest(dataset)
+    inputs = manifest['inputs']
+
+    files = []
+    changed = []
+    for path in sorted(glob.glob(os.path.join(outdir, '*.root'))):
+        path = os.path.abspath(path)
+        old = inputs.get(path)
+        if old is None or old['state'] == NOT_DONE:
+            files.append(path)
+        elif (old['size'], old['mtime']) != tuple(fingerprint(path).values()):
+            if old['state'] == OK:
+                changed.append(path)
+            else:
+                files.append(path)
+    if changed:
+        print(f'[merge] {len(changed)} merged files changed since, rerun with --rebuild to include them')
+    print(f'[merge] {len(files)} new files')
+
+    session = new_session()
+    writers = {}
+    counts = {}
+    try:
+        with mp.Pool(nworkers) as pool:
+            for path, state, entries, tables in pool.imap_unordered(
+                    _read_output, [(path, trees, run_block) for path in files], chunksize = 8):
+                for tree, parts in tables.items():
+                    schema = manifest['schemas'].setdefault(tree, schema_of(next(iter(parts.values()))))
+                    if any(schema_of(table) != schema for table in parts.values()):
+                        state = BAD_SCHEMA
+                if state == OK:
+                    for tree, parts in tables.items():
+                        for key, table in parts.items():
+                            if (tree, key) not in writers:
+                                writers[tree, key] = columnar.PartWriter(os.path.join(dataset, tree, key),
+                                                                          prefix = f'part-{session}', **kwargs)
+                            writers[tree, key].write(table)
+                inputs[path] = dict(fingerprint(path), state = state, entries = entries)
+                counts[state] = counts.get(state, 0) + 1
+    finally:
+        for (tree, key), writer in writers.items():
+            writer.close()
+            for part in writer.paths:
+                rel = os.path.relpath(part, dataset)
+                manifest['parts'][rel] = dict(tree = tree, partition = key,
+                                              entries = _num_rows(part), session = session)
+        save_manifest(dataset, manifest)
+    print('[merge] ' + ', '.join(f'{n} {state}' for state, n in sorted(counts.items())))
+    return manifest
+
+def _read_output(args):
+    return read_output(*args)
+
+def _num_rows(path):
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(path).metadata.num_rows
+
+def compact(dataset, **kwargs):
+    """
+    Rewrite every partition made of several part files into one.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    manifest = load_manifest(dataset)
+    partitions = {}
+    for rel, part in manifest['parts'].items():
+        partitions.setdefault((part['tree'], part['partition']), []).append(rel)
+    session = new_session()
+    for (tree, key), rels in sorted(partitions.items()):
+        if len(rels) < 2:
+            continue
+        tmp = os.path.join(dataset, '.compact', tree, key)
+        writer = columnar.PartWriter(tmp, prefix = f'part-{session}', **kwargs)
+        try:
+            for rel in sorted(rels):
+                for batch in pq.ParquetFile(os.path.join(dataset, rel)).iter_batches():
+                    writer.write(pa.Table.from_batches([batch]))
+        finally:
+            writer.close()
+        for rel in rels:
+            os.remove(os.path.join(dataset, rel))
+            del manifest['parts'][rel]
+        for path in writer.paths:
+            dest = os.path.join(dataset, tree, key, os.path.basename(path))
+            os.replace(path, dest)
+            manifest['parts'][os.path.relpath(dest, dataset)] = dict(
+                tree = tree, partition = key, entries = _num_rows(dest), session = session)
+        save_manifest(dataset, manifest)
+        print(f'[merge] Compacted {len(rels)} files of {tree}/{key}')
+    shutil.rmtree(os.path.join(dataset, '.compact'), ignore_errors = True)
+
+def print_manifest(manifest):
+    states = {}
+    for entry in manifest['inputs'].values():
+        states[entry['state']] = states.get(entry['state'], 0) + 1
+    print('Inputs: ' + ', '.join(f'{n} {state}' for state, n in sorted(states.items())))
+    trees = {}
+    for part in manifest['parts'].values():
+        t = trees.setdefault(part['tree'], dict(files = 0, partitions = set(), entries = 0))
+        t['files'] += 1
+        t['partitions'].add(part['partition'])
+        t['entries'] += part['entries']
+    for tree, t in sorted(trees.items()):
+        print('%-12s %10d candidates in %4d files, %4d partitions' %
+              (tree, t['entries'], t['files'], len(t['partitions'])))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Merge the outputs of a campaign into a Parquet dataset')
+    parser.add_argument('outdir', help = 'output dir of the campaign')
+    parser.add_argument('dataset', help = 'Parquet dataset dir')
+    parser.add_argument('--tree', default = 'good', help = 'comma separated trees every output must have')
+    parser.add_argument('--run_block', type = int, default = 100, help = 'runs per partition')
+    parser.add_argument('--nworkers', type = int, default = None, help = 'number of processes reading outputs')
+    parser.add_argument('--rows_per_file', type = int, default = 5000000, help = 'candidates per Parquet file')
+    parser.add_argument('--rebuild', action = 'store_true', default = False,
+                        help = 'delete the dataset and merge all outputs again')
+    parser.add_argument('--compact', action = 'store_true', default = False,
+                        help = 'rewrite partitions made of several files into one')
+    args = parser.parse_args()
+
+    if args.rebuild and os.path.exists(args.dataset):
+        shutil.rmtree(args.dataset)
+    manifest = merge(args.outdir, args.dataset, args.tree.split(','), args.run_block, args.nworkers,
+                     rows_per_file = args.rows_per_file)
+    if args.compact:
+        compact(args.dataset, rows_per_file = args.rows_per_file)
+        manifest = load_manifest(args.dataset)
+    print_manifest(manifest)
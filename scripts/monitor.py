@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Follow the jobs of a campaign until they are all finished
+#
+# The files in flight are taken from the ledger, their state is polled from
+# the backend (bjobs or the local process table) and, once a job is gone,
+# from its log. Failed files are handed back for resubmission until they
+# have used up their retries. Every poll prints the aggregate throughput
+# and the slowest hosts.
+import os
+import subprocess
+import time
+from collections import defaultdict
+
+import joblog
+import ledger
+
+def summarize(logs):
+    """
+    Return aggregate numbers over parsed job logs.
+    """
+    done = [log for log in logs if log['status'] == 'done']
+    events = sum(log['events'] or 0 for log in done)
+    seconds = sum(log['time'] or 0 for log in done)
+    cpu = [log['cpu_time'] for log in done if log['cpu_time'] is not None]
+    hosts = defaultdict(list)
+    for log in done:
+        if log['host'] is not None and log['events_per_second'] is not None:
+            hosts[log['host']].append(log['events_per_second'])
+    return dict(njobs = len(done),
+                events = events,
+                events_per_second = events / seconds if seconds > 0 else None,
+                cpu_per_job = sum(cpu) / len(cpu) if cpu else None,
+                hosts = {host: sum(rates) / len(rates) for host, rates in hosts.items()})
+
+def print_summary(counts, summary, nhosts = 5):
+    """
+    Print the state counts and the throughput of the finished jobs.
+    """
+    print('[monitor] %s' % time.strftime('%H:%M:%S'), end = ' ')
+    print(', '.join(f'{counts[s]} {s}' for s in ledger.STATES))
+    if summary['events_per_second'] is not None:
+        print('[monitor] %d jobs, %d events, %.1f events/s' %
+              (summary['njobs'], summary['events'], summary['events_per_second']), end = '')
+        if summary['cpu_per_job'] is not None:
+            print(', %.0f s CPU per job' % summary['cpu_per_job'], end = '')
+        print()
+    slow = sorted(summary['hosts'].items(), key = lambda item: item[1])[:nhosts]
+    if slow:
+        print('[monitor] Slowest hosts: ' + ', '.join('%s (%.1f events/s)' % item for item in slow))
+
+def poll(book, outdir, backend):
+    """
+    Update the ledger for all files in flight.
+
+    Files whose job the backend does not know and whose log does not show
+    it finished are lost (killed, or never started): they are marked failed.
+    """
+    inflight = book.tasks(outdir, states = [ledger.SUBMITTED, ledger.RUNNING])
+    job_ids = {book.entries[t.mdst]['job_id'] for t in inflight} - {None}
+    try:
+        states = backend.status(sorted(job_ids))
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f'[monitor] Cannot poll the backend, skipping: {e}')
+        return
+    for task in inflight:
+        entry = book.entries[task.mdst]
+        state = states.get(entry['job_id'])
+        fresh = os.path.exists(task.log) and os.path.getmtime(task.log) >= entry['time']
+        if fresh and (state is None or state in (ledger.DONE, ledger.FAILED)):
+            # Finished or unknown to the backend: the log has the last word, unless it
+            # shows no end of a job the backend knows is over
+            logged = ledger.disk_state(task.root, task.log, entry.get('report'))
+            if state is None or logged in (ledger.DONE, ledger.FAILED):
+                state = logged
+        if entry['job_id'] not in states and state in (None, ledger.RUNNING):
+            book.record([task], ledger.FAILED, job_id = entry['job_id'], error = 'lost')
+        elif state is not None and state != entry['state']:
+            book.record([task], state, job_id = entry['job_id'])
+
+def read_logs(book, outdir):
+    """
+    Return the parsed logs of the finished files.
+    """
+    logs = {}
+    for task in book.tasks(outdir, states = [ledger.DONE, ledger.FAILED]):
+        if task.log not in logs:
+            try:
+                logs[task.log] = joblog.parse_log(task.log, book.entries[task.mdst].get('report'))
+            except OSError:
+                continue
+    return list(logs.values())
+
+def monitor(book, outdir, backend, resubmit, retries = 3, interval = 300, once = False):
+    """
+    Poll until no file is in flight, resubmitting failed files.
+
+    resubmit is called with a list of task groups (files sharing one output
+    are kept together) and returns the jobs it submitted.
+    """
+    while True:
+        poll(book, outdir, backend)
+
+        failed = [t for t in book.tasks(outdir, states = [ledger.FAILED])
+                  if book.entries[t.mdst].get('attempt', 1) <= retries]
+        if failed:
+            groups = defaultdict(list)
+            for task in failed:
+                groups[task.log].append(task)
+            print(f'[monitor] Resubmitting {len(failed)} failed files in {len(groups)} jobs')
+            for job in resubmit(list(groups.values())):
+                attempt = book.entries[job.tasks[0].mdst].get('attempt', 1) + 1
+                if job.returncode is not None:
+                    # Run in place by a local runner
+                    state = ledger.DONE if job.returncode == 0 else ledger.FAILED
+                    book.record(job.tasks, state, job_id = job.job_id, attempt = attempt)
+                elif job.job_id is not None:
+                    book.record(job.tasks, ledger.SUBMITTED, job_id = job.job_id, attempt = attempt,
+                                report = job.report)
+
+        counts = book.summary(book.tasks(outdir))
+        print_summary(counts, summarize(read_logs(book, outdir)))
+        if once or counts[ledger.SUBMITTED] + counts[ledger.RUNNING] == 0:
+            return counts
+        time.sleep(interval)
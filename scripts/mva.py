@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+# Train the Sigma+ MVA used by recon_lambdac.py
+#
+# The Sigma+ candidates of a training sample (ROOT files or a Parquet
+# dataset, e.g. the v7train variant of reconstruction.py) are read chunk by
+# chunk and only kept as 8-bit bin indices of the FEATURES, like FastBDT
+# does, so large samples fit in memory. A gradient-boosted decision tree is
+# then grown level by level from gradient histograms, the row chunks being
+# histogrammed by a thread pool.
+#
+#   ./mva.py ../data/v7_train.parquet --tree good --out Sigma_p_bdt.npz
+#
+# writes the trees as a .npz weightfile; load() gives a pure NumPy model for
+# re-scoring ntuples offline:
+#
+#   model = mva.load('Sigma_p_bdt.npz')
+#   df['Sigma_mva'] = model.predict(df)
+#
+# MVAExpert needs a basf2 weightfile. With --basf2 the same features and
+# settings are trained by basf2_mva (FastBDT) from the ROOT files instead,
+# writing MVA_Sigma_p.root.
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import ntuple
+import reconstruction
+import sampling
+
+TARGET = 'isSignal'
+# Variables not used for training: MC truth, the mass the MVA must not
+# sculpt, the event and constant columns
+EXCLUDED = ['M', 'E', 'charge', 'IPX', 'IPY', 'IPZ', 'sample_weight']
+
+def features(config = reconstruction.SIGMA_V7):
+    """
+    Return the training variables of a configuration's ntuple.
+    """
+    return [v for v in reconstruction.ntuple_vars(config)
+            if v not in EXCLUDED and not v.endswith('isSignal') and not v.endswith('PDG')
+            and 'Timing' not in v]
+
+def to_matrix(arrays, names):
+    """
+    Return the named columns as a float32 matrix.
+
+    NaN becomes the largest float32, so it falls into the last bin and always
+    goes to the right in a split.
+    """
+    x = np.column_stack([np.asarray(arrays[name], np.float32) for name in names])
+    x[np.isnan(x)] = np.finfo(np.float32).max
+    return x
+
+def fit_edges(x, nbins = 64):
+    """
+    Return the bin edges of every feature from quantiles of a sample.
+    """
+    edges = []
+    q = np.linspace(0, 1, nbins + 1)[1:-1]
+    for column in x.T:
+        finite = column[np.isfinite(column)]
+        # float32 like the features, so the thresholds compare exactly as the bins
+        e = np.quantile(finite, q).astype(np.float32) if len(finite) else np.zeros(0, np.float32)
+        edges.append(np.unique(e))
+    return edges
+
+def digitize(x, edges):
+    """
+    Return the bin of every value: the number of edges not above it.
+    """
+    return np.column_stack([np.searchsorted(e, column, side = 'right')
+                            for e, column in zip(edges, x.T)]).astype(np.uint8)
+
+class Model:
+    """
+    Gradient-boosted trees of fixed depth with pure NumPy inference.
+
+    Node i has the children 2i+1 (value < threshold) and 2i+2, the last
+    level holding the leaf values.
+    """
+    def __init__(self, names, base, feature, threshold, leaves):
+        self.names = names
+        self.base = base
+        self.feature = feature
+        self.threshold = threshold
+        self.leaves = leaves
+
+    def decision(self, x):
+        depth = int(np.log2(self.leaves.shape[1]))
+        score = np.full(len(x), self.base)
+        rows = np.arange(len(x))
+        for feature, threshold, leaves in zip(self.feature, self.threshold, self.leaves):
+            node = np.zeros(len(x), np.int64)
+            for _ in range(depth):
+                go_right = ~(x[rows, feature[node]] < threshold[node])
+                node = 2 * node + 1 + go_right
+            score += leaves[node - (len(feature))]
+        return score
+
+    def predict(self, data):
+        """
+        Return the signal probability of candidates given as a dict, DataFrame or matrix.
+        """
+        x = data if isinstance(data, np.ndarray) else to_matrix(data, self.names)
+        return 1 / (1 + np.exp(-self.decision(x)))
+
+    def save(self, path):
+        np.savez_compressed(path, names = np.array(self.names), base = self.base, feature = self.feature,
+                            threshold = self.threshold, leaves = self.leaves)
+
+def load(path):
+    with np.load(path) as f:
+        return Model(list(f['names']), float(f['base']), f['feature'], f['threshold'], f['leaves'])
+
+def histograms(xb, node, g, h, nnodes, nbins, pool, chunk = 1 << 16):
+    """
+    Return the gradient and hessian sums per (node, feature, bin).
+    """
+    nfeat = xb.shape[1]
+    offset = (np.arange(nfeat) * nbins)[None, :]
+
+    def one(start):
+        sl = slice(start, start + chunk)
+        index = (node[sl, None] * (nfeat * nbins) + offset + xb[sl]).ravel()
+        size = nnodes * nfeat * nbins
+        return (np.bincount(index, np.repeat(g[sl], nfeat), size),
+                np.bincount(index, np.repeat(h[sl], nfeat), size))
+
+    G = np.zeros(nnodes * nfeat * nbins)
+    H = np.zeros(nnodes * nfeat * nbins)
+    for dg, dh in pool.map(one, range(0, len(node), chunk)):
+        G += dg
+        H += dh
+    return G.reshape(nnodes, nfeat, nbins), H.reshape(nnodes, nfeat, nbins)
+
+def train(xb, y, edges, names, ntrees = 200, depth = 3, shrinkage = 0.1, subsample = 0.5,
+          l2 = 1.0, nthreads = 4, seed = 0):
+    """
+    Boost trees on binned features xb (uint8) and targets y (0/1).
+    """
+    rng = np.random.default_rng(seed)
+    nbins = max(len(e) for e in edges) + 1
+    mean = np.clip(y.mean(), 1e-6, 1 - 1e-6)
+    base = np.log(mean / (1 - mean))
+    score = np.full(len(y), base)
+    ninner = 2 ** depth - 1
+    feature = np.zeros((ntrees, ninner), np.int64)
+    threshold = np.full((ntrees, ninner), np.inf, np.float32)
+    bins = np.full((ntrees, ninner), nbins, np.int64)
+    leaves = np.zeros((ntrees, 2 ** depth))
+    # A bin can only be split below the number of edges of its feature
+    valid = np.arange(nbins)[None, :] < np.array([len(e) for e in edges])[:, None]
+
+    with ThreadPoolExecutor(nthreads) as pool:
+        for t in range(ntrees):
+            rows = np.flatnonzero(rng.random(len(y)) < subsample)
+            p = 1 / (1 + np.exp(-score[rows]))
+            g = p - y[rows]
+            h = p * (1 - p)
+            x = xb[rows]
+            node = np.zeros(len(rows), np.int64)
+            for level in range(depth):
+                first = 2 ** level - 1
+                nnodes = 2 ** level
+                G, H = histograms(x, node - first, g, h, nnodes, nbins, pool)
+                GL, HL = np.cumsum(G, axis = 2), np.cumsum(H, axis = 2)
+                Gt, Ht = GL[:, :, -1:], HL[:, :, -1:]
+                gain = GL ** 2 / (HL + l2) + (Gt - GL) ** 2 / (Ht - HL + l2) - Gt ** 2 / (Ht + l2)
+                gain = np.where(valid[None] & (HL > 1e-3) & (Ht - HL > 1e-3), gain, -np.inf)
+                best = gain.reshape(nnodes, -1).argmax(axis = 1)
+                for i, b in enumerate(best):
+                    f, cut = divmod(int(b), nbins)
+                    if np.isfinite(gain[i, f, cut]):
+                        feature[t, first + i] = f
+                        bins[t, first + i] = cut
+                        threshold[t, first + i] = edges[f][cut]
+                go_right = x[np.arange(len(rows)), feature[t, node]] > bins[t, node]
+                node = 2 * node + 1 + go_right
+            leaf = node - ninner
+            Gs = np.bincount(leaf, g, 2 ** depth)
+            Hs = np.bincount(leaf, h, 2 ** depth)
+            leaves[t] = -shrinkage * Gs / (Hs + l2)
+
+            # Update all rows with the new tree
+            node = np.zeros(len(y), np.int64)
+            for level in range(depth):
+                node = 2 * node + 1 + (xb[np.arange(len(y)), feature[t, node]] > bins[t, node])
+            score += leaves[t][node - ninner]
+    return Model(names, base, feature, threshold, leaves)
+
+def auc(y, score):
+    """
+    Return the area under the ROC curve.
+    """
+    order = np.argsort(score, kind = 'stable')
+    ranks = np.empty(len(score))
+    ranks[order] = np.arange(1, len(score) + 1)
+    npos = y.sum()
+    nneg = len(y) - npos
+    if npos == 0 or nneg == 0:
+        return None
+    return (ranks[y == 1].sum() - npos * (npos + 1) / 2) / (npos * nneg)
+
+def read_sample(nt, names, nbins = 64, max_fit = 200000, test_fraction = 0.2):
+    """
+    Read a training sample in two passes: quantile edges, then bin indices.
+
+    Returns the binned features, the targets, the test mask (a hashed fraction
+    of the candidates), the raw test features and the edges.
+    """
+    columns = names + [TARGET] + ['__experiment__', '__run__', '__event__', '__candidate__']
+    sample = []
+    total = 0
+    for chunk in nt.iterate(columns):
+        sample.append(to_matrix(chunk, names)[::10])
+        total += len(sample[-1])
+        if total >= max_fit:
+            break
+    edges = fit_edges(np.concatenate(sample)[:max_fit], nbins)
+
+    xb, y, test, xtest = [], [], [], []
+    for chunk in nt.iterate(columns):
+        x = to_matrix(chunk, names)
+        u = sampling.sample_hash(chunk['__experiment__'], chunk['__run__'], chunk['__event__'],
+                                 chunk['__candidate__'], seed = 1)
+        xb.append(digitize(x, edges))
+        y.append(np.nan_to_num(np.asarray(chunk[TARGET], np.float64)) == 1)
+        test.append(u < test_fraction)
+        xtest.append(x[test[-1]])
+    xb, y, test = np.concatenate(xb), np.concatenate(y).astype(np.float64), np.concatenate(test)
+    return xb, y, test, np.concatenate(xtest), edges
+
+def train_basf2(files, tree, names, identifier, ntrees, depth, shrinkage, subsample):
+    """
+    Train the FastBDT weightfile MVAExpert reads with basf2_mva.
+    """
+    import basf2_mva
+    go = basf2_mva.GeneralOptions()
+    go.m_datafiles = basf2_mva.vector(*files)
+    go.m_treename = tree
+    go.m_identifier = identifier
+    go.m_variables = basf2_mva.vector(*names)
+    go.m_target_variable = TARGET
+    sp = basf2_mva.FastBDTOptions()
+    sp.m_nTrees = ntrees
+    sp.m_nLevels = depth
+    sp.m_shrinkage = shrinkage
+    sp.m_randRatio = subsample
+    basf2_mva.teacher(go, sp)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Train the Sigma+ MVA')
+    parser.add_argument('source', help = 'training sample: dir of ROOT files or Parquet dataset')
+    parser.add_argument('--tree', default = 'good', help = 'tree name')
+    parser.add_argument('--out', default = 'Sigma_p_bdt.npz', help = 'NumPy weightfile to write')
+    parser.add_argument('--ntrees', type = int, default = 200, help = 'number of trees')
+    parser.add_argument('--depth', type = int, default = 3, help = 'tree depth')
+    parser.add_argument('--shrinkage', type = float, default = 0.1, help = 'learning rate')
+    parser.add_argument('--subsample', type = float, default = 0.5, help = 'fraction of candidates per tree')
+    parser.add_argument('--nbins', type = int, default = 64, help = 'bins per feature (at most 255)')
+    parser.add_argument('--nthreads', type = int, default = 4, help = 'threads filling the histograms')
+    parser.add_argument('--basf2', default = None, metavar = 'IDENTIFIER',
+                        help = 'train with basf2_mva (FastBDT) into this weightfile, e.g. MVA_Sigma_p.root '
+                        '(ROOT files only)')
+    args = parser.parse_args()
+
+    names = features()
+    nt = ntuple.Ntuple(args.source, args.tree)
+    if args.basf2 is not None:
+        if nt.parquet:
+            parser.error('--basf2 trains from the ROOT files, not from a Parquet dataset')
+        train_basf2(nt.files, args.tree, names, args.basf2, args.ntrees, args.depth,
+                    args.shrinkage, args.subsample)
+        exit(0)
+
+    start = time.perf_counter()
+    xb, y, test, xtest, edges = read_sample(nt, names, min(args.nbins, 255))
+    seconds = time.perf_counter() - start
+    print('Read %d candidates (%d signal) with %d features in %.1f s (%.0f candidates/s)' %
+          (len(y), y.sum(), len(names), seconds, len(y) / seconds))
+
+    start = time.perf_counter()
+    model = train(xb[~test], y[~test], edges, names, args.ntrees, args.depth, args.shrinkage,
+                  args.subsample, nthreads = args.nthreads)
+    seconds = time.perf_counter() - start
+    ntrain = int((~test).sum())
+    print('Trained %d trees on %d candidates in %.1f s (%.0f candidates/s per tree)' %
+          (args.ntrees, ntrain, seconds, ntrain * args.ntrees / seconds))
+    model.save(args.out)
+    print('Wrote %s' % args.out)
+
+    # Score the test candidates from their raw values, as offline re-scoring does
+    start = time.perf_counter()
+    score = model.predict(xtest)
+    seconds = time.perf_counter() - start
+    print('Scored %d test candidates in %.2f s (%.0f candidates/s), AUC %.4f' %
+          (len(score), seconds, len(score) / seconds, auc(y[test], score)))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# Lazy, column-projected reader for the ntuples of a campaign
+#
+# Instead of loading every column of every file with read_root, the
+# notebooks open the campaign once and only read what a plot needs:
+#
+#   import sys; sys.path.append('../scripts')
+#   from ntuple import Ntuple
+#   nt = Ntuple('../data/v6/*.root', 'good')          # or a merge.py dataset dir
+#   df = nt.read(['pi0_M', 'pi0_isSignal'], where = 'cosa > 0')
+#   counts, edges = nt.hist('pi0_M', bins = 200, range = (0.11, 0.16), where = 'pi0_isSignal == 1')
+#   for chunk in nt.iterate(['M', 'isSignal']):
+#       ...
+#
+# Data are read in chunks of step_size, so iterating and histogramming the
+# whole campaign runs in constant memory. The where predicates (simple
+# comparisons joined with 'and') are applied while reading: on a Parquet
+# dataset written by merge.py they are pushed down to the row group
+# statistics, so files and row groups which cannot match are not read at
+# all; on ROOT files the predicate columns are read first and the other
+# columns only for the chunks with matching candidates. Decompression runs
+# in a thread pool of nthreads.
+import glob
+import operator
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+OPS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt,
+       '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+PREDICATE = re.compile(r'^\s*(\w+)\s*(==|!=|<=|>=|<|>)\s*(\S+)\s*$')
+
+def parse_where(where):
+    """
+    Return a list of (column, op, value) from 'a == 1 and b > 0' or a list of such tuples.
+    """
+    if where is None:
+        return []
+    if not isinstance(where, str):
+        return [tuple(p) for p in where]
+    preds = []
+    for term in re.split(r'\band\b', where):
+        match = PREDICATE.match(term)
+        if match is None:
+            raise ValueError(f'Cannot parse predicate {term.strip()!r}, use "column op value"')
+        column, op, value = match.groups()
+        preds.append((column, op, float(value)))
+    return preds
+
+def select(arrays, preds):
+    """
+    Return the boolean mask of the candidates passing all predicates.
+    """
+    mask = None
+    for column, op, value in preds:
+        m = OPS[op](arrays[column], value)
+        mask = m if mask is None else mask & m
+    return mask
+
+def expand(source):
+    """
+    Return the files of a glob pattern, a directory or a list of paths.
+    """
+    if isinstance(source, (list, tuple)):
+        return list(source)
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '*.root')))
+    return sorted(glob.glob(source))
+
+class Ntuple:
+    """
+    One tree of a campaign, either ROOT files or a Parquet dataset.
+
+    source is a glob pattern, a directory or a list of ROOT files, a dataset
+    directory holding tree/, or a list of Parquet part files.
+    """
+    def __init__(self, source, tree = 'good', step_size = '50 MB', nthreads = 4):
+        self.tree = tree
+        self.step_size = step_size
+        self.nthreads = nthreads
+        self.parquet = isinstance(source, str) and os.path.isdir(os.path.join(source, tree))
+        if self.parquet:
+            self.dataset_dir = os.path.join(source, tree)
+            self.files = []
+        elif isinstance(source, (list, tuple)) and source and all(s.endswith('.parquet') for s in source):
+            # Part files of a dataset, without the partition columns
+            self.parquet = True
+            self.dataset_dir = list(source)
+            self.files = []
+        else:
+            self.files = expand(source)
+            if not self.files:
+                raise FileNotFoundError(f'No ROOT files in {source}')
+
+    def columns(self):
+        """
+        Return the column names of the tree.
+        """
+        if self.parquet:
+            return self._dataset().schema.names
+        import uproot
+        with uproot.open(self.files[0]) as f:
+            return f[self.tree].keys()
+
+    def _dataset(self):
+        import pyarrow.dataset as ds
+        if isinstance(self.dataset_dir, list):
+            return ds.dataset(self.dataset_dir, format = 'parquet')
+        return ds.dataset(self.dataset_dir, format = 'parquet', partitioning = 'hive')
+
+    def parts(self):
+        """
+        Return the files as single-file sources, to be read by separate workers.
+        """
+        if not self.parquet:
+            return [[path] for path in self.files]
+        if isinstance(self.dataset_dir, list):
+            return [[path] for path in self.dataset_dir]
+        return [[path] for path in sorted(glob.glob(os.path.join(self.dataset_dir, '**', '*.parquet'),
+                                                    recursive = True))]
+
+    def iterate(self, columns, where = None, library = 'np'):
+        """
+        Yield the selected candidates chunk by chunk.
+
+        Chunks are dicts of numpy arrays, or DataFrames with library = 'pd'.
+        """
+        preds = parse_where(where)
+        chunks = self._iterate_parquet(columns, preds) if self.parquet else self._iterate_root(columns, preds)
+        for arrays in chunks:
+            if library == 'pd':
+                import pandas as pd
+                yield pd.DataFrame(arrays)
+            else:
+                yield arrays
+
+    def _iterate_parquet(self, columns, preds):
+        import pyarrow.dataset as ds
+        expr = None
+        for column, op, value in preds:
+            e = OPS[op](ds.field(column), value)
+            expr = e if expr is None else expr & e
+        batch_size = 1 << 17
+        for batch in self._dataset().to_batches(columns = list(columns), filter = expr,
+                                                batch_size = batch_size, use_threads = self.nthreads > 1):
+            if batch.num_rows:
+                yield {name: batch.column(name).to_numpy(zero_copy_only = False) for name in columns}
+
+    def _iterate_root(self, columns, preds):
+        import uproot
+        pred_columns = sorted({p[0] for p in preds})
+        with ThreadPoolExecutor(self.nthreads) as pool:
+            for path in self.files:
+                with uproot.open(path, decompression_executor = pool, interpretation_executor = pool) as f:
+                    if self.tree not in f or f[self.tree].num_entries == 0:
+                        continue
+                    tree = f[self.tree]
+                    if not preds:
+                        for arrays in tree.iterate(list(columns), step_size = self.step_size, library = 'np'):
+                            yield arrays
+                        continue
+                    for arrays, report in tree.iterate(pred_columns, step_size = self.step_size,
+                                                       library = 'np', report = True):
+                        mask = select(arrays, preds)
+                        if not mask.any():
+                            continue
+                        rest = [c for c in columns if c not in arrays]
+                        if rest:
+                            arrays.update(tree.arrays(rest, entry_start = report.tree_entry_start,
+                                                      entry_stop = report.tree_entry_stop, library = 'np'))
+                        yield {c: arrays[c][mask] for c in columns}
+
+    def read(self, columns, where = None):
+        """
+        Return the selected candidates as one DataFrame.
+        """
+        import pandas as pd
+        chunks = list(self.iterate(columns, where))
+        if not chunks:
+            return pd.DataFrame(columns = list(columns))
+        return pd.DataFrame({c: np.concatenate([chunk[c] for chunk in chunks]) for c in columns})
+
+    def hist(self, column, bins = 200, range = None, where = None):
+        """
+        Return the histogram of one column over all files in constant memory.
+        """
+        if range is None:
+            raise ValueError('Give the histogram range, it cannot be known before reading')
+        counts = np.zeros(bins)
+        edges = np.linspace(range[0], range[1], bins + 1)
+        for chunk in self.iterate([column], where):
+            counts += np.histogram(chunk[column], bins = edges)[0]
+        return counts, edges
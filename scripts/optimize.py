@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+# Multi-dimensional optimization of the Sigma+ cuts
+#
+# The Berger-style cuts (photon energy, pi0 momentum and mass, proton PID,
+# Sigma+ mass window) are optimized on a merged ntuple for a figure of merit
+# by a grid search or by coordinate ascent:
+#
+#   ./optimize.py ../data/v7_loose.parquet --tree good --method ascent --fom significance
+#   ./optimize.py ../data/v7_loose.parquet --method grid --vars gamma_E pi0_p dM
+#
+# Each variable of VARIABLES is read once, sorted once, and the sort orders
+# are cached on disk (--cache). To scan one variable with the others fixed,
+# the candidates passing the other cuts are summed cumulatively along the
+# sort order of that variable; every threshold then costs one binary search
+# in the sorted values. A grid search sweeps its largest dimension this way
+# for every combination of the others, so its cost grows with the product of
+# the grid sizes: only the coordinate ascent scales to all variables, the
+# grid is for a few. Results are cached next to the
+# indexes, keyed by the input files and the optimization settings.
+#
+# Cuts can only be tightened beyond those the ntuple was made with, so scan
+# a loose ntuple for thresholds below the standard selection.
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import ntuple
+from cutscan import frange
+from reconstruction import SIGMA_MASS
+
+PI0_MASS = 0.13497
+SIGNAL = 'isSignal'
+WEIGHT = 'sample_weight'
+# Bump when a definition of VARIABLES changes, it invalidates the caches
+VERSION = 1
+# Grid sweeps times candidates above which grid() suggests ascent()
+GRID_WARN = 1e10
+
+# name -> (columns, value, cut op, thresholds); both photons and both PIDs are cut alike
+VARIABLES = {
+    'gamma_E': (['gamma1_E', 'gamma2_E'], lambda c: np.minimum(c['gamma1_E'], c['gamma2_E']),
+                '>', frange(0.02, 0.1, 0.005)),
+    'pi0_p': (['pi0_p'], lambda c: c['pi0_p'], '>', frange(0.0, 0.3, 0.02)),
+    'pi0_dM': (['pi0_M'], lambda c: np.abs(c['pi0_M'] - PI0_MASS), '<', frange(0.005, 0.03, 0.0025)),
+    'p_pid': (['p_pid_ppi', 'p_pid_pk'], lambda c: np.minimum(c['p_pid_ppi'], c['p_pid_pk']),
+              '>', frange(0.4, 0.95, 0.05)),
+    'p_dr': (['p_dr'], lambda c: c['p_dr'], '>', frange(0.0, 0.1, 0.01)),
+    'dM': (['M'], lambda c: np.abs(c['M'] - SIGMA_MASS), '<', frange(0.002, 0.03, 0.002)),
+}
+
+def fom(name, s, b, s0):
+    """
+    Return a figure of merit of the signal s and background b kept of s0 signal.
+    """
+    s, b = np.asarray(s, np.float64), np.asarray(b, np.float64)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        if name == 'significance':
+            value = s / np.sqrt(b)
+        elif name == 'significance_sb':
+            value = s / np.sqrt(s + b)
+        elif name == 'punzi':
+            # Punzi for a 3 sigma discovery
+            value = (s / s0) / (1.5 + np.sqrt(b))
+        else:
+            raise ValueError(f'Unknown figure of merit {name}')
+    return np.where(np.isfinite(value), value, 0.0)
+
+def sha1(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys = True).encode()).hexdigest()[:16]
+
+def describe(nt):
+    """
+    Return the input files with their sizes and modification times.
+    """
+    files = [part[0] for part in nt.parts()]
+    return [(path, os.path.getsize(path), int(os.path.getmtime(path))) for path in files]
+
+class Index:
+    """
+    Sorted values and cumulative signal and background counts of the cut variables.
+    """
+    def __init__(self, names, values, weight_s, weight_b):
+        self.names = names
+        self.values = values
+        self.orders = {name: np.argsort(values[name], kind = 'stable').astype(np.int32) for name in names}
+        self.sorted = {name: values[name][self.orders[name]] for name in names}
+        # NaNs sort last and pass no cut
+        self.nvalid = {name: int(np.count_nonzero(~np.isnan(values[name]))) for name in names}
+        self.ws = weight_s
+        self.wb = weight_b
+        self.s0 = float(weight_s.sum())
+        self.b0 = float(weight_b.sum())
+
+    @classmethod
+    def read(cls, nt, names, where = None):
+        columns = sorted({c for name in names for c in VARIABLES[name][0]} | {SIGNAL})
+        weighted = WEIGHT in nt.columns()
+        values = {name: [] for name in names}
+        ws, wb = [], []
+        for chunk in nt.iterate(columns + ([WEIGHT] if weighted else []), where):
+            for name in names:
+                values[name].append(np.asarray(VARIABLES[name][1](chunk), np.float32))
+            w = np.asarray(chunk[WEIGHT], np.float64) if weighted else np.ones(len(chunk[SIGNAL]))
+            signal = np.asarray(chunk[SIGNAL]) == 1
+            ws.append(np.where(signal, w, 0.0))
+            wb.append(np.where(signal, 0.0, w))
+        if not ws:
+            raise ValueError('No candidates selected')
+        return cls(names, {name: np.concatenate(v) for name, v in values.items()},
+                   np.concatenate(ws), np.concatenate(wb))
+
+    def save(self, path):
+        arrays = {'ws': self.ws, 'wb': self.wb}
+        for name in self.names:
+            arrays['values_' + name] = self.values[name]
+            arrays['order_' + name] = self.orders[name]
+        np.savez(path, names = np.array(self.names), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        f = np.load(path)
+        index = cls.__new__(cls)
+        index.names = list(f['names'])
+        index.values = {name: f['values_' + name] for name in index.names}
+        index.orders = {name: f['order_' + name] for name in index.names}
+        index.sorted = {name: index.values[name][index.orders[name]] for name in index.names}
+        index.nvalid = {name: int(np.count_nonzero(~np.isnan(index.values[name]))) for name in index.names}
+        index.ws, index.wb = f['ws'], f['wb']
+        index.s0, index.b0 = float(index.ws.sum()), float(index.wb.sum())
+        return index
+
+    def cut(self, name, values, threshold):
+        """
+        Return the mask of values passing one cut.
+
+        The threshold is cast to float32 like the values, so the masks agree
+        with the binary searches of sweep() at thresholds on a value.
+        """
+        return ntuple.OPS[VARIABLES[name][2]](values, np.float32(threshold))
+
+    def passing(self, name, threshold):
+        """
+        Return the mask of the candidates passing one cut (None: no cut).
+        """
+        if threshold is None:
+            return None
+        return self.cut(name, self.values[name], threshold)
+
+    def mask(self, cuts, skip = None):
+        mask = None
+        for name, threshold in cuts.items():
+            if name == skip:
+                continue
+            m = self.passing(name, threshold)
+            if m is not None:
+                mask = m if mask is None else mask & m
+        return mask
+
+    def rows(self, name, cuts = None):
+        """
+        Return the candidates passing the cuts on the other variables, in the sort order of name.
+        """
+        order = self.orders[name]
+        mask = self.mask(cuts or {}, skip = name)
+        return order if mask is None else order[mask[order]]
+
+    def sweep(self, cuts, name, thresholds, rows = None):
+        """
+        Return S and B for each threshold of one variable with the other cuts fixed.
+
+        One cumulative sum over the candidates, then a binary search per threshold.
+        The candidates can be given as rows (see rows()) instead of by the cuts.
+        """
+        if rows is None:
+            rows = self.rows(name, cuts)
+        if rows is self.orders[name]:
+            values, n = self.sorted[name], self.nvalid[name]
+        else:
+            values = self.values[name][rows]
+            n = int(np.count_nonzero(~np.isnan(values)))
+        cs = np.concatenate([[0.0], np.cumsum(self.ws[rows])])
+        cb = np.concatenate([[0.0], np.cumsum(self.wb[rows])])
+        values = values[:n]
+        t = np.asarray(thresholds, np.float32)
+        op = VARIABLES[name][2]
+        if op in ('<', '<='):
+            end = np.searchsorted(values, t, side = 'left' if op == '<' else 'right')
+            return cs[end], cb[end]
+        start = np.searchsorted(values, t, side = 'right' if op == '>' else 'left')
+        return cs[n] - cs[start], cb[n] - cb[start]
+
+    def counts(self, cuts):
+        mask = self.mask(cuts)
+        if mask is None:
+            return self.s0, self.b0
+        return float(self.ws @ mask), float(self.wb @ mask)
+
+class Optimizer:
+    """
+    Grid search and coordinate ascent of the cuts on VARIABLES, cached in cache_dir.
+    """
+    def __init__(self, source, tree = 'good', names = None, where = None, cache_dir = None,
+                 figure = 'significance'):
+        self.names = list(names or VARIABLES)
+        self.figure = figure
+        self.cache_dir = cache_dir
+        nt = ntuple.Ntuple(source, tree)
+        self.key = sha1([VERSION, describe(nt), tree, where, self.names])
+        path = None if cache_dir is None else os.path.join(cache_dir, self.key + '.npz')
+        if path is not None and os.path.exists(path):
+            self.index = Index.load(path)
+        else:
+            self.index = Index.read(nt, self.names, where)
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok = True)
+                self.index.save(path)
+
+    def value(self, s, b):
+        return fom(self.figure, s, b, self.index.s0)
+
+    def result(self, cuts, evaluated, trajectory = None):
+        s, b = self.index.counts(cuts)
+        return dict(cuts = cuts, signal = s, background = b,
+                    efficiency = s / self.index.s0 if self.index.s0 else None,
+                    background_efficiency = b / self.index.b0 if self.index.b0 else None,
+                    fom = float(self.value(s, b)), figure = self.figure,
+                    evaluated = evaluated, trajectory = trajectory)
+
+    def grid(self, grids):
+        """
+        Return the best cuts over all combinations of the thresholds in grids.
+
+        The largest dimension is swept for every combination of the others,
+        which are nested so that each level only filters the candidates left
+        by the outer cuts. The number of sweeps is still the product of the
+        other grid sizes: only ascent() scales to many variables.
+        """
+        names = sorted(grids, key = lambda name: len(grids[name]))
+        swept, fixed = names[-1], names[:-1]
+        sweeps = int(np.prod([len(grids[name]) for name in fixed]))
+        if sweeps * len(self.index.ws) > GRID_WARN:
+            print('Warning: the grid takes %d sweeps over up to %d candidates, consider --method ascent' %
+                  (sweeps, len(self.index.ws)))
+        best = dict(cuts = None, value = -np.inf, evaluated = 0)
+
+        def descend(depth, cuts, rows):
+            if depth == len(fixed):
+                s, b = self.index.sweep(cuts, swept, grids[swept], rows = rows)
+                f = self.value(s, b)
+                i = int(np.argmax(f))
+                best['evaluated'] += len(f)
+                if f[i] > best['value']:
+                    best['cuts'], best['value'] = dict(cuts, **{swept: grids[swept][i]}), f[i]
+                return
+            name = fixed[depth]
+            values = self.index.values[name][rows]
+            for threshold in grids[name]:
+                inner = rows if threshold is None else rows[self.index.cut(name, values, threshold)]
+                descend(depth + 1, dict(cuts, **{name: threshold}), inner)
+
+        descend(0, {}, self.index.orders[swept])
+        return self.result({name: best['cuts'][name] for name in grids}, best['evaluated'])
+
+    def ascent(self, grids, start = None, max_rounds = 20):
+        """
+        Return the cuts found by optimizing one variable at a time until no cut moves.
+        """
+        cuts = dict(start or {name: None for name in grids})
+        trajectory, evaluated = [], 0
+        current = float(self.value(*self.index.counts(cuts)))
+        for _ in range(max_rounds):
+            moved = False
+            for name in grids:
+                s, b = self.index.sweep(cuts, name, grids[name])
+                f = self.value(s, b)
+                evaluated += len(f)
+                i = int(np.argmax(f))
+                if f[i] > current + 1e-12 and grids[name][i] != cuts[name]:
+                    cuts[name], current, moved = grids[name][i], float(f[i]), True
+                    trajectory.append(dict(variable = name, threshold = cuts[name], fom = current))
+            if not moved:
+                break
+        return self.result(cuts, evaluated, trajectory)
+
+    def run(self, method, grids, start = None):
+        """
+        Run an optimization, or return its cached result.
+        """
+        key = sha1([self.key, method, self.figure, grids, start])
+        path = None if self.cache_dir is None else os.path.join(self.cache_dir, 'result_' + key + '.json')
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                return dict(json.load(f), cached = True)
+        result = self.grid(grids) if method == 'grid' else self.ascent(grids, start)
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(result, f, indent = 1)
+        return dict(result, cached = False)
+
+def where(cuts):
+    """
+    Return the cuts as a where expression of the variables.
+    """
+    return ' and '.join(f'{name} {VARIABLES[name][2]} {threshold}'
+                        for name, threshold in cuts.items() if threshold is not None)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Optimize the Sigma+ cuts for a figure of merit')
+    parser.add_argument('source', help = 'dir of ROOT files or Parquet dataset')
+    parser.add_argument('--tree', default = 'good', help = 'tree name')
+    parser.add_argument('--where', default = None, help = 'preselection, e.g. "cosa > 0"')
+    parser.add_argument('--vars', nargs = '+', default = list(VARIABLES), choices = list(VARIABLES),
+                        help = 'variables to optimize')
+    parser.add_argument('--method', default = 'ascent', choices = ['ascent', 'grid'], help = 'search method')
+    parser.add_argument('--fom', default = 'significance', choices = ['significance', 'significance_sb', 'punzi'],
+                        help = 'S/sqrt(B), S/sqrt(S+B) or Punzi')
+    parser.add_argument('--cache', default = 'optimize_cache', help = 'dir of the cached indexes and results')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    opt = Optimizer(args.source, args.tree, args.vars, args.where, args.cache, args.fom)
+    print('Indexed %d candidates in %.1f s' % (len(opt.index.ws), time.perf_counter() - start))
+    grids = {name: VARIABLES[name][3] for name in args.vars}
+    if args.method == 'grid':
+        print('Grid of %d points' % np.prod([len(g) for g in grids.values()]))
+
+    start = time.perf_counter()
+    result = opt.run(args.method, grids)
+    seconds = time.perf_counter() - start
+    print('%s: %d cuts evaluated in %.2f s%s' % (args.method, result['evaluated'], seconds,
+                                                  ' (cached)' if result['cached'] else ''))
+    for step in result['trajectory'] or []:
+        print('  %-8s -> %-8g %s = %.3f' % (step['variable'], step['threshold'], args.fom, step['fom']))
+    print('Best cuts: %s' % where(result['cuts']))
+    print('S = %.1f (eff %.3f), B = %.1f (eff %.4f), %s = %.3f' % (
+        result['signal'], result['efficiency'] or 0, result['background'],
+        result['background_efficiency'] or 0, args.fom, result['fom']))
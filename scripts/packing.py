@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Pack mdst files into jobs of similar wall time
+#
+# The run time of a file is estimated from its size, using either a plain
+# throughput in bytes/s or an events/s rate together with the mean mdst size
+# of an event. Files are then packed first-fit-decreasing into jobs that stay
+# below the target wall time, so small files share the basf2 start-up and
+# B2BII database setup while large files get a job of their own.
+#
+# A profile is a JSON file mapping the steering script name to its rates, e.g.
+#
+#   {"sigma_v7.py": {"overhead": 60, "events_per_second": 400, "bytes_per_event": 30000}}
+import json
+import os
+
+DEFAULT_RATES = dict(overhead = 60.0, bytes_per_second = 2e6)
+
+def load_rates(profile, script):
+    """
+    Return the rates of a steering script from a profile file.
+    """
+    rates = dict(DEFAULT_RATES)
+    if profile is not None and os.path.exists(profile):
+        with open(profile) as f:
+            rates.update(json.load(f).get(os.path.basename(script), {}))
+    if 'events_per_second' in rates and 'bytes_per_event' in rates:
+        rates['bytes_per_second'] = rates['events_per_second'] * rates['bytes_per_event']
+    return rates
+
+def estimate_seconds(path, rates):
+    """
+    Return the estimated processing time of one mdst file without start-up.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        # Not visible from here (e.g. submitting from another host): assume average
+        size = rates.get('default_size', 1e9)
+    return size / rates['bytes_per_second']
+
+def pack(paths, walltime, rates):
+    """
+    Group files into jobs whose estimated wall time stays below walltime seconds.
+
+    Files which alone exceed the limit get a job of their own. The groups and
+    the files in them keep the order of paths.
+    """
+    capacity = walltime - rates['overhead']
+    costs = {path: estimate_seconds(path, rates) for path in paths}
+    bins = []
+    for path in sorted(paths, key = lambda p: -costs[p]):
+        for b in bins:
+            if b['cost'] + costs[path] <= capacity:
+                b['paths'].append(path)
+                b['cost'] += costs[path]
+                break
+        else:
+            bins.append(dict(paths = [path], cost = costs[path]))
+    order = {path: i for i, path in enumerate(paths)}
+    groups = [sorted(b['paths'], key = order.get) for b in bins]
+    return sorted(groups, key = lambda g: order[g[0]])
+
+def job_seconds(group, rates):
+    """
+    Return the estimated wall time of a job processing the files in group.
+    """
+    return rates['overhead'] + sum(estimate_seconds(path, rates) for path in group)
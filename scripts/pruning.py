@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Pairwise mass pre-check of the Lambda_c+ -> Sigma+ pi+ pi- pions
+#
+# A pion can only be in a Lambda_c+ candidate below the highest mass the
+# combiner accepts (M_max) if it makes a pi+ pi- pair with
+# m(pi+ pi-) <= M_max - m(Sigma+) and a Sigma+ pi pair with
+# m(Sigma+ pi) <= M_max - m(pi). Pions of an event failing either test are
+# removed from the pion list before the combiner, so it forms fewer triples
+# and the Lambda_c+ tree fit runs on fewer candidates. The test is exact: no
+# candidate passing the M_max cut is lost.
+#
+# In the path, give a Lambda_c+ configuration of reconstruction.py a prune
+# mass (see LAMBDAC); the cut flow has the pion list before and after as
+# the stages pi+:lamc and 'prune pi+:pruned', and the combinations of the
+# Lambda_c+:loose stage. Offline, on the four-vectors of kinematics.py,
+#
+#   ./pruning.py ../data/lambdac_fv --tree lambda_c
+#
+# checks that no written candidate would be lost and counts the triples the
+# pre-check keeps among the pions of the written candidates.
+import argparse
+
+import numpy as np
+
+import kinematics
+from reconstruction import PION_MASS
+
+try:
+    import basf2 as b2
+    from ROOT import Belle2, std
+except ImportError:
+    # The offline check does not need basf2
+    b2 = None
+
+def keep_pions(sigma, pions, charge, max_mass):
+    """
+    Return the mask of the pions with a pi+ pi- and a Sigma+ pi pair below the
+    kinematic limits of a Lambda_c+ lighter than max_mass.
+
+    sigma and pions are (n, 4) four-vectors of one event, charge the pion charges.
+    """
+    if len(sigma) == 0 or len(pions) == 0:
+        return np.zeros(len(pions), bool)
+    m_sigma = kinematics.mass(sigma)
+    # Pairs with an opposite charge pion
+    m_pi_pi = kinematics.mass(pions[:, None, :], pions[None, :, :])
+    opposite = charge[:, None] != charge[None, :]
+    pi_pi = (opposite & (m_pi_pi <= max_mass - m_sigma.min())).any(axis = 1)
+    m_sigma_pi = kinematics.mass(pions[:, None, :], sigma[None, :, :])
+    sigma_pi = (m_sigma_pi <= max_mass - PION_MASS).any(axis = 1)
+    return pi_pi & sigma_pi
+
+def triples(charge, keep = None):
+    """
+    Return the number of pi+ pi- pairs (times the Sigma+ candidates: triples) of an event.
+    """
+    if keep is not None:
+        charge = charge[keep]
+    return int((charge > 0).sum()) * int((charge < 0).sum())
+
+if b2 is not None:
+    class PionPrune(b2.Module):
+        """
+        Remove the pions of a list which cannot be in a Lambda_c+ candidate below max_mass.
+        """
+        def __init__(self, listname, sigma_list, max_mass):
+            super().__init__()
+            self.listname = listname
+            self.sigma_list = sigma_list
+            self.max_mass = max_mass
+
+        @staticmethod
+        def four_vectors(particles):
+            return np.array([[p.getPx(), p.getPy(), p.getPz(), p.getEnergy()] for p in particles],
+                            np.float64).reshape(-1, 4)
+
+        def event(self):
+            plist = Belle2.PyStoreObj(self.listname)
+            if not plist.isValid() or plist.obj().getListSize() == 0:
+                return
+            slist = Belle2.PyStoreObj(self.sigma_list)
+            nsigma = slist.obj().getListSize() if slist.isValid() else 0
+            sigma = self.four_vectors([slist.obj().getParticle(i) for i in range(nsigma)])
+            # The list and its anti-list: both pion charges
+            pions = [plist.obj().getParticle(i) for i in range(plist.obj().getListSize())]
+            charge = np.array([p.getCharge() for p in pions])
+            keep = keep_pions(sigma, self.four_vectors(pions), charge, self.max_mass)
+            remove = std.vector('unsigned int')()
+            for p, k in zip(pions, keep):
+                if not k:
+                    remove.push_back(p.getArrayIndex())
+            plist.obj().removeParticles(remove)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Count the Lambda_c+ triples with and without the pion pre-check')
+    parser.add_argument('source', help = 'dir of ROOT files or Parquet dataset with four-vectors')
+    parser.add_argument('--tree', default = 'lambda_c', help = 'tree name')
+    parser.add_argument('--max_mass', type = float, default = 2.4, help = 'highest Lambda_c+ mass')
+    args = parser.parse_args()
+
+    # The ntuple holds the daughters of the candidates: rebuild the lists of each event from them
+    import ntuple
+    nt = ntuple.Ntuple(args.source, args.tree)
+    event = ['__experiment__', '__run__', '__event__']
+    before = after = nevents = candidates = lost = 0
+    for chunk in nt.iterate(event + kinematics.columns(['sigma', 'pi_plus', 'pi_minus']) + ['M']):
+        sigma, pi_plus, pi_minus = (kinematics.four_vector(chunk, d) for d in ['sigma', 'pi_plus', 'pi_minus'])
+        key = np.stack([chunk[c] for c in event], axis = -1)
+        _, start = np.unique(key, axis = 0, return_index = True)
+        bounds = list(np.sort(start)) + [len(key)]
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            s = np.unique(sigma[lo:hi], axis = 0)
+            pions, index = np.unique(np.concatenate([pi_plus[lo:hi], pi_minus[lo:hi]]), axis = 0,
+                                     return_inverse = True)
+            index = index.ravel()
+            charge = np.zeros(len(pions))
+            charge[index[:hi - lo]] = 1
+            charge[index[hi - lo:]] = -1
+            keep = keep_pions(s, pions, charge, args.max_mass)
+            before += len(s) * triples(charge)
+            after += len(s) * triples(charge, keep)
+            # Candidates in the mass window whose pions would be removed (should be none)
+            inside = chunk['M'][lo:hi] <= args.max_mass
+            lost += int((inside & ~(keep[index[:hi - lo]] & keep[index[hi - lo:]])).sum())
+            candidates += int(inside.sum())
+            nevents += 1
+    print('%d events, %d candidates below %.3f GeV' % (nevents, candidates, args.max_mass))
+    print('Triples per event: %.2f without, %.2f with the pion pre-check (%.1f%% of the combinations)' %
+          (before / max(nevents, 1), after / max(nevents, 1), 100 * after / max(before, 1)))
+    print('Candidates lost: %d' % lost)
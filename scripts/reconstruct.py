@@ -0,0 +1,29 @@
+# Several Sigma+/Lambda_c+ selections in one pass over the mdst
+#
+# The B2BII conversion and all particle lists the selections agree on are
+# done once, and every selection writes its own tree <tree>_<variant>
+# (good_v6, good_v7, lambda_c_lambdac, ...) to the output file. The variants
+# are chosen with the RECO_VARIANTS environment variable (comma separated
+# names of reconstruction.VARIANTS, default all) and RECO_MC=0 selects the
+# data database. RECO_FOUR_VECTORS=1 adds the daughter four-vectors of
+# kinematics.py to all trees:
+#
+#   RECO_VARIANTS=v6,v7 ./submit.py reconstruct.py ../data/v6v7 --exp 55 --run_start 1 --run_end 50
+import os
+import sys
+
+import reconstruction
+
+names = os.getenv('RECO_VARIANTS', ','.join(reconstruction.VARIANTS)).split(',')
+unknown = [name for name in names if name not in reconstruction.VARIANTS]
+if unknown:
+    sys.exit('Unknown variants %s, choose from %s' % (unknown, list(reconstruction.VARIANTS)))
+configs = [reconstruction.VARIANTS[name] for name in names]
+if os.getenv('RECO_FOUR_VECTORS', '0') != '0':
+    configs = [dict(config, four_vectors = True) for config in configs]
+
+# Usage: basf2 <script> <input mdst> [<input mdst> ...] <output root>
+input_files = sys.argv[1:-1]
+output_file = sys.argv[-1]
+
+reconstruction.run(configs, input_files, output_file, is_mc = os.getenv('RECO_MC', '1') != '0')
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+
+# Shared Sigma+ and Lambda_c+ reconstruction
+#
+# A selection is described by a cut configuration (a plain dict, see
+# SIGMA_V6, SIGMA_V7 and LAMBDAC below) and added to a basf2 path with
+#
+#   reco = Reconstruction(mp, multi = True)
+#   reco.add(SIGMA_V6, output_file)
+#   reco.add(SIGMA_V7, output_file)
+#
+# or, for a whole steering script, with run([SIGMA_V6, SIGMA_V7], ...),
+# which first adds reco.gate(configs): events without the particles any
+# configuration needs are dropped before the first combiner.
+#
+# Several configurations can be added to the same path. Every particle list
+# is identified by how it is made (source lists, cuts and fits), so a list
+# two configurations agree on is built once and shared. With multi = True
+# the list and tree names get the name of the configuration which first
+# needed them as a suffix (p+:berger_v6, good_v7, ...), so one pass over the
+# mdst (and one B2BII conversion) produces all variants.
+#
+# Only modularAnalysis, the variable manager and path.add_module are used,
+# and all three can be handed in, so the path construction can be checked
+# with stubs outside basf2.
+import os
+from contextlib import contextmanager
+
+SIGMA_MASS = 1.18937
+LAMBDAC_MASS = 2.28646
+PION_MASS = 0.13957
+
+# Best-candidate rankings: name -> (basf2 variable, higher is better). A
+# variable only defined on some lists is given per particle of the list.
+RANKINGS = {
+    'chiProb': ('chiProb', True),
+    'dM': ('abs(dM)', False),
+    # MVAExpert sets Sigma_mva on the Sigma+ of the Lambda_c+ selection only
+    'Sigma_mva': ({'Lambda_c+': 'daughter(0, extraInfo(Sigma_mva))'}, True),
+}
+
+FOUR_VECTOR = ['px', 'py', 'pz', 'E']
+
+# pi0 cuts not needing the vertex fit, for the v7_prefit variant only. They
+# are taken on the raw photons, while the sigma_good cuts are taken after the
+# first vertexTree has refitted them at the Sigma+ vertex, which can move a
+# photon energy or the diphoton mass across the margin. Make them the default
+# only once compare_ntuples.py finds no candidate of v7 lost in v7_prefit on
+# a reference mdst (RECO_VARIANTS=v7,v7_prefit with reconstruct.py).
+PI0_PREFIT = ('daughter(0, E) > 0.025 and daughter(1, E) > 0.025 and p > 0.04 and '
+              'InvM >= 0.09 and InvM <= 0.18')
+
+# Sigma+ selection of sigma_v6.py
+SIGMA_V6 = dict(
+    name = 'v6',
+    tree = 'good',
+    ntuple = 'sigma',
+    mc_match = True,
+    # M Berger: standard pairwise PID > 0.6
+    proton = 'pid_ppi > 0.6 and pid_pk > 0.6',
+    # Cuts not needing the vertex fit, applied before the first tree fit
+    pi0 = '',
+    sigma_loose = 'M >= 1.15 and M <= 1.23',
+    # M Berger: photons > 40 MeV and pi0 lab frame momentum > 100 MeV
+    sigma_good = 'gamma1_E > 0.05 and gamma2_E > 0.05 and pi0_M >= 0.11 and pi0_M <= 0.16 and pi0_p > 0.1',
+    sigma_mass = 'M >= 1.17 and M <= 1.21',
+    # Keep only the best keep candidates per event by one of RANKINGS (None: keep all)
+    rank = None,
+    keep = 1,
+    # Keep all signal and this fraction of the background, see sampling.py (None: keep all)
+    sample = None,
+    sample_seed = 0,
+    # Write px, py, pz, E of the daughters for offline kinematics, see kinematics.py
+    four_vectors = False,
+    # Event gate before the combiners: lowest photon energy of a pi0 (None: no gate)
+    gate_photon_E = 0.025,
+)
+
+# Sigma+ selection of sigma_v7.py: looser photon energy and pi0 momentum cuts
+SIGMA_V7 = dict(SIGMA_V6,
+    name = 'v7',
+    sigma_good = 'gamma1_E > 0.03 and gamma2_E > 0.03 and pi0_M >= 0.11 and pi0_M <= 0.16 and pi0_p > 0.05',
+)
+
+# Lambda_c+ -> Sigma+ pi+ pi- selection of recon_lambdac.py
+LAMBDAC = dict(SIGMA_V7,
+    name = 'lambdac',
+    tree = 'lambda_c',
+    ntuple = 'lambdac',
+    mva_identifier = 'MVA_Sigma_p.root',
+    mva_cut = 'extraInfo(Sigma_mva) > 0.2',
+    # Pion PID vetoes on the pion list, before combining (the same as on every triple)
+    pion = 'pid_ppi < 0.6 and pid_kpi < 0.6',
+    # Remove pions without a pi+ pi- and Sigma+ pi pair below the limits of this mass, see pruning.py
+    prune = 2.4,
+    lambdac_loose = 'M >= 2.2 and M <= 2.4',
+    lambdac_mass = 'M >= 2.24 and M <= 2.34',
+)
+
+# LAMBDAC as before the pion pre-filters: vetoes on every triple, for comparing the cut flows
+LAMBDAC_ALL = dict(LAMBDAC,
+    name = 'lambdac_all',
+    pion = '',
+    prune = None,
+    lambdac_loose = ('pi_plus_pid_ppi < 0.6 and pi_plus_pid_kpi < 0.6 and '
+                     'pi_minus_pid_ppi < 0.6 and pi_minus_pid_kpi < 0.6 and '
+                     'M >= 2.2 and M <= 2.4'),
+)
+
+# LAMBDAC with loose impact parameter cuts on the pions. The values are not
+# tuned: check their efficiency in the pi+:lamc stage of the cut flow on a
+# reference sample before using them
+LAMBDAC_IP = dict(LAMBDAC,
+    name = 'lambdac_ip',
+    pion = LAMBDAC['pion'] + ' and dr < 2 and abs(dz) < 4',
+)
+
+# SIGMA_V7 with the pi0 pre-fit cuts, to be validated against SIGMA_V7
+SIGMA_V7_PREFIT = dict(SIGMA_V7,
+    name = 'v7_prefit',
+    pi0 = PI0_PREFIT,
+)
+
+# SIGMA_V7 with the candidate closest to the Sigma+ mass in each event
+SIGMA_V7_BEST = dict(SIGMA_V7,
+    name = 'v7best',
+    rank = 'dM',
+)
+
+# SIGMA_V7 training sample for MVA_Sigma_p.root: sig:bkg ~ 1:1
+SIGMA_V7_TRAIN = dict(SIGMA_V7,
+    name = 'v7train',
+    tree = 'train',
+    sample = 0.01,
+)
+
+VARIANTS = {config['name']: config for config in [SIGMA_V6, SIGMA_V7, SIGMA_V7_PREFIT, SIGMA_V7_BEST, SIGMA_V7_TRAIN,
+                                                  LAMBDAC, LAMBDAC_ALL, LAMBDAC_IP]}
+
+def print_env():
+    """
+    Print relevant environmental variables.
+    """
+    import datetime
+    envs = ['BELLE2_EXTERNALS_DIR',
+            'BELLE2_EXTERNALS_SUBSIR',
+            'BELLE2_EXTERNALS_OPTION',
+            'BELLE2_EXTERNALS_VERSION',
+            'BELLE2_LOCAL_DIR',
+            'BELLE2_OPTION',
+            'BELLE2_RELEASE',
+            'BELLE_POSTGRES_SERVER',
+            'USE_GRAND_REPROCESS_DATA',
+            'PANTHER_TABLE_DIR',
+            'PGUSER']
+    print("Current time is %s" % datetime.datetime.now())
+    print()
+    print("[Environmental variables]")
+    for var in envs:
+        print("%30s = %s" % (var, os.getenv(var)))
+    print()
+
+def ntuple_vars(config):
+    """
+    Return the ntuple variables of a configuration.
+    """
+    event_vars = ['IPX', 'IPY', 'IPZ']
+    if config['ntuple'] == 'sigma':
+        sigma_vars = ['p', 'pt', 'pz', 'E', 'M',
+                      'charge', 'distance', 'significanceOfDistance',
+                      'cosa', 'cosaXY',
+                      'mcPDG', 'genMotherPDG', 'isSignal']
+        proton_vars = ['p_' + v for v in ['p', 'dr', 'dz', 'pid_ppi', 'pid_pk', 'pid_kpi',
+                                          'isSignal', 'genMotherPDG']]
+        pi0_vars = ['pi0_' + v for v in ['p', 'M', 'mcPDG', 'genMotherPDG', 'isSignal',
+                                         'distance', 'significanceOfDistance']]
+        gamma_vars = [f'{g}_{v}' for g in ['gamma1', 'gamma2']
+                      for v in ['phi', 'theta', 'E', 'goodBelleGamma', 'clusterReg', 'clusterE9E21',
+                                'clusterTiming', 'clusterErrorTiming', 'genMotherPDG', 'isSignal']]
+        names = sigma_vars + proton_vars + pi0_vars + gamma_vars + event_vars
+    else:
+        lamc_pi_vars = [f'{pi}_{v}' for pi in ['pi_plus', 'pi_minus']
+                        for v in ['p', 'M', 'dr', 'dz', 'pid_ppi', 'pid_kpi', 'pid_pk',
+                                  'mcPDG', 'genMotherPDG', 'isSignal']]
+        lamc_sigma_vars = ['sigma_' + v for v in ['p', 'M', 'dr', 'dz', 'mcPDG', 'genMotherPDG',
+                                                  'isSignal', 'Sigma_mva']]
+        dalitz_vars = ['m_sigma_pi_plus', 'm_sigma_pi_minus', 'm_pi_pi']
+        lamc_vars = ['M', 'p', 'distance', 'significanceOfDistance', 'chiProb', 'xp',
+                     'mcPDG', 'genMotherPDG', 'isSignal']
+        names = lamc_pi_vars + lamc_sigma_vars + dalitz_vars + lamc_vars
+    if config['four_vectors']:
+        daughters = ['p', 'pi0'] if config['ntuple'] == 'sigma' else ['sigma', 'pi_plus', 'pi_minus']
+        names += [f'{d}_{v}' for d in daughters for v in FOUR_VECTOR]
+    if config['sample']:
+        names.append('sample_weight')
+    return names
+
+class Reconstruction:
+    """
+    Add the Sigma+/Lambda_c+ selections of cut configurations to a path.
+    """
+    def __init__(self, path, multi = False, cf = None, ma = None, variables = None,
+                 create_aliases_for_selected = None):
+        if ma is None:
+            import modularAnalysis as ma
+        if variables is None:
+            from variables import variables
+        if create_aliases_for_selected is None:
+            from variables.utils import create_aliases_for_selected
+        self.path = path
+        self.multi = multi
+        self.cf = cf
+        self.ma = ma
+        self.variables = variables
+        self.create_aliases_for_selected = create_aliases_for_selected
+        # recipe -> list name
+        self.lists = {}
+        self.names = set()
+        self.trees = []
+        self.add_aliases()
+
+    def add_aliases(self):
+        """
+        Define the aliases used by the cuts and the ntuples.
+        """
+        v = self.variables
+        v.addAlias('pid_ppi', 'atcPIDBelle(4,2)')
+        v.addAlias('pid_pk', 'atcPIDBelle(4,3)')
+        v.addAlias('pid_kpi', 'atcPIDBelle(3,2)')
+
+        v.addAlias('cosa', 'cosAngleBetweenMomentumAndVertexVector')
+        v.addAlias('cosaXY', 'cosAngleBetweenMomentumAndVertexVectorInXYPlane')
+        v.addAlias('Sigma_mva', 'extraInfo(Sigma_mva)')
+        v.addAlias('sample_weight', 'extraInfo(sample_weight)')
+
+        # Dalitz variables
+        v.addAlias('m_sigma_pi_plus', 'daughterInvM(0, 1)')
+        v.addAlias('m_sigma_pi_minus', 'daughterInvM(0, 2)')
+        v.addAlias('m_pi_pi', 'daughterInvM(1, 2)')
+
+        # Daughter aliases used by the cuts; the ntuple lists below select from them
+        cafs = self.create_aliases_for_selected
+        cafs(['p', 'dr', 'dz', 'pid_ppi', 'pid_pk', 'pid_kpi', 'isSignal', 'genMotherPDG'] + FOUR_VECTOR,
+             'Sigma+ -> ^p+ pi0', prefix = ['p'])
+        cafs(['p', 'M', 'mcPDG', 'genMotherPDG', 'isSignal', 'distance', 'significanceOfDistance'] + FOUR_VECTOR,
+             'Sigma+ -> p+ ^pi0', prefix = ['pi0'])
+        cafs(['phi', 'theta', 'E', 'goodBelleGamma', 'clusterReg', 'clusterE9E21',
+              'clusterTiming', 'clusterErrorTiming', 'genMotherPDG', 'isSignal'],
+             'Sigma+ -> p+ [pi0 -> ^gamma ^gamma]', prefix = ['gamma1', 'gamma2'])
+        cafs(['p', 'M', 'dr', 'dz', 'pid_ppi', 'pid_kpi', 'pid_pk', 'mcPDG', 'genMotherPDG', 'isSignal'] +
+             FOUR_VECTOR, 'Lambda_c+ -> Sigma+ ^pi+ ^pi-', prefix = ['pi_plus', 'pi_minus'])
+        cafs(['p', 'M', 'dr', 'dz', 'mcPDG', 'genMotherPDG', 'isSignal', 'Sigma_mva'] + FOUR_VECTOR,
+             'Lambda_c+ -> ^Sigma+ pi+ pi-', prefix = ['sigma'])
+
+    @contextmanager
+    def stage(self, name, out, inputs = None, combine = False):
+        """
+        Cut-flow stage around the modules added inside the block, if a cut flow is kept.
+        """
+        if self.cf is None:
+            yield
+        else:
+            with self.cf.stage(name, self.path, out = out, inputs = inputs, combine = combine):
+                yield
+
+    def list_name(self, particle, label, config):
+        name = f'{particle}:{label}_{config["name"]}' if self.multi else f'{particle}:{label}'
+        assert name not in self.names, f'Particle list {name} defined twice'
+        self.names.add(name)
+        return name
+
+    def make(self, particle, label, config, create, post = ()):
+        """
+        Return the list made by a recipe, adding its modules if it is new.
+
+        create is ('copy', source, cut) or ('decay', daughters, cut) and post a
+        sequence of in-place steps ('fit', kwargs, stage), ('cut', cut, stage),
+        ('rank', (variable, highest, keep), stage), ('sample', (fraction, seed),
+        stage), ('prune', (sigma list, max mass), stage) or ('mva', (identifier,
+        extraInfoName), stage). A step with a stage name starts a new cut-flow
+        stage, {name} being replaced by the list name.
+        """
+        recipe = (particle, create, tuple((op, repr(arg), stage) for op, arg, stage in post))
+        if recipe in self.lists:
+            return self.lists[recipe]
+        name = self.list_name(particle, label, config)
+        self.lists[recipe] = name
+
+        segments = [(name, [])]
+        for step in post:
+            if step[2] is not None:
+                segments.append((step[2].format(name = name), []))
+            segments[-1][1].append(step)
+
+        kind, source, cut = create
+        if kind == 'copy':
+            with self.stage(name, name, inputs = [source]):
+                self.ma.cutAndCopyList(name, source, cut, path = self.path)
+                self.steps(name, segments[0][1])
+        else:
+            with self.stage(name, name, inputs = list(source), combine = True):
+                self.ma.reconstructDecay(f'{name} -> ' + ' '.join(source), cut, path = self.path)
+                self.steps(name, segments[0][1])
+        for stage, steps in segments[1:]:
+            with self.stage(stage, name):
+                self.steps(name, steps)
+        return name
+
+    def steps(self, name, steps):
+        """
+        Add in-place steps working on one list.
+        """
+        for op, arg, _ in steps:
+            if op == 'fit':
+                self.ma.vertexTree(name, 0, path = self.path, **arg)
+            elif op == 'cut':
+                if arg:
+                    self.ma.applyCuts(name, arg, path = self.path)
+            elif op == 'rank':
+                variable, highest, keep = arg
+                rank = self.ma.rankByHighest if highest else self.ma.rankByLowest
+                rank(name, variable, numBest = keep, path = self.path)
+            elif op == 'sample':
+                import sampling
+                fraction, seed = arg
+                self.path.add_module(sampling.Downsample(name, fraction, seed))
+            elif op == 'prune':
+                import pruning
+                sigma, max_mass = arg
+                self.path.add_module(pruning.PionPrune(name, sigma, max_mass))
+            elif op == 'mva':
+                identifier, extra_info = arg
+                self.path.add_module('MVAExpert', listNames = [name], extraInfoName = extra_info,
+                                     identifier = identifier)
+            else:
+                raise ValueError(f'Unknown step {op}')
+
+    def proton(self, config):
+        """
+        Return the proton list of a configuration.
+        """
+        if 'p+:all' not in self.names:
+            self.ma.fillParticleList('p+:all', '', path = self.path)
+            self.names.add('p+:all')
+        return self.make('p+', 'berger', config, ('copy', 'p+:all', config['proton']))
+
+    def pions(self, config):
+        """
+        Return the pi+ list of a Lambda_c+ configuration, before the pair pre-check.
+        """
+        if 'pi+:all' not in self.names:
+            self.ma.fillParticleList('pi+:all', '', path = self.path)
+            self.names.update(['pi+:all', 'pi-:all'])
+        if not config['pion']:
+            return 'pi+:all'
+        return self.make('pi+', 'lamc', config, ('copy', 'pi+:all', config['pion']))
+
+    def gate(self, configs):
+        """
+        Drop the events none of the configurations can make a candidate of.
+
+        An event passes if, for one configuration, it has a proton, a pi0 with
+        both photons above gate_photon_E and, for Lambda_c+, two pions. The
+        gate goes before all combiners, so add it before the configurations.
+        """
+        if any(config['gate_photon_E'] is None for config in configs):
+            return
+        terms = []
+        for config in configs:
+            energy = config['gate_photon_E']
+            pi0 = self.make('pi0', 'gate', config,
+                            ('copy', 'pi0:mdst', f'daughter(0, E) > {energy} and daughter(1, E) > {energy}'))
+            term = f'nParticlesInList({self.proton(config)}) > 0 and nParticlesInList({pi0}) > 0'
+            if config['ntuple'] == 'lambdac':
+                term += f' and nParticlesInList({self.pions(config)}) > 1'
+            terms.append(term)
+        # A configuration needing more than another adds nothing to the or
+        terms = [term for i, term in enumerate(terms)
+                 if not any(term == other and j < i or term.startswith(other + ' and ')
+                            for j, other in enumerate(terms))]
+        cut = terms[0] if len(terms) == 1 else ' or '.join(f'[{term}]' for term in terms)
+        # An event stage: applyEventCuts ends the path of the events it drops,
+        # so the events reaching the end of the stage are the ones passing the
+        # gate, whichever configuration they pass for. The pass rate is the
+        # Pass column of this stage in the cut flow.
+        with self.stage('event gate', None):
+            self.ma.applyEventCuts(cut, path = self.path)
+
+    def sigma(self, config):
+        """
+        Add the Sigma+ -> p+ pi0 selection and return the name of the good list.
+        """
+        proton = self.proton(config)
+        pi0 = self.make('pi0', 'loose', config, ('copy', 'pi0:mdst', config['pi0']))
+        # Set updateAllDaughters = True because the pi0:mdst list is mass constrained
+        loose = self.make('Sigma+', 'loose', config, ('decay', (proton, pi0), config['sigma_loose']),
+                          [('fit', dict(ipConstraint = True, updateAllDaughters = True),
+                            'vertexTree {name}')])
+        good = self.make('Sigma+', 'good', config, ('copy', loose, config['sigma_good']),
+                         [('fit', dict(ipConstraint = True, massConstraint = [111]), None),
+                          ('cut', config['sigma_mass'], None)])
+        return good
+
+    def lambdac(self, config, sigma):
+        """
+        Add the Lambda_c+ -> Sigma+ pi+ pi- selection on top of a Sigma+ list.
+        """
+        sigma = self.make('Sigma+', 'mva', config, ('copy', sigma, ''),
+                          [('mva', (config['mva_identifier'], 'Sigma_mva'), 'MVAExpert'),
+                           ('cut', config['mva_cut'], None)])
+        pion = self.pions(config)
+        if config['prune']:
+            pion = self.make('pi+', 'pruned', config, ('copy', pion, ''),
+                             [('prune', (sigma, config['prune']), 'prune {name}')])
+        anti = pion.replace('pi+', 'pi-')
+        return self.make('Lambda_c+', 'loose', config, ('decay', (sigma, pion, anti), config['lambdac_loose']),
+                         [('fit', dict(massConstraint = [3222]), None),
+                          ('cut', config['lambdac_mass'], None)])
+
+    def best(self, config, plist):
+        """
+        Copy a list keeping the best candidates of each event.
+        """
+        variable, highest = RANKINGS[config['rank']]
+        particle = plist.split(':')[0]
+        if isinstance(variable, dict):
+            if particle not in variable:
+                raise ValueError(f'{config["name"]}: {config["rank"]} ranking is not defined on {particle} lists')
+            variable = variable[particle]
+        return self.make(particle, 'best', config, ('copy', plist, ''),
+                         [('rank', (variable, highest, config['keep']), 'rank {name}')])
+
+    def sample(self, config, plist):
+        """
+        Copy a truth-matched list keeping all signal and a fraction of the background.
+        """
+        if not config['mc_match']:
+            raise ValueError(f'{config["name"]}: downsampling needs the MC truth')
+        particle = plist.split(':')[0]
+        return self.make(particle, 'sampled', config, ('copy', plist, ''),
+                         [('sample', (config['sample'], config['sample_seed']), 'sample {name}')])
+
+    def add(self, config, output_file):
+        """
+        Add the selection of one configuration and its ntuple to the path.
+
+        Returns the name of the list written to the ntuple.
+        """
+        plist = self.sigma(config)
+        if config['ntuple'] == 'lambdac':
+            plist = self.lambdac(config, plist)
+        if config['rank']:
+            plist = self.best(config, plist)
+        if config['mc_match']:
+            self.ma.matchMCTruth(plist, path = self.path)
+        if config['sample']:
+            plist = self.sample(config, plist)
+        tree = f'{config["tree"]}_{config["name"]}' if self.multi else config['tree']
+        self.path.add_module('VariablesToNtuple', particleList = plist,
+                             variables = ntuple_vars(config), treeName = tree, fileName = output_file)
+        self.trees.append(tree)
+        return plist
+
+def run(configs, input_files, output_file, is_mc = True):
+    """
+    Convert the Belle mdst once and write the ntuples of all configurations.
+
+    Skims written by skim.py are read as they are, without conversion.
+    """
+    import basf2 as b2
+    import b2biiConversion as b2c
+    import modularAnalysis as ma
+    import cutflow
+    import skim
+
+    b2c.setupB2BIIDatabase(isMC = is_mc)
+    print_env()
+
+    # Show input and output file info
+    print("Input: %s" % ' '.join(input_files))
+    print("Ouput: %s" % output_file)
+    print("Variants: %s" % ' '.join(config['name'] for config in configs))
+
+    mp = b2.create_path()
+    # Candidates and time per reconstruction stage, written to <output>.cutflow.json
+    cf = cutflow.CutFlow(output_file)
+
+    skims = [skim.read_info(f) for f in input_files]
+    if all(skims):
+        # Converted by skim.py: read directly
+        loose = set()
+        for f, info in zip(input_files, skims):
+            print("Skim %s: hash %s, %d source files" % (f, info['hash'], len(info['sources'])))
+            for config in configs:
+                if not skim.compatible(config['proton'], info['proton']):
+                    loose.add((config['name'], info['proton']))
+        # The skim has lost events a looser proton cut would keep
+        for name, proton in sorted(loose):
+            b2.B2WARNING(f'Proton cut of {name} is looser than the skim cut {proton!r}')
+        ma.inputMdstList('Belle', input_files, path = mp)
+    elif any(skims):
+        b2.B2FATAL('Cannot mix skims and Belle mdst files in one job')
+    else:
+        b2c.convertBelleMdstToBelleIIMdst(input_files, applyHadronBJSkim=True, path=mp)
+
+    reco = Reconstruction(mp, multi = len(configs) > 1, cf = cf)
+    reco.gate(configs)
+    for config in configs:
+        reco.add(config, output_file)
+
+    cf.finish(mp)
+    b2.process(path=mp)
+    print(b2.statistics)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# Reproducible background downsampling for MVA training samples
+#
+# All truth-matched candidates are kept, and a background candidate is kept
+# when a hash of (experiment, run, event, candidate, seed) falls below the
+# kept fraction. The hash does not depend on basf2's random generator, so a
+# rerun selects exactly the same candidates. Kept candidates get the weight
+# 1 (signal) or 1 / fraction (background) in a sample_weight column.
+#
+# In the path, give a configuration of reconstruction.py a sample fraction
+# (see the v7train variant). On a merged Parquet dataset:
+#
+#   ./sampling.py ../data/v7.parquet ../data/v7_train.parquet --fraction 0.01
+#
+# The in-path stage hashes the position in the list before sampling, the
+# post-processing step the __candidate__ column, so the two select different
+# (but each reproducible) background candidates.
+import argparse
+import glob
+import os
+
+import numpy as np
+
+try:
+    import basf2 as b2
+    from ROOT import Belle2, std
+except ImportError:
+    # Post-processing does not need basf2
+    b2 = None
+
+WEIGHT = 'sample_weight'
+
+def splitmix64(x):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def sample_hash(exp, run, event, candidate, seed = 0):
+    """
+    Return a number in [0, 1) for every candidate, uniform and reproducible.
+    """
+    h = np.full(np.broadcast(exp, run, event, candidate).shape, seed, np.uint64)
+    with np.errstate(over = 'ignore'):
+        for values in (exp, run, event, candidate):
+            h = splitmix64(h ^ np.asarray(values).astype(np.int64).astype(np.uint64))
+    return (h >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+def check_fraction(fraction):
+    """
+    Return fraction if it is a fraction of the background one can keep, else raise ValueError.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError(f'The kept fraction must be in (0, 1], not {fraction}')
+    return fraction
+
+def fraction_arg(text):
+    """
+    Return the --fraction argument, checked.
+    """
+    try:
+        return check_fraction(float(text))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def keep_mask(signal, u, fraction):
+    """
+    Return the kept candidates and their weights.
+    """
+    keep = (signal == 1) | (u < fraction)
+    weight = np.where(signal == 1, 1.0, 1.0 / fraction).astype(np.float32)
+    return keep, weight
+
+if b2 is not None:
+    class Downsample(b2.Module):
+        """
+        Keep the signal and a hashed fraction of the background of a particle list.
+        """
+        def __init__(self, listname, fraction, seed = 0):
+            super().__init__()
+            self.listname = listname
+            self.fraction = check_fraction(fraction)
+            self.seed = seed
+
+        def initialize(self):
+            from variables import variables
+            self.manager = variables
+            self.meta = Belle2.PyStoreObj('EventMetaData')
+
+        def event(self):
+            plist = Belle2.PyStoreObj(self.listname)
+            if not plist.isValid() or plist.obj().getListSize() == 0:
+                return
+            meta = self.meta.obj()
+            particles = [plist.obj().getParticle(i) for i in range(plist.obj().getListSize())]
+            signal = np.array([self.manager.evaluate('isSignal', p) for p in particles])
+            u = sample_hash(meta.getExperiment(), meta.getRun(), meta.getEvent(),
+                            np.arange(len(particles)), self.seed)
+            keep, weight = keep_mask(signal, u, self.fraction)
+            remove = std.vector('unsigned int')()
+            for p, k, w in zip(particles, keep, weight):
+                if k:
+                    p.addExtraInfo(WEIGHT, float(w))
+                else:
+                    remove.push_back(p.getArrayIndex())
+            plist.obj().removeParticles(remove)
+
+def sample_file(path, dest, fraction, seed):
+    """
+    Write the sampled candidates of one Parquet file with their weights.
+
+    Returns the number of candidates before and after.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    f = pq.ParquetFile(path)
+    os.makedirs(os.path.dirname(dest), exist_ok = True)
+    before = after = 0
+    writer = None
+    try:
+        for i in range(f.num_row_groups):
+            table = f.read_row_group(i)
+            c = {name: table.column(name).to_numpy() for name in
+                 ['__experiment__', '__run__', '__event__', '__candidate__', 'isSignal']}
+            u = sample_hash(c['__experiment__'], c['__run__'], c['__event__'], c['__candidate__'], seed)
+            keep, weight = keep_mask(c['isSignal'], u, fraction)
+            table = table.append_column(WEIGHT, pa.array(weight)).filter(keep)
+            if writer is None:
+                writer = pq.ParquetWriter(dest, table.schema, compression = 'zstd')
+            writer.write_table(table)
+            before += len(keep)
+            after += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return before, after
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Keep the signal and a reproducible fraction of the background')
+    parser.add_argument('dataset', help = 'Parquet dataset dir (merge.py or columnar.py)')
+    parser.add_argument('outdir', help = 'dataset dir to write')
+    parser.add_argument('--tree', default = 'good', help = 'tree name')
+    parser.add_argument('--fraction', type = fraction_arg, default = 0.01,
+                        help = 'fraction of the background kept, in (0, 1]')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed of the hash')
+    args = parser.parse_args()
+
+    indir = os.path.join(args.dataset, args.tree)
+    files = sorted(glob.glob(os.path.join(indir, '**', '*.parquet'), recursive = True))
+    before = after = 0
+    for path in files:
+        n, k = sample_file(path, os.path.join(args.outdir, args.tree, os.path.relpath(path, indir)),
+                           args.fraction, args.seed)
+        before += n
+        after += k
+    print('Kept %d of %d candidates (%.2f%%) in %d files' %
+          (after, before, 100 * after / max(before, 1), len(files)))
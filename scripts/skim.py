@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# Skim once, reconstruct many
+#
+# As a basf2 steering script this converts the Belle mdst once and writes
+# the events with at least one p+:berger and one pi0:mdst candidate to a
+# converted Belle II udst. Next to it goes <output>.skim.json, recording the
+# source mdst files (path, size, mtime and SHA-1 of their content) and the
+# proton cut of the skim:
+#
+#   ./submit.py skim.py ../data/skim --exp 55 --run_start 1 --run_end 50
+#
+# The steering scripts built on reconstruction.py read such a file directly,
+# without conversion, and submit.py picks the skims up with
+#
+#   ./submit.py sigma_v7.py ../data/v7 --exp 55 --run_start 1 --run_end 50 --skim ../data/skim
+#
+# A skim is only used while its source files have not changed, and only
+# holds events every configuration with a proton cut at least as tight as
+# the skim cut would keep: the skim cut itself, or it and further cuts
+# (see compatible()).
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import reconstruction
+
+SUFFIX = '.skim.json'
+
+# Events kept by the skim; the proton cut is the loosest one of the configurations
+PROTON = reconstruction.SIGMA_V6['proton']
+EVENT_CUT = 'nParticlesInList(p+:skim) > 0 and nParticlesInList(pi0:mdst) > 0'
+# Lists converted from the Belle mdst which are stored in the skim
+PARTICLE_LISTS = ['pi0:mdst', 'gamma:mdst']
+
+def sha1sum(path, blocksize = 1 << 20):
+    """
+    Return the SHA-1 of the content of a file.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def describe(path, sha1 = None):
+    """
+    Return the record of one source file.
+    """
+    st = os.stat(path)
+    return dict(path = path, size = st.st_size, mtime = st.st_mtime, sha1 = sha1)
+
+def content_hash(sources):
+    """
+    Return one hash over the content of all source files, independent of their order.
+    """
+    return hashlib.sha1('\n'.join(sorted(s['sha1'] for s in sources)).encode()).hexdigest()
+
+def read_info(path):
+    """
+    Return the side-car record of a skim file, or None if it is not a skim.
+    """
+    try:
+        with open(path + SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def compatible(proton, skim_proton = PROTON):
+    """
+    Return whether a proton cut is at least as tight as the skim cut: it has all of its 'and' terms.
+    """
+    terms = lambda cut: {term.strip() for term in cut.split(' and ') if term.strip()}
+    return terms(skim_proton) <= terms(proton)
+
+def is_skim(path):
+    return read_info(path) is not None
+
+def is_fresh(info, verify = False):
+    """
+    Check that the source files of a skim are unchanged.
+
+    By default the size and mtime are compared; verify = True rehashes the content.
+    """
+    for source in info['sources']:
+        try:
+            current = describe(source['path'])
+        except OSError:
+            return False
+        if (current['size'], current['mtime']) != (source['size'], source['mtime']):
+            return False
+        if verify and sha1sum(source['path']) != source['sha1']:
+            return False
+    return True
+
+def find_skims(skimdir, verify = False):
+    """
+    Return a dict mapping source mdst paths to the fresh skim file covering them.
+    """
+    skims = {}
+    for sidecar in sorted(glob.glob(os.path.join(skimdir, '*' + SUFFIX))):
+        path = sidecar[:-len(SUFFIX)]
+        info = read_info(path)
+        if info is None or not os.path.exists(path) or not is_fresh(info, verify):
+            continue
+        for source in info['sources']:
+            skims[source['path']] = path
+    return skims
+
+def replace_inputs(dataset, skims):
+    """
+    Return the skim files covering a list of mdst files and the mdst files not covered.
+    """
+    files = []
+    missing = []
+    for mdst in dataset:
+        if mdst not in skims:
+            missing.append(mdst)
+        elif skims[mdst] not in files:
+            files.append(skims[mdst])
+    return files, missing
+
+class Hasher(threading.Thread):
+    """
+    Hash the source files in the background while basf2 reads them.
+    """
+    def __init__(self, paths):
+        super().__init__(daemon = True)
+        self.paths = paths
+        self.sources = []
+
+    def run(self):
+        self.sources = [describe(path, sha1sum(path)) for path in self.paths]
+
+def write_info(output_file, sources, events = None):
+    info = dict(sources = sources,
+                hash = content_hash(sources),
+                proton = PROTON,
+                event_cut = EVENT_CUT,
+                particle_lists = PARTICLE_LISTS,
+                events = events)
+    with open(output_file + SUFFIX, 'w') as f:
+        json.dump(info, f, indent = 1)
+    return info
+
+if __name__ == '__main__':
+    import basf2 as b2
+    import modularAnalysis as ma
+    import b2biiConversion as b2c
+    import udst
+
+    import cutflow
+    from variables import variables
+
+    is_mc = os.getenv('RECO_MC', '1') != '0'
+    b2c.setupB2BIIDatabase(isMC = is_mc)
+    reconstruction.print_env()
+
+    # Usage: basf2 skim.py <input mdst> [<input mdst> ...] <output udst>
+    input_files = sys.argv[1:-1]
+    output_file = sys.argv[-1]
+    print("Input: %s" % ' '.join(input_files))
+    print("Ouput: %s" % output_file)
+
+    hasher = Hasher(input_files)
+    hasher.start()
+
+    mp = b2.create_path()
+    cf = cutflow.CutFlow(output_file)
+
+    b2c.convertBelleMdstToBelleIIMdst(input_files, applyHadronBJSkim=True, path=mp)
+
+    variables.addAlias('pid_ppi', 'atcPIDBelle(4,2)')
+    variables.addAlias('pid_pk', 'atcPIDBelle(4,3)')
+
+    ma.fillParticleList('p+:all', '', path = mp)
+    with cf.stage('p+:skim', mp, out = 'p+:skim', inputs = ['p+:all']):
+        ma.cutAndCopyList('p+:skim', 'p+:all', PROTON, path = mp)
+    with cf.stage('skim', mp, out = 'pi0:mdst'):
+        ma.applyEventCuts(EVENT_CUT, path = mp)
+
+    udst.add_udst_output(path = mp, filename = output_file, particleLists = PARTICLE_LISTS)
+
+    cf.finish(mp)
+    b2.process(path=mp)
+    print(b2.statistics)
+
+    hasher.join()
+    info = write_info(output_file, hasher.sources, events = cf.stages['skim']['events_out'])
+    print("Skim hash: %s" % info['hash'])
@@ -3,7 +3,6 @@
 # Submit jobs based on user scrpits
 #
 #
-import b2biiConversion as b2c
 import argparse
 import glob
 import os
@@ -11,39 +10,130 @@ import sys
 import logging
 import shutil
 from termcolor import colored
-import multiprocessing as mp
 import tqdm
 
+import batch
+import catalogue
+import ledger
+import monitor
+import packing
+import skim
+
 BELLE_EVENT_TYPES = ['Any', 'evtgen-mixed', 'evtgen-charged', 'evtgen-charm', 'evtgen-uds']
 BELLE_DATA_TYPES = ['Any']
 
 def get_mdst_list(is_data, exp, run_start = 1, run_end = 9999, 
                   event_type = 'Any', data_type = 'Any', 
-                  belle_level = 'caseB', stream = 0):
+                  belle_level = 'caseB', stream = 0, cat = None):
     """
     Return mdst file list from Belle File Search Engine.
+
+    If a catalogue is given the list is served from its cache.
     """
     
     if not is_data:
         assert event_type in ['Any', 'evtgen-mixed', 'evtgen-charged', 'evtgen-charm', 'evtgen-uds']
-        url =  f'http://bweb3.cc.kek.jp/montecarlo.php?ex={exp}&rs={run_start}&re={run_end}&ty={event_type}&dt={data_type}&bl={belle_level}&st={stream}'
+        if cat is not None:
+            return cat.get_mc(exp, run_start, run_end, event_type, data_type, belle_level, stream)
+        url = catalogue.mc_url(exp, run_start, run_end, event_type, data_type, belle_level, stream)
     else:
         raise Exception("Not implemented")
     print(f'[get_mdst_list] Getting mdst from {url}')
-    return b2c.parse_process_url(url)    
+    return catalogue.fetch_b2c(url)
 
-def submit_one(script, mdstpath, outdir, queue = 's', b2opt = ""):
+def submit_one(script, mdstpath, outdir, queue = 's', b2opt = "", template = batch.BASF2_TEMPLATE):
     """
-    Submit one job for one mdst file
+    Submit one job for one mdst file and return its LSF job id (None if failed)
+
+    With template = memprof.TEMPLATE the job samples its memory use.
     """
-    base = os.path.basename(mdstpath)
-    rootname = base + '.root'
-    logname = base + '.log'
-    rootpath = os.path.join(outdir, rootname)
-    logpath = os.path.join(outdir, logname)
-    return os.system(f'bsub -q {queue} -oo {logpath} basf2 {b2opt} {script} {mdstpath} {rootpath} >> /dev/null')
+    job, = batch.make_jobs(script, [[mdstpath]], outdir, b2opt = b2opt, template = template)
+    batch.Submitter(batch.LSFBackend(queue), nworkers = 1).submit([job])
+    return job.job_id
     
+def add_backend_options(parser):
+    """
+    Add the options choosing and tuning the backend running the jobs.
+    """
+    parser.add_argument('--backend', default = 'lsf', choices = ['lsf', 'local'],
+                        help = 'submit to LSF or run the jobs on this machine')
+    parser.add_argument('--command', default = batch.BASF2_TEMPLATE,
+                        help = 'command template using {script}, {inputs}, {output} and {b2opt}')
+    parser.add_argument('--timeout', type = float, default = None,
+                        help = 'kill local jobs running longer than this many minutes')
+    parser.add_argument('--queue', default = 's', help = 'LSF queue')
+    parser.add_argument('--nworkers', type = int, default = None,
+                        help = 'number of concurrent bsub calls (default 8) or local jobs (default: all cores)')
+    parser.add_argument('--retries', type = int, default = 3,
+                        help = 'number of retries for a failed bsub call')
+    parser.add_argument('--backoff', type = float, default = 1.0,
+                        help = 'initial wait in seconds before retrying bsub (doubled every retry)')
+    parser.add_argument('--max_backoff', type = float, default = 60.0,
+                        help = 'maximum wait in seconds between bsub retries')
+    parser.add_argument('--min_interval', type = float, default = 0.0,
+                        help = 'minimum time in seconds between two bsub calls')
+
+def make_submitter(args):
+    """
+    Return the LSF submitter configured by the command line options.
+    """
+    return batch.Submitter(batch.LSFBackend(args.queue),
+                           nworkers = args.nworkers or 8,
+                           retries = args.retries,
+                           backoff = args.backoff,
+                           max_backoff = args.max_backoff,
+                           min_interval = args.min_interval)
+
+def make_runner(args):
+    """
+    Return the local runner configured by the command line options.
+    """
+    return batch.LocalRunner(nworkers = args.nworkers,
+                             timeout = None if args.timeout is None else args.timeout * 60)
+
+def monitor_main(argv):
+    """
+    Follow the jobs of an output directory and resubmit the failed ones.
+    """
+    parser = argparse.ArgumentParser(prog = 'submit.py monitor')
+    parser.add_argument('script', help = 'steering script the jobs were submitted with')
+    parser.add_argument('outdir', help = 'output dir')
+    parser.add_argument('--one', action = 'store_true', default = False,
+                        help = 'the jobs were submitted with --one')
+    parser.add_argument('--max_retries', type = int, default = 3,
+                        help = 'number of times a failed file is resubmitted')
+    parser.add_argument('--interval', type = float, default = 5,
+                        help = 'minutes between two polls')
+    parser.add_argument('--once', action = 'store_true', default = False,
+                        help = 'poll only once')
+    add_backend_options(parser)
+    args = parser.parse_args(argv)
+
+    b2opt = "-n 1000" if args.one == True else ""
+    book = ledger.Ledger(args.outdir, ledger.steering_key(args.script, b2opt, args.command))
+    if not book.entries:
+        print(colored('No jobs of %s found in %s' % (args.script, args.outdir), 'red'))
+        exit(1)
+
+    def resubmit(groups):
+        jobs = batch.make_jobs(args.script, [[t.mdst for t in g] for g in groups], args.outdir,
+                               b2opt = b2opt, prefix = 'retry', template = args.command)
+        if args.backend == 'local':
+            return make_runner(args).run(jobs)
+        return make_submitter(args).submit(jobs)
+
+    backend = batch.LocalRunner() if args.backend == 'local' else batch.LSFBackend(args.queue)
+    counts = monitor.monitor(book, args.outdir, backend, resubmit, retries = args.max_retries,
+                             interval = args.interval * 60, once = args.once)
+    if counts[ledger.FAILED] > 0:
+        print(colored('%d files failed for good, see the logs' % counts[ledger.FAILED], 'red'))
+        exit(1)
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'monitor':
+        monitor_main(sys.argv[2:])
+        exit(0)
+
     parser = argparse.ArgumentParser()
     
     parser.add_argument('script', help = 'steering script to run')
@@ -60,10 +150,36 @@ if __name__ == '__main__':
     parser.add_argument('--stream',  type = int, default = 0,
                         help = 'stream number (for MC)')
     
+    parser.add_argument('--catalogue', default = catalogue.DEFAULT_PATH,
+                        help = 'mdst catalogue cache file')
+    parser.add_argument('--catalogue_ttl', type = float, default = catalogue.DEFAULT_TTL / 3600,
+                        help = 'hours before a cached mdst list is fetched again')
+    parser.add_argument('--no_cache', action = 'store_true', default = False,
+                        help = 'always query the File Search Engine')
+    
+    parser.add_argument('--skim', default = None,
+                        help = 'output dir of a skim.py campaign to read instead of the mdst files')
+    parser.add_argument('--skim_verify', action = 'store_true', default = False,
+                        help = 'rehash the mdst files to check the skims are up to date')
+
     parser.add_argument('--one', action = 'store_true', default = False,
                         help = 'only process the first mdst in the list')
     parser.add_argument('--clear', action = 'store_true', default = False,
                         help = 'clear output dir or not')
+    parser.add_argument('--resume', action = 'store_true', default = False,
+                        help = 'only submit files which are not done or in flight according to the ledger')
+    parser.add_argument('--adopt', action = 'store_true', default = False,
+                        help = 'with --resume, count done outputs the ledger has never seen as done')
+
+    add_backend_options(parser)
+    parser.add_argument('--files_per_job', type = int, default = 1,
+                        help = 'number of mdst files processed by one job')
+    parser.add_argument('--walltime', type = float, default = 0,
+                        help = 'pack mdst files into jobs of about this many minutes (0 = no packing)')
+    parser.add_argument('--profile', default = None,
+                        help = 'JSON file with the processing rates of the steering scripts')
+    parser.add_argument('--array', type = int, default = 0,
+                        help = 'submit jobs as LSF job arrays of this size (0 = no arrays)')
 
     args = parser.parse_args()
     
@@ -80,18 +196,29 @@ if __name__ == '__main__':
         print("data_type =", args.data_type)
     print("stream =", args.stream)
     
+    cat = None
+    if not args.no_cache:
+        cat = catalogue.Catalogue(args.catalogue, ttl = args.catalogue_ttl * 3600)
     dataset = get_mdst_list(args.is_data, 
                             args.exp, 
                             run_start = args.run_start,
                             run_end = args.run_end,
                             event_type = args.event_type,
                             data_type = args.data_type,
-                            stream = args.stream)
+                            stream = args.stream,
+                            cat = cat)
     if len(dataset) == 0:
         print(colored('Empty dataset', 'red'))
         exit(1)
 
     print('The dataset contains %d mdst files' % len(dataset))
+    if args.skim is not None:
+        dataset, missing = skim.replace_inputs(dataset, skim.find_skims(args.skim, args.skim_verify))
+        if missing:
+            print(colored('%d mdst files have no up to date skim in %s, run skim.py on them first' %
+                          (len(missing), args.skim), 'red'))
+            exit(1)
+        print('Reading %d skim files from %s' % (len(dataset), args.skim))
     if args.one == True:
         print(colored('Test mode on: will only run on the first mdst file', 'red'))
         dataset = dataset[:1]
@@ -110,20 +237,88 @@ if __name__ == '__main__':
         assert os.path.exists(outdir), "Output directory does not exist!"
         print(colored('Done', 'green'))
     
-    # Use more workers to make submission faster
-    nworkers = 8
-    print("Number workers for job submission =", nworkers)
-    pool = mp.Pool(nworkers)
-    
-    bar = tqdm.tqdm(total = len(dataset))
-    def update_bar(*args):
-        bar.update()
     b2opt = ""
     if args.one == True:
         b2opt = "-n 1000"
 
-    for mdst in dataset:
-        pool.apply_async(submit_one, args = (args.script, mdst, args.outdir, 's', b2opt), callback = update_bar)
-    pool.close()
-    pool.join()
-    
+    # The ledger remembers which files were submitted with this script and options
+    book = ledger.Ledger(outdir, ledger.steering_key(args.script, b2opt, args.command))
+    if args.resume == True:
+        # Packed jobs write pack_<hash>.root/.log: check the outputs the ledger recorded
+        known = {t.mdst: t for t in book.tasks(outdir)}
+        tasks = [known.get(mdst) or batch.Task(mdst, outdir) for mdst in dataset]
+        dataset = [t.mdst for t in book.pending(tasks, adopt = args.adopt)]
+        counts = book.summary(tasks)
+        print('Ledger: %d done, %d submitted, %d running, %d failed, %d new' %
+              (counts[ledger.DONE], counts[ledger.SUBMITTED], counts[ledger.RUNNING],
+               counts[ledger.FAILED], counts[None]))
+        if len(dataset) == 0:
+            print(colored('Nothing left to submit', 'green'))
+            exit(0)
+        print('Resuming with %d mdst files' % len(dataset))
+
+    if args.walltime > 0:
+        rates = packing.load_rates(args.profile, args.script)
+        groups = packing.pack(dataset, args.walltime * 60, rates)
+        longest = max(packing.job_seconds(g, rates) for g in groups)
+        print("Longest job is estimated to take %.1f min" % (longest / 60))
+    else:
+        groups = batch.chunks(dataset, args.files_per_job)
+    jobs = batch.make_jobs(args.script, groups, outdir, b2opt = b2opt, template = args.command)
+    print("Number of jobs =", len(jobs))
+
+    if args.backend == 'local':
+        runner = make_runner(args)
+        print("Number of local workers =", runner.nworkers)
+
+        # Show the throughput in input bytes and events (files) per second
+        sizes = {job.name: sum(os.path.getsize(t.mdst) for t in job.tasks if os.path.exists(t.mdst))
+                 for job in jobs}
+        processed = dict(bytes = 0, files = 0)
+        bar = tqdm.tqdm(total = len(jobs))
+        def update_bar(done):
+            for job in done:
+                state = ledger.DONE if job.returncode == 0 else ledger.FAILED
+                book.record(job.tasks, state, job_id = job.job_id, seconds = job.seconds, error = job.error)
+                processed['bytes'] += sizes[job.name]
+                processed['files'] += len(job.tasks)
+            elapsed = max(bar.format_dict['elapsed'], 1e-6)
+            bar.set_postfix(MBps = '%.1f' % (processed['bytes'] / elapsed / 1e6),
+                            files_per_min = '%.1f' % (processed['files'] / elapsed * 60))
+            bar.update(len(done))
+        # Recorded when the process starts, so an interrupted run leaves no job running in the ledger
+        def record_start(job):
+            book.record(job.tasks, ledger.RUNNING, job_id = job.job_id)
+        runner.run(jobs, callback = update_bar, started = record_start)
+        bar.close()
+
+        failed = [job for job in jobs if job.returncode != 0]
+        if failed:
+            print(colored('%d jobs failed, e.g. %s: %s (see %s)' %
+                          (len(failed), failed[0].name, failed[0].error, failed[0].log), 'red'))
+            exit(1)
+        print(colored('All %d jobs done' % len(jobs), 'green'))
+        exit(0)
+
+    # Use more workers to make submission faster
+    submitter = make_submitter(args)
+    print("Number workers for job submission =", submitter.nworkers)
+
+    bar = tqdm.tqdm(total = len(jobs))
+    def update_bar(done):
+        # Keep the job ids so the jobs can be followed up later
+        for job in done:
+            if job.job_id is not None:
+                book.record(job.tasks, ledger.SUBMITTED, job_id = job.job_id, report = job.report)
+            else:
+                book.record(job.tasks, ledger.FAILED, error = job.error)
+        bar.update(len(done))
+    submitter.submit(jobs, array_size = args.array, listdir = os.path.join(outdir, 'jobs'),
+                     callback = update_bar)
+    bar.close()
+
+    failed = [job for job in jobs if job.job_id is None]
+    if failed:
+        print(colored('%d jobs failed to submit, e.g. %s: %s' % (len(failed), failed[0].name, failed[0].error), 'red'))
+        exit(1)
+    print(colored('All %d jobs submitted' % len(jobs), 'green'))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# Synthetic ntuples for testing the tools downstream of basf2
+#
+# Writes ROOT files with the trees and columns VariablesToNtuple produces for
+# the configurations of reconstruction.py, filled with random candidates
+# (a Sigma+ peak on a flat background, a few candidates per event) so the
+# converters, readers and cut scans can be tried without basf2 or Belle data:
+#
+#   ./synthetic.py /tmp/synth --files 10 --events 5000
+import argparse
+import os
+
+import numpy as np
+
+import reconstruction
+from reconstruction import SIGMA_MASS, LAMBDAC_MASS, PION_MASS
+
+PI0_MASS = 0.13498
+PROTON_MASS = 0.93827
+
+BOOKKEEPING = ['__experiment__', '__run__', '__event__', '__candidate__', '__ncandidates__', '__weight__']
+
+def isotropic(rng, n):
+    cos = rng.uniform(-1, 1, n)
+    phi = rng.uniform(0, 2 * np.pi, n)
+    sin = np.sqrt(1 - cos ** 2)
+    return np.stack([sin * np.cos(phi), sin * np.sin(phi), cos], axis = -1)
+
+def two_body(mother, m1, m2, rng):
+    """
+    Return the four-vectors of isotropic two-body decays of the four-vectors mother.
+    """
+    import kinematics
+    m = kinematics.mass(mother)
+    q = np.sqrt(np.maximum((m ** 2 - (m1 + m2) ** 2) * (m ** 2 - (m1 - m2) ** 2), 0)) / (2 * m)
+    direction = isotropic(rng, len(m)) * q[:, None]
+    d1 = np.concatenate([direction, np.sqrt(q ** 2 + np.square(m1))[:, None]], axis = -1)
+    d2 = np.concatenate([-direction, np.sqrt(q ** 2 + np.square(m2))[:, None]], axis = -1)
+    return kinematics.unboost(d1, mother), kinematics.unboost(d2, mother)
+
+def lab(masses, rng):
+    """
+    Return four-vectors of the given masses with random lab momenta.
+    """
+    p = isotropic(rng, len(masses)) * (rng.exponential(1.0, len(masses)) + 0.3)[:, None]
+    return np.concatenate([p, np.sqrt((p ** 2).sum(axis = -1) + masses ** 2)[:, None]], axis = -1)
+
+def lambdac_four_vectors(masses, rng):
+    """
+    Return the daughter four-vector columns of Lambda_c+ -> Sigma+ pi+ pi- decays
+    of the given masses, flat in the pi+ pi- mass.
+    """
+    import kinematics
+    masses = np.maximum(masses, SIGMA_MASS + 2 * PION_MASS + 1e-3)
+    m_pi_pi = rng.uniform(2 * PION_MASS, masses - SIGMA_MASS)
+    sigma, pi_pi = two_body(lab(masses, rng), SIGMA_MASS, m_pi_pi, rng)
+    pi_plus, pi_minus = two_body(pi_pi, PION_MASS, PION_MASS, rng)
+    daughters = dict(sigma = sigma, pi_plus = pi_plus, pi_minus = pi_minus)
+    return {f'{d}_{c}': p[:, i] for d, p in daughters.items() for i, c in enumerate(kinematics.COMPONENTS)}
+
+def sigma_four_vectors(masses, rng):
+    """
+    Return the daughter four-vector columns of Sigma+ -> p+ pi0 decays of the given masses.
+    """
+    import kinematics
+    masses = np.maximum(masses, PROTON_MASS + PI0_MASS + 1e-3)
+    p, pi0 = two_body(lab(masses, rng), PROTON_MASS, PI0_MASS, rng)
+    daughters = dict(p = p, pi0 = pi0)
+    return {f'{d}_{c}': v[:, i] for d, v in daughters.items() for i, c in enumerate(kinematics.COMPONENTS)}
+
+def candidates(config, nevents, exp = 55, run = 1, signal_fraction = 0.05, seed = 0):
+    """
+    Return the columns of a tree with nevents events of random candidates.
+    """
+    rng = np.random.default_rng(seed)
+    ncand = 1 + rng.poisson(1.5, nevents)
+    n = int(ncand.sum())
+    event = np.repeat(np.arange(1, nevents + 1), ncand)
+    first = np.repeat(np.cumsum(ncand) - ncand, ncand)
+    signal = rng.random(n) < signal_fraction
+
+    columns = dict(__experiment__ = np.full(n, exp, np.int32),
+                   __run__ = np.full(n, run, np.int32),
+                   __event__ = event.astype(np.int32),
+                   __candidate__ = (np.arange(n) - first).astype(np.int32),
+                   __ncandidates__ = np.repeat(ncand, ncand).astype(np.int32),
+                   __weight__ = np.ones(n))
+
+    def peak(mass, width, lo, hi):
+        return np.where(signal, rng.normal(mass, width, n), rng.uniform(lo, hi, n))
+
+    def flag(efficiency = 1.0):
+        return (signal & (rng.random(n) < efficiency)).astype(float)
+
+    for var in reconstruction.ntuple_vars(config):
+        if var == 'M' and config['ntuple'] == 'sigma':
+            value = peak(SIGMA_MASS, 0.004, 1.17, 1.21)
+        elif var == 'M':
+            value = peak(LAMBDAC_MASS, 0.008, 2.24, 2.34)
+        elif var == 'sigma_M':
+            value = peak(SIGMA_MASS, 0.001, 1.17, 1.21)
+        elif var == 'pi0_M':
+            value = peak(PI0_MASS, 0.005, 0.11, 0.16)
+        elif var == 'isSignal':
+            value = signal.astype(float)
+        elif var.endswith('isSignal'):
+            value = np.maximum(flag(0.9), rng.random(n) < 0.2)
+        elif var in ('cosa', 'cosaXY'):
+            value = np.where(signal, 1 - rng.exponential(0.05, n), rng.uniform(-1, 1, n)).clip(-1, 1)
+        elif var in ('distance', 'pi0_distance'):
+            value = np.where(signal, rng.exponential(2.0, n), rng.exponential(0.3, n))
+        elif var.endswith('significanceOfDistance'):
+            value = np.where(signal, rng.exponential(8.0, n), rng.exponential(1.5, n))
+        elif var == 'sigma_Sigma_mva':
+            value = np.where(signal, rng.beta(5, 1, n), rng.beta(1, 3, n))
+        elif var == 'sample_weight':
+            value = np.ones(n)
+        elif var == 'chiProb':
+            value = np.where(signal, rng.uniform(0, 1, n), rng.exponential(0.1, n).clip(0, 1))
+        elif var.endswith('_E') or var.endswith('_p') or var in ('p', 'pt', 'E'):
+            value = rng.exponential(0.3, n) + 0.03
+        elif var.endswith('PDG'):
+            value = rng.choice([0, 111, 211, -211, 2212, 3222, 4122, 22], n).astype(float)
+        elif var in ('charge', 'gamma1_clusterReg', 'gamma2_clusterReg') or var.endswith('goodBelleGamma'):
+            value = rng.integers(0, 3, n).astype(float)
+        elif 'pid' in var or var in ('xp',) or var.endswith('clusterE9E21'):
+            value = rng.uniform(0, 1, n)
+        else:
+            value = rng.normal(0, 1, n)
+        columns[var] = value
+
+    if config['four_vectors'] and config['ntuple'] == 'lambdac':
+        import kinematics
+        columns.update(lambdac_four_vectors(columns['M'], rng))
+        columns.update(kinematics.dalitz(*(kinematics.four_vector(columns, d)
+                                           for d in ['sigma', 'pi_plus', 'pi_minus'])))
+    elif config['four_vectors']:
+        columns.update(sigma_four_vectors(columns['M'], rng))
+    return columns
+
+def write(path, trees):
+    """
+    Write a dict of tree name -> columns to a ROOT file.
+    """
+    import uproot
+    with uproot.recreate(path) as f:
+        for tree, columns in trees.items():
+            f[tree] = columns
+
+def generate(outdir, configs, nfiles = 10, nevents = 1000, exp = 55, seed = 0):
+    """
+    Write nfiles ROOT files, one run each, and return their paths.
+    """
+    os.makedirs(outdir, exist_ok = True)
+    paths = []
+    for i in range(nfiles):
+        run = i + 1
+        path = os.path.join(outdir, 'synthetic_e%06dr%06d.root' % (exp, run))
+        write(path, {config['tree']: candidates(config, nevents, exp, run, seed = seed + i)
+                     for config in configs})
+        paths.append(path)
+    return paths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Write synthetic ntuples')
+    parser.add_argument('outdir', help = 'output dir')
+    parser.add_argument('--files', type = int, default = 10, help = 'number of files (one run each)')
+    parser.add_argument('--events', type = int, default = 1000, help = 'events per file')
+    parser.add_argument('--variants', default = 'v7', help = 'comma separated configurations of reconstruction.py')
+    parser.add_argument('--exp', type = int, default = 55, help = 'experiment number')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed')
+    args = parser.parse_args()
+
+    configs = [reconstruction.VARIANTS[name] for name in args.variants.split(',')]
+    paths = generate(args.outdir, configs, args.files, args.events, args.exp, args.seed)
+    print('Wrote %d files to %s' % (len(paths), args.outdir))
@@ -0,0 +1,112 @@
+# Submission through batch.LSFBackend and batch.Submitter with a fake bsub
+#
+#   python -m pytest scripts/tests
+import os
+import stat
+
+import batch
+import ledger
+
+# Records its arguments, one call per line, and answers like bsub. Fails
+# while <dir>/fail holds a positive count, counting it down.
+FAKE_BSUB = '''#!/bin/sh
+dir=$(dirname "$0")
+echo "$@" >> "$dir/calls"
+if [ -f "$dir/fail" ] && [ "$(cat "$dir/fail")" -gt 0 ]; then
+    echo $(( $(cat "$dir/fail") - 1 )) > "$dir/fail"
+    echo "Cannot connect to LSF. Please wait ..." >&2
+    exit 255
+fi
+echo "Job <$$> is submitted to queue <$2>."
+'''
+
+FAKE_BJOBS = '''#!/bin/sh
+echo "101,RUN,0"
+echo "102,DONE,0"
+echo "103,EXIT,2"
+echo "Job <104> is not found" >&2
+exit 255
+'''
+
+def script(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+def calls(tmp_path):
+    return (tmp_path / 'calls').read_text().splitlines()
+
+def submitter(tmp_path, **kwargs):
+    backend = batch.LSFBackend('s', bsub = script(tmp_path, 'bsub', FAKE_BSUB), timeout = 10)
+    return batch.Submitter(backend, backoff = 0.0, **kwargs)
+
+def test_submit(tmp_path):
+    outdir = str(tmp_path / 'out')
+    jobs = batch.make_jobs('sigma_v7.py', [['a.mdst'], ['b.mdst', 'c.mdst']], outdir)
+    done = []
+    submitter(tmp_path, nworkers = 2).submit(jobs, callback = done.extend)
+    assert sorted(done, key = lambda job: job.name) == jobs
+    assert all(job.job_id is not None and job.job_id.isdigit() for job in jobs)
+    assert all(job.attempts == 1 and not job.error for job in jobs)
+    assert sorted(calls(tmp_path)) == sorted(f'-q s -J {job.name} -oo {job.log} sh -c {job.command}' for job in jobs)
+    # One file keeps its own output, packed files share one
+    assert jobs[0].log == os.path.join(outdir, 'a.mdst.log')
+    assert jobs[1].command == 'basf2 sigma_v7.py b.mdst c.mdst ' + jobs[1].tasks[0].root
+    assert os.path.basename(jobs[1].log).startswith('pack_')
+
+def test_retry(tmp_path):
+    (tmp_path / 'fail').write_text('2\n')
+    jobs = batch.make_jobs('sigma_v7.py', [['a.mdst']], str(tmp_path))
+    submitter(tmp_path, nworkers = 1, retries = 3).submit(jobs)
+    assert jobs[0].job_id is not None
+    assert jobs[0].attempts == 3
+    assert len(calls(tmp_path)) == 3
+
+def test_give_up(tmp_path):
+    (tmp_path / 'fail').write_text('10\n')
+    jobs = batch.make_jobs('sigma_v7.py', [['a.mdst']], str(tmp_path))
+    submitter(tmp_path, nworkers = 1, retries = 2).submit(jobs)
+    assert jobs[0].job_id is None
+    assert jobs[0].attempts == 3
+    assert 'Cannot connect to LSF' in jobs[0].error
+
+def test_array(tmp_path):
+    jobs = batch.make_jobs('sigma_v7.py', [['a.mdst'], ['b.mdst'], ['c.mdst']], str(tmp_path))
+    listdir = str(tmp_path / 'jobs')
+    submitter(tmp_path, nworkers = 1).submit(jobs, array_size = 2, listdir = listdir)
+    first, second = sorted(calls(tmp_path))
+    assert '-J job00000_array[1-2]' in first and '-J job00002_array[1-1]' in second
+    array_id = jobs[0].job_id.split('[')[0]
+    assert [job.job_id for job in jobs[:2]] == [f'{array_id}[1]', f'{array_id}[2]']
+    assert jobs[2].job_id.endswith('[1]')
+    # LSF writes the report of each element to its own file
+    assert [job.report for job in jobs] == [os.path.join(listdir, name) for name in
+                                            ['job00000_array.1.log', 'job00000_array.2.log', 'job00002_array.1.log']]
+    with open(os.path.join(listdir, 'job00000_array.lst')) as f:
+        assert len(f.read().splitlines()) == 2
+
+def test_status(tmp_path):
+    backend = batch.LSFBackend('s')
+    states = backend.status(['101', '102', '103[2]', '104'], bjobs = script(tmp_path, 'bjobs', FAKE_BJOBS))
+    # The jobs bjobs does not know are left out, array elements get their index
+    assert states == {'101': ledger.RUNNING, '102': ledger.DONE, '103[2]': ledger.FAILED}
+
+def test_local_started(tmp_path):
+    jobs = batch.make_jobs('x', [['a'], ['b']], str(tmp_path), template = 'echo {inputs}')
+    started = []
+    batch.LocalRunner(nworkers = 2).run(jobs, started = started.append)
+    assert sorted(started, key = lambda job: job.name) == jobs
+    assert all(job.returncode == 0 and job.job_id.startswith('local:') for job in jobs)
+
+def test_local_status(tmp_path):
+    jobs = batch.make_jobs('x', [['a']], str(tmp_path), template = 'sleep 30 # {inputs}')
+    runner = batch.LocalRunner(nworkers = 1, timeout = 0.5)
+    alive = []
+    runner.run(jobs, started = lambda job: alive.append(runner.status([job.job_id])))
+    assert alive == [{jobs[0].job_id: ledger.RUNNING}]
+    assert runner.status([jobs[0].job_id]) == {}
+    # A live pid started at another time is another process which got the pid of the job
+    start = batch.process_start(os.getpid())
+    me, reused = f'local:{os.getpid()}:{start}', f'local:{os.getpid()}:{start + 1}'
+    assert runner.status([me, reused]) == {me: ledger.RUNNING}
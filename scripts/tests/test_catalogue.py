@@ -0,0 +1,92 @@
+# catalogue.Catalogue answering run range queries from its SQLite cache with a fake fetch
+#
+#   python -m pytest scripts/tests
+import time
+
+import catalogue
+
+MDST_DIR = '/group/belle/bdata_b/mcprod/dat/e000055/evtgen/charged/00/all/0127/on_resonance/s00'
+
+def mdst(run):
+    return f'{MDST_DIR}/evtgen-charged-s00-e000055r{run:06d}-b20090127_0910.mdst'
+
+# Part of a saved montecarlo.php page: every path is both a link and its text
+LISTING = '''<html><body>
+<h2>Exp 55, run 1 - 9999, charged, caseB, stream 0</h2>
+<table>
+<tr><td><a href="%(1)s">%(1)s</a></td><td>12345 events</td></tr>
+<tr><td><a href='%(3)s'>%(3)s</a></td><td>23456 events</td></tr>
+<tr><td><a href="%(2)s">%(2)s</a></td><td>34567 events</td></tr>
+<tr><td>/group/belle/mcprod/README.txt</td></tr>
+</table>
+</body></html>
+''' % {'1': mdst(1), '2': mdst(2), '3': mdst(3)}
+
+class FakeFetch:
+    """
+    Answer every URL with one file per run, counting the calls.
+    """
+    def __init__(self, runs):
+        self.runs = runs
+        self.urls = []
+
+    def __call__(self, url):
+        self.urls.append(url)
+        return [mdst(run) for run in self.runs]
+
+def test_parse_listing():
+    paths = catalogue.parse_listing(LISTING)
+    # In page order, once per file, no other links
+    assert paths == [mdst(1), mdst(3), mdst(2)]
+    assert [catalogue.run_number(path) for path in paths] == [1, 3, 2]
+    assert catalogue.run_number('/x/README.mdst') is None
+
+def test_lookup(tmp_path):
+    cat = catalogue.Catalogue(str(tmp_path / 'cat.sqlite'), fetch = None)
+    key = catalogue.query_key(False, 55)
+    assert cat.store(key, [mdst(run) for run in [5, 1, 3, 9, 7]]) == 5
+    # Inclusive run ranges, sorted by run
+    assert cat.lookup(key, 3, 7) == [mdst(3), mdst(5), mdst(7)]
+    assert cat.lookup(key, 10, 20) == []
+    assert cat.lookup(catalogue.query_key(False, 55, event_type = 'mixed'), 1, 9) == []
+
+    # Storing a range replaces only that range
+    assert cat.store(key, [mdst(4)], 3, 5) == 1
+    assert cat.lookup(key, 1, 9) == [mdst(1), mdst(4), mdst(7), mdst(9)]
+    assert cat.covered(key, 3, 5) and cat.covered(key, 1, 9)
+
+def test_import_range(tmp_path):
+    cat = catalogue.Catalogue(str(tmp_path / 'cat.sqlite'), fetch = None)
+    key = catalogue.query_key(False, 55)
+    cat.store(key, [mdst(run) for run in range(1, 6)])
+    # A listing with more runs than asked for does not overwrite the runs outside the range
+    assert cat.store(key, catalogue.parse_listing(LISTING), 2, 2) == 1
+    assert cat.lookup(key, 1, 9) == [mdst(run) for run in range(1, 6)]
+
+def test_one_fetch(tmp_path):
+    fetch = FakeFetch(range(1, 101))
+    cat = catalogue.Catalogue(str(tmp_path / 'cat.sqlite'), fetch = fetch)
+    # Ten slices of one experiment cost one fetch of the whole run range
+    slices = [cat.get_mc(55, start, start + 9) for start in range(1, 101, 10)]
+    assert cat.nfetches == 1 and len(fetch.urls) == 1
+    assert 'rs=1&re=9999' in fetch.urls[0]
+    assert sum(slices, []) == [mdst(run) for run in range(1, 101)]
+    # The cache outlives the process
+    cat.close()
+    cat = catalogue.Catalogue(str(tmp_path / 'cat.sqlite'), fetch = fetch)
+    assert cat.get_mc(55, 50, 50) == [mdst(50)]
+    assert cat.nfetches == 0
+
+def test_ttl(tmp_path, monkeypatch):
+    fetch = FakeFetch([1, 2])
+    cat = catalogue.Catalogue(str(tmp_path / 'cat.sqlite'), ttl = 3600, fetch = fetch)
+    cat.get_mc(55)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 3000)
+    cat.get_mc(55)
+    assert cat.nfetches == 1
+    # Past the time to live the experiment is fetched again, and what it lists now replaces the cache
+    fetch.runs = [1, 2, 3]
+    monkeypatch.setattr(time, 'time', lambda: now + 4000)
+    assert cat.get_mc(55) == [mdst(1), mdst(2), mdst(3)]
+    assert cat.nfetches == 2
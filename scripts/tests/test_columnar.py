@@ -0,0 +1,38 @@
+# columnar.py typing and converting the synthetic ntuples of synthetic.py
+#
+#   python -m pytest scripts/tests
+import os
+
+import numpy as np
+import pyarrow.parquet as pq
+
+import columnar
+import synthetic
+from reconstruction import SIGMA_V7
+
+def read(dataset, tree = 'good'):
+    return pq.read_table(os.path.join(dataset, tree)).to_pandas()
+
+def test_cast():
+    columns = columnar.cast(dict(isSignal = np.array([1.0, np.nan, 0.0]), charge = np.array([-1.0, 1.0, 0.0]),
+                                 mcPDG = np.array([3222.0, -211.0, np.nan]), M = np.array([1.18, 1.19, 1.2]),
+                                 __weight__ = np.array([0.5, 1.0, 2.0]), __event__ = np.arange(3, dtype = np.int32)))
+    assert {name: values.dtype for name, values in columns.items()} == dict(
+        isSignal = np.int8, charge = np.int8, mcPDG = np.int32, M = np.float32,
+        __weight__ = np.float64, __event__ = np.int32)
+    # No MC match: NaN becomes 0 in the integer columns
+    assert columns['isSignal'].tolist() == [1, 0, 0]
+    assert columns['mcPDG'].tolist() == [3222, -211, 0]
+
+def test_convert(tmp_path):
+    paths = synthetic.generate(str(tmp_path / 'out'), [SIGMA_V7], nfiles = 2, nevents = 200)
+    parts, entries = columnar.convert(paths, 'good', str(tmp_path / 'parquet'), rows_per_file = 300,
+                                      row_group_size = 100)
+    assert len(parts) > 1
+    types = {field.name: str(field.type) for field in pq.read_schema(parts[0])}
+    assert types['isSignal'] == 'int8' and types['gamma1_goodBelleGamma'] == 'int8'
+    assert types['genMotherPDG'] == 'int32' and types['pi0_mcPDG'] == 'int32'
+    assert types['M'] == 'float' and types['__weight__'] == 'double'
+    assert len(read(str(tmp_path / 'parquet'))) == entries
+    # A missing tree is no candidates
+    assert columnar.convert(paths, 'lambda_c', str(tmp_path / 'parquet')) == ([], 0)
@@ -0,0 +1,53 @@
+# kinematics.py batched functions against the per-candidate loop on synthetic four-vectors
+#
+#   python -m pytest scripts/tests
+import numpy as np
+import pytest
+
+import kinematics
+import synthetic
+from reconstruction import PION_MASS, SIGMA_MASS
+
+@pytest.fixture
+def arrays():
+    rng = np.random.default_rng(1)
+    masses = rng.uniform(2.24, 2.34, 2000)
+    return masses, synthetic.lambdac_four_vectors(masses, rng)
+
+@pytest.mark.parametrize('sigma_mass', [None, SIGMA_MASS])
+def test_lambdac_loop(arrays, sigma_mass):
+    _, columns = arrays
+    fast = kinematics.lambdac(columns, sigma_mass)
+    slow = kinematics.lambdac_loop(columns, sigma_mass)
+    assert sorted(fast) == sorted(slow)
+    for name in slow:
+        np.testing.assert_allclose(fast[name], slow[name], rtol = 1e-9, atol = 1e-9, err_msg = name)
+
+def test_float32(arrays):
+    # As read from Parquet: both take the products in double precision
+    _, columns = arrays
+    columns = {name: values.astype(np.float32) for name, values in columns.items()}
+    fast = kinematics.lambdac(columns)
+    slow = kinematics.lambdac_loop(columns)
+    for name in slow:
+        np.testing.assert_allclose(fast[name], slow[name], rtol = 1e-9, atol = 1e-9, err_msg = name)
+
+def test_lambdac(arrays):
+    masses, columns = arrays
+    result = kinematics.lambdac(columns, SIGMA_MASS)
+    np.testing.assert_allclose(result['M'], masses, rtol = 1e-9)
+    # The squared Dalitz masses add up to M^2 and the daughter masses squared
+    total = result['m_sigma_pi_plus'] ** 2 + result['m_sigma_pi_minus'] ** 2 + result['m_pi_pi'] ** 2
+    np.testing.assert_allclose(total, masses ** 2 + SIGMA_MASS ** 2 + 2 * PION_MASS ** 2, rtol = 1e-9)
+    for name in ['cos_helicity_pi_pi', 'cos_helicity_sigma_pi']:
+        assert (np.abs(result[name]) <= 1 + 1e-12).all()
+
+def test_boost(arrays):
+    _, columns = arrays
+    sigma = kinematics.four_vector(columns, 'sigma')
+    rest = kinematics.boost(sigma, sigma)
+    np.testing.assert_allclose(rest[:, :3], 0, atol = 1e-9)
+    np.testing.assert_allclose(rest[:, 3], kinematics.mass(sigma), rtol = 1e-9)
+    pion = kinematics.four_vector(columns, 'pi_plus')
+    np.testing.assert_allclose(kinematics.unboost(kinematics.boost(pion, sigma), sigma), pion, rtol = 1e-9,
+                               atol = 1e-9)
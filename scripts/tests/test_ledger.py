@@ -0,0 +1,84 @@
+# ledger.Ledger replaying and reconciling against outputs and logs in a temporary dir
+#
+#   python -m pytest scripts/tests
+import os
+
+import batch
+import ledger
+
+def finish(task, log = 'Successfully completed.\n', age = 0):
+    """
+    Write the output and log of a task, the log age seconds old.
+    """
+    with open(task.root, 'wb') as f:
+        f.write(b'root')
+    with open(task.log, 'w') as f:
+        f.write(log)
+    if age:
+        mtime = os.path.getmtime(task.log) - age
+        os.utime(task.log, (mtime, mtime))
+
+def make_tasks(tmp_path, names):
+    return [batch.Task(name + '.mdst', str(tmp_path)) for name in names]
+
+def test_adopt(tmp_path):
+    a, b = make_tasks(tmp_path, ['a', 'b'])
+    finish(a)
+    # An empty ledger takes the outputs already on disk as done
+    book = ledger.Ledger(str(tmp_path), 'k1')
+    assert book.reconcile([a]) == {a.mdst: ledger.DONE}
+
+    # Once it has entries, outputs it never submitted may come from another script
+    finish(b)
+    book = ledger.Ledger(str(tmp_path), 'k1')
+    assert book.pending([a, b]) == [b]
+    assert book.state(b.mdst) is None
+    assert book.pending([a, b], adopt = True) == []
+    assert book.state(b.mdst) == ledger.DONE
+
+def test_stale_log(tmp_path):
+    task, = make_tasks(tmp_path, ['a'])
+    finish(task, log = 'Exited with exit code 1.\n', age = 100)
+    book = ledger.Ledger(str(tmp_path), 'k1')
+    book.record([task], ledger.SUBMITTED, job_id = '1')
+    # The failed log is from before the resubmission: the job is still in flight
+    assert book.pending([task]) == []
+    assert book.state(task.mdst) == ledger.SUBMITTED
+
+    finish(task, log = 'Exited with exit code 1.\n')
+    assert book.pending([task]) == [task]
+    assert book.entries[task.mdst]['job_id'] == '1'
+
+def test_steering_key(tmp_path):
+    script = tmp_path / 'steering.py'
+    script.write_text('cuts = 1\n')
+    key = ledger.steering_key(str(script))
+    assert ledger.steering_key(str(script), b2opt = '-n 10') != key
+    task, = make_tasks(tmp_path, ['a'])
+    finish(task)
+    ledger.Ledger(str(tmp_path), key).record([task], ledger.DONE)
+
+    # A changed script does not see the outputs of the old one as its own
+    script.write_text('cuts = 2\n')
+    changed = ledger.steering_key(str(script))
+    assert changed != key
+    book = ledger.Ledger(str(tmp_path), changed)
+    assert book.entries == {}
+    assert ledger.Ledger(str(tmp_path), key).state(task.mdst) == ledger.DONE
+
+def test_truncated_line(tmp_path):
+    a, b = make_tasks(tmp_path, ['a', 'b'])
+    book = ledger.Ledger(str(tmp_path), 'k1')
+    book.record([a], ledger.SUBMITTED, job_id = '1')
+    book.record([a, b], ledger.DONE)
+    # A submission killed while writing leaves half a line
+    with open(book.path) as f:
+        text = f.read()
+    with open(book.path, 'w') as f:
+        f.write(text[:-20])
+    book = ledger.Ledger(str(tmp_path), 'k1')
+    assert book.state(a.mdst) == ledger.DONE
+    assert book.state(b.mdst) is None
+    # Appending after the cut line keeps the ledger readable
+    book.record([b], ledger.SUBMITTED)
+    assert ledger.Ledger(str(tmp_path), 'k1').state(b.mdst) == ledger.SUBMITTED
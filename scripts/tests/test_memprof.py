@@ -0,0 +1,53 @@
+# memprof.py sampling a dummy job which allocates memory in its event loop
+#
+#   python -m pytest scripts/tests
+import os
+import subprocess
+import sys
+
+import memprof
+
+MEMPROF = os.path.abspath(memprof.__file__)
+
+def sample(tmp_path, cmd, interval = 0.05):
+    """
+    Run a command under memprof.py and return its exit code, output and samples.
+    """
+    output = str(tmp_path / 'job.root')
+    proc = subprocess.run([sys.executable, MEMPROF, '--interval', str(interval), '--output', output, '--'] + cmd,
+                          stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True,
+                          timeout = 60)
+    return proc.returncode, proc.stdout, memprof.read_series(memprof.series_path(output))
+
+def test_dummy_job(tmp_path):
+    code, output, samples = sample(tmp_path, [sys.executable, MEMPROF, '--dummy', '80', '1.2'])
+    assert code == 0
+    # The output of the job is passed through
+    assert 'Starting event processing' in output
+    assert memprof.series_path(str(tmp_path / 'job.root')) == str(tmp_path / 'job.mem.csv')
+
+    # No CPU use for the first sample, which has no interval before it
+    assert samples[0][2] is None
+    assert all(cpu is not None and cpu >= 0 for _, _, cpu, _ in samples[1:])
+    phases = [phase for _, _, _, phase in samples]
+    assert phases[0] == 'setup' and phases[-1] == 'end'
+    assert 'events' in phases
+
+    summary = memprof.job_summary(samples)
+    assert summary['peak_phase'] == 'events'
+    assert summary['peak'] - summary['phases']['setup']['rss'] > 40
+    assert summary['growth'] > 0
+
+def test_summary(tmp_path, capsys):
+    sample(tmp_path, [sys.executable, MEMPROF, '--dummy', '20', '0.6'])
+    memprof.summarize(str(tmp_path))
+    printed = capsys.readouterr().out
+    assert printed.startswith('1 jobs, peak RSS median')
+    assert 'events' in printed and '\njob ' in printed
+
+def test_exit_code(tmp_path):
+    code, _, _ = sample(tmp_path, ['sh', '-c', 'sleep 0.2; exit 3'])
+    assert code == 3
+    # Killed by a signal: 128 + signal, as a shell reports it
+    code, _, _ = sample(tmp_path, ['sh', '-c', 'sleep 0.2; kill -9 $$'])
+    assert code == 128 + 9
@@ -0,0 +1,46 @@
+# merge.py appending the synthetic ntuples of synthetic.py to a Parquet dataset
+#
+#   python -m pytest scripts/tests
+import os
+
+import pyarrow.parquet as pq
+
+import merge
+import synthetic
+from reconstruction import SIGMA_V7
+
+def read(dataset, tree = 'good'):
+    return pq.read_table(os.path.join(dataset, tree)).to_pandas()
+
+def test_merge(tmp_path):
+    outdir, dataset = str(tmp_path / 'out'), str(tmp_path / 'dataset')
+    paths = synthetic.generate(outdir, [SIGMA_V7], nfiles = 2, nevents = 100)
+    first = dict(merge.merge(outdir, dataset, ['good'], run_block = 1, nworkers = 1)['parts'])
+
+    # A crashed job, and a job which wrote the columns of another script
+    with open(os.path.join(outdir, 'crashed.root'), 'wb') as f:
+        f.write(b'not a ROOT file')
+    columns = synthetic.candidates(SIGMA_V7, 50, run = 5)
+    del columns['cosaXY']
+    synthetic.write(os.path.join(outdir, 'other.root'), {'good': columns})
+    # One more good file: the second merge appends only the new files
+    paths += synthetic.generate(str(tmp_path / 'more'), [SIGMA_V7], nfiles = 3, nevents = 100)[2:]
+    os.replace(paths[-1], os.path.join(outdir, os.path.basename(paths[-1])))
+    manifest = merge.merge(outdir, dataset, ['good'], run_block = 1, nworkers = 1)
+
+    states = {os.path.basename(path): entry['state'] for path, entry in manifest['inputs'].items()}
+    assert states == {'synthetic_e000055r000001.root': merge.OK, 'synthetic_e000055r000002.root': merge.OK,
+                      'synthetic_e000055r000003.root': merge.OK, 'crashed.root': merge.CORRUPT,
+                      'other.root': merge.BAD_SCHEMA}
+    assert {rel: part for rel, part in manifest['parts'].items() if rel in first} == first
+    assert [part['partition'] for rel, part in manifest['parts'].items() if rel not in first] == \
+        ['exp=55/runs=00003-00003']
+    df = read(dataset)
+    assert sorted(df['__run__'].unique()) == [1, 2, 3]
+    assert len(df) == sum(entry['entries'].get('good', 0) for entry in manifest['inputs'].values()
+                          if entry['state'] == merge.OK)
+    assert len(df) == sum(part['entries'] for part in manifest['parts'].values())
+
+    # Nothing new: nothing read or written
+    again = merge.merge(outdir, dataset, ['good'], run_block = 1, nworkers = 1)
+    assert again['parts'] == manifest['parts']
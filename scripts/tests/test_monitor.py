@@ -0,0 +1,117 @@
+# monitor.poll and monitor.monitor with a fake backend on a ledger in a temporary dir
+#
+#   python -m pytest scripts/tests
+import os
+
+import batch
+import ledger
+import monitor
+
+STATISTICS = '''Name                 |      Calls | Memory(MB) |    Time(s) |     Time(ms)/Call
+Total                |       1000 |        512 |      20.00 |     20.00 +-   1.00
+'''
+
+REPORT = '''Successfully completed.
+
+Resource usage summary:
+
+    CPU time :                                   19.50 sec.
+    Max Memory :                                 600 MB
+'''
+
+class FakeBackend:
+    """
+    Answer status with fixed states, or fail like an unreachable bjobs.
+    """
+    def __init__(self, states = None, error = None):
+        self.states = states or {}
+        self.error = error
+        self.polls = 0
+
+    def status(self, job_ids):
+        self.polls += 1
+        if self.error is not None:
+            raise OSError(self.error)
+        return {job_id: state for job_id, state in self.states.items() if job_id in job_ids}
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+def submitted(tmp_path, names, **extra):
+    book = ledger.Ledger(str(tmp_path), 'k1')
+    tasks = [batch.Task(name + '.mdst', str(tmp_path)) for name in names]
+    for i, task in enumerate(tasks):
+        book.record([task], ledger.SUBMITTED, job_id = str(100 + i), **extra)
+    return book, tasks
+
+def test_lost(tmp_path):
+    book, (a, b) = submitted(tmp_path, ['a', 'b'])
+    monitor.poll(book, str(tmp_path), FakeBackend({'100': ledger.RUNNING}))
+    assert book.state(a.mdst) == ledger.RUNNING
+    # Gone from the backend without a log: killed or never started
+    assert book.state(b.mdst) == ledger.FAILED
+    assert book.entries[b.mdst]['error'] == 'lost'
+
+def test_backend_error(tmp_path):
+    book, (a,) = submitted(tmp_path, ['a'])
+    monitor.poll(book, str(tmp_path), FakeBackend(error = 'bjobs failed: LSF is down'))
+    # No job is taken for lost while the backend cannot be asked
+    assert book.state(a.mdst) == ledger.SUBMITTED
+
+def test_terminal_state(tmp_path):
+    book, (a, b) = submitted(tmp_path, ['a', 'b'])
+    # Logs cut short, with no end of job in them
+    write(a.log, '[INFO] Starting event processing\n')
+    write(b.log, '[INFO] Starting event processing\n')
+    write(b.root, 'root')
+    monitor.poll(book, str(tmp_path), FakeBackend({'100': ledger.FAILED, '101': ledger.DONE}))
+    assert book.state(a.mdst) == ledger.FAILED
+    assert book.state(b.mdst) == ledger.DONE
+
+    # The log has the last word once it shows the end of the job
+    book, (c,) = submitted(tmp_path, ['c'])
+    write(c.log, STATISTICS + 'Exited with exit code 139.\n')
+    monitor.poll(book, str(tmp_path), FakeBackend({'100': ledger.DONE}))
+    assert book.state(c.mdst) == ledger.FAILED
+
+def test_array_report(tmp_path):
+    os.makedirs(tmp_path / 'jobs')
+    report = str(tmp_path / 'jobs' / 'job00000_array.1.log')
+    book, (a,) = submitted(tmp_path, ['a'], report = report)
+    write(a.log, '[INFO] Starting event processing\n')
+    write(a.root, 'root')
+    backend = FakeBackend({'100': ledger.RUNNING})
+    monitor.poll(book, str(tmp_path), backend)
+    assert book.state(a.mdst) == ledger.RUNNING
+    assert book.entries[a.mdst]['report'] == report
+
+    # The element is gone from bjobs: its exit is in the report, not in the log
+    write(a.log, '[INFO] Starting event processing\n' + STATISTICS)
+    write(report, REPORT.replace('Successfully completed.', 'Exited with exit code 1.'))
+    backend.states = {}
+    monitor.poll(book, str(tmp_path), backend)
+    assert book.state(a.mdst) == ledger.FAILED
+    assert 'error' not in book.entries[a.mdst]
+
+    logs = monitor.read_logs(book, str(tmp_path))
+    assert [(log['exit_code'], log['cpu_time'], log['max_memory']) for log in logs] == [(1, 19.5, 600)]
+
+def test_retries(tmp_path, capsys):
+    book, (a,) = submitted(tmp_path, ['a'])
+    resubmitted = []
+    def resubmit(groups):
+        jobs = []
+        for tasks in groups:
+            job = batch.Job('a', tasks, 'true', tasks[0].log)
+            job.job_id = str(200 + len(resubmitted))
+            resubmitted.append(job)
+            jobs.append(job)
+        return jobs
+    # Every job gets lost: resubmitted until the retries are used up
+    counts = monitor.monitor(book, str(tmp_path), FakeBackend(), resubmit, retries = 2, interval = 0)
+    assert len(resubmitted) == 2
+    assert counts[ledger.FAILED] == 1
+    assert book.entries[a.mdst]['attempt'] == 3
+    assert book.entries[a.mdst]['job_id'] == '201'
+    assert 'Resubmitting 1 failed files in 1 jobs' in capsys.readouterr().out
@@ -0,0 +1,50 @@
+# mva.py training and scoring the Sigma+ MVA on synthetic candidates
+#
+#   python -m pytest scripts/tests
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import columnar
+import mva
+import ntuple
+import synthetic
+from reconstruction import SIGMA_V7
+
+@pytest.fixture(scope = 'module')
+def sample(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('mva')
+    synthetic.generate(str(tmp / 'out'), [SIGMA_V7], nfiles = 2, nevents = 3000)
+    return tmp
+
+def test_train(sample, tmp_path):
+    names = mva.features()
+    assert 'M' not in names and 'isSignal' not in names and 'mcPDG' not in names
+    nt = ntuple.Ntuple(str(sample / 'out'), 'good')
+    xb, y, test, xtest, edges = mva.read_sample(nt, names, nbins = 32)
+    assert xb.dtype == np.uint8 and xb.shape == (len(y), len(names))
+    assert 0.1 < test.mean() < 0.3
+    model = mva.train(xb[~test], y[~test], edges, names, ntrees = 20, nthreads = 2)
+
+    # The synthetic signal is displaced and points back to the interaction point
+    score = model.predict(xtest)
+    assert ((score > 0) & (score < 1)).all()
+    assert mva.auc(y[test], score) > 0.9
+
+    # Inference from the weightfile and from named columns gives the same scores
+    model.save(str(tmp_path / 'bdt.npz'))
+    loaded = mva.load(str(tmp_path / 'bdt.npz'))
+    assert np.array_equal(loaded.predict(xtest), score)
+    df = nt.read(names)
+    assert np.allclose(loaded.predict(df)[test], score)
+
+def test_basf2_parquet(sample, tmp_path):
+    paths = sorted(str(path) for path in (sample / 'out').glob('*.root'))
+    columnar.convert(paths, 'good', str(tmp_path / 'parquet'))
+    proc = subprocess.run([sys.executable, os.path.abspath(mva.__file__), str(tmp_path / 'parquet'),
+                           '--basf2', 'MVA_Sigma_p.root'], stderr = subprocess.PIPE, universal_newlines = True)
+    assert proc.returncode == 2
+    assert 'not from a Parquet dataset' in proc.stderr
@@ -0,0 +1,50 @@
+# optimize.py cut scans on a hand-made index and on synthetic candidates
+#
+#   python -m pytest scripts/tests
+import itertools
+
+import numpy as np
+import pytest
+
+import optimize
+import synthetic
+from reconstruction import SIGMA_V7
+
+def test_fom():
+    s, b = np.array([9.0, 0.0]), np.array([16.0, 4.0])
+    assert optimize.fom('significance', s, b, 9.0).tolist() == [2.25, 0.0]
+    assert optimize.fom('significance_sb', s, b, 9.0).tolist() == [9 / 5, 0.0]
+    with pytest.raises(ValueError):
+        optimize.fom('purity', s, b, 9.0)
+
+def test_float32_thresholds():
+    # Values on the thresholds, as float32 columns store them
+    values = np.array([0.1, 0.2, 0.2, 0.3, np.nan], np.float32)
+    index = optimize.Index(['pi0_p', 'pi0_dM'], dict(pi0_p = values, pi0_dM = values),
+                           np.array([1.0, 0, 1, 0, 1]), np.array([0.0, 1, 0, 1, 0]))
+    for threshold in [0.1, np.float64(0.2), 0.3]:
+        for name in ['pi0_p', 'pi0_dM']:
+            s, b = index.sweep({}, name, [threshold])
+            assert (s[0], b[0]) == index.counts({name: threshold})
+    assert index.counts({'pi0_p': 0.1}) == (1.0, 2.0)
+    assert index.counts({'pi0_dM': np.float64(0.2)}) == (1.0, 0.0)
+
+@pytest.fixture(scope = 'module')
+def optimizer(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('optimize')
+    synthetic.generate(str(tmp / 'out'), [SIGMA_V7], nfiles = 2, nevents = 2000)
+    return optimize.Optimizer(str(tmp / 'out'), names = ['pi0_p', 'pi0_dM', 'dM'], cache_dir = str(tmp / 'cache'))
+
+def test_grid(optimizer):
+    grids = dict(pi0_p = [None, 0.1, 0.2], pi0_dM = [0.01, 0.02], dM = [0.004, 0.008, 0.012, 0.02])
+    result = optimizer.grid(grids)
+    assert result['evaluated'] == 24
+    # Every point of the grid counted directly
+    values = {combination: float(optimizer.value(*optimizer.index.counts(dict(zip(grids, combination)))))
+              for combination in itertools.product(*grids.values())}
+    assert result['fom'] == pytest.approx(max(values.values()))
+    assert result['cuts'] == dict(zip(grids, max(values, key = values.get)))
+
+    ascent = optimizer.ascent(grids)
+    assert ascent['fom'] <= result['fom'] + 1e-9
+    assert ascent['fom'] == pytest.approx(values[tuple(ascent['cuts'][name] for name in grids)])
@@ -0,0 +1,173 @@
+# Path construction of reconstruction.py with the stub basf2 modules of bench.py
+#
+#   python -m pytest scripts/tests
+import importlib
+import os
+import runpy
+import sys
+
+import pytest
+
+import bench
+import reconstruction
+from reconstruction import LAMBDAC, PI0_PREFIT, SIGMA_V6, SIGMA_V7, SIGMA_V7_PREFIT, SIGMA_V7_TRAIN
+
+STUBBED = ['basf2', 'modularAnalysis', 'b2biiConversion', 'b2biiMonitors', 'variables',
+           'variables.utils', 'variables.collections', 'ROOT', 'pruning', 'cutflow',
+           'sampling']
+
+# The cut-flow counters run() adds around the stages
+RUN_MODULES = ('StageBegin', 'StageEnd', 'CutFlowWriter')
+
+SIGMA_MODULES = [
+    'cutAndCopyList', 'fillParticleList', 'cutAndCopyList', 'applyEventCuts',
+    'cutAndCopyList', 'reconstructDecay', 'vertexTree', 'cutAndCopyList', 'vertexTree', 'applyCuts',
+    'matchMCTruth', 'VariablesToNtuple',
+]
+SIGMA_LISTS = [
+    'pi0:gate', 'p+:all', 'p+:berger', None,
+    'pi0:loose', 'Sigma+:loose -> p+:berger pi0:loose', 'Sigma+:loose', 'Sigma+:good', 'Sigma+:good', 'Sigma+:good',
+    'Sigma+:good', 'Sigma+:good',
+]
+
+@pytest.fixture
+def stubs():
+    """
+    Install the stubs for one test and put the real modules back afterwards.
+    """
+    saved = {name: sys.modules.get(name) for name in STUBBED}
+    # pruning, cutflow and sampling define their basf2 modules only when basf2 imports
+    for name in ['pruning', 'cutflow', 'sampling']:
+        sys.modules.pop(name, None)
+    bench.install_stubs()
+    yield sys.modules['basf2']
+    for name, module in saved.items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+
+def build(b2, configs):
+    """
+    Return the path of run(): the event gate, then every configuration.
+    """
+    path = b2.create_path()
+    reco = reconstruction.Reconstruction(path, multi = len(configs) > 1)
+    reco.gate(configs)
+    for config in configs:
+        reco.add(config, 'out.root')
+    return path, reco
+
+def lists(path):
+    """
+    Return the list (or decay) each call of the path makes.
+    """
+    def made(name, args, kwargs):
+        if name == 'applyEventCuts':
+            return None
+        if name in ('VariablesToNtuple', 'MVAExpert'):
+            return kwargs.get('particleList') or kwargs.get('listNames')
+        return args[0] if args else None
+    return [made(*call) for call in path.calls]
+
+def cut_of(path, listname):
+    return [args[2] for name, args, _ in path.calls if name == 'cutAndCopyList' and args[0] == listname]
+
+def test_sigma_v6(stubs):
+    path, reco = build(stubs, [SIGMA_V6])
+    assert path.modules == SIGMA_MODULES
+    assert lists(path) == SIGMA_LISTS
+    assert cut_of(path, 'pi0:loose') == ['']
+    assert reco.trees == ['good']
+
+def test_sigma_v7(stubs):
+    path, reco = build(stubs, [SIGMA_V7])
+    assert path.modules == SIGMA_MODULES
+    assert lists(path) == SIGMA_LISTS
+    # No pi0 cuts before the first fit: the pre-fit cuts are an opt-in variant
+    assert cut_of(path, 'pi0:loose') == ['']
+    assert cut_of(path, 'Sigma+:good') == [SIGMA_V7['sigma_good']]
+
+def test_sigma_v7_prefit(stubs):
+    path, _ = build(stubs, [SIGMA_V7_PREFIT])
+    assert path.modules == SIGMA_MODULES
+    assert cut_of(path, 'pi0:loose') == [PI0_PREFIT]
+
+def test_lambdac(stubs):
+    path, reco = build(stubs, [LAMBDAC])
+    assert path.modules == [
+        'cutAndCopyList', 'fillParticleList', 'cutAndCopyList', 'fillParticleList', 'cutAndCopyList',
+        'applyEventCuts',
+        'cutAndCopyList', 'reconstructDecay', 'vertexTree', 'cutAndCopyList', 'vertexTree', 'applyCuts',
+        'cutAndCopyList', 'MVAExpert', 'applyCuts',
+        'cutAndCopyList', 'PionPrune',
+        'reconstructDecay', 'vertexTree', 'applyCuts', 'matchMCTruth', 'VariablesToNtuple',
+    ]
+    made = lists(path)
+    assert made[:5] == ['pi0:gate', 'p+:all', 'p+:berger', 'pi+:all', 'pi+:lamc']
+    assert made[12] == 'Sigma+:mva'
+    assert made[15] == 'pi+:pruned'
+    assert made[17] == 'Lambda_c+:loose -> Sigma+:mva pi+:pruned pi-:pruned'
+    assert made[-1] == 'Lambda_c+:loose'
+    # The gate asks for a pi+ pi- pair of the pre-filtered pions
+    gate, = [args[0] for name, args, _ in path.calls if name == 'applyEventCuts']
+    assert 'nParticlesInList(pi+:lamc) > 1' in gate
+    assert reco.trees == ['lambda_c']
+    # PID vetoes only: the impact parameter cuts are the lambdac_ip variant
+    assert cut_of(path, 'pi+:lamc') == ['pid_ppi < 0.6 and pid_kpi < 0.6']
+
+def test_shared_lists(stubs):
+    path, reco = build(stubs, [SIGMA_V6, SIGMA_V7])
+    made = lists(path)
+    # The lists both agree on are built once, up to the first fit; the good lists differ in their cuts
+    for shared in ['p+:berger_v6', 'pi0:loose_v6', 'Sigma+:loose_v6']:
+        assert made.count(shared) == 1
+    assert not any(name.endswith('_v7') for name in made if name and name.split(':')[0] in ('p+', 'pi0'))
+    assert 'Sigma+:good_v6' in made and 'Sigma+:good_v7' in made
+    assert reco.trees == ['good_v6', 'good_v7']
+
+def test_sigma_mva_ranking(stubs):
+    path, _ = build(stubs, [dict(LAMBDAC, rank = 'Sigma_mva')])
+    rank, = [(name, args) for name, args, _ in path.calls if name.startswith('rankBy')]
+    assert rank == ('rankByHighest', ('Lambda_c+:best', 'daughter(0, extraInfo(Sigma_mva))'))
+    # Not set on the Sigma+ lists of the Sigma+ selections
+    with pytest.raises(ValueError):
+        build(stubs, [dict(SIGMA_V7, rank = 'Sigma_mva')])
+
+def test_sample(stubs):
+    path, _ = build(stubs, [SIGMA_V7_TRAIN])
+    assert 'Downsample' in path.modules
+    # No background left, or more background than there is
+    for fraction in [-0.1, 1.5]:
+        with pytest.raises(ValueError):
+            build(stubs, [dict(SIGMA_V7_TRAIN, sample = fraction)])
+
+@pytest.mark.parametrize('script, configs', [('sigma_v6.py', [SIGMA_V6]), ('sigma_v7.py', [SIGMA_V7]),
+                                             ('recon_lambdac.py', [LAMBDAC])])
+def test_steering(stubs, monkeypatch, script, configs):
+    # The steering scripts are thin wrappers: their path is the library path after the conversion
+    monkeypatch.setattr(sys, 'argv', [script, 'in.mdst', 'out.root'])
+    runpy.run_path(os.path.join(os.path.dirname(reconstruction.__file__), script), run_name = '__main__')
+    steering, = stubs.processed
+    path, _ = build(stubs, configs)
+    assert steering.modules[0] == 'B2BIIConvert'
+    assert [call for call in steering.calls[1:] if call[0] not in RUN_MODULES] == path.calls
+
+def test_gate_count(stubs, tmp_path, capsys):
+    cutflow = importlib.import_module('cutflow')
+    cf = cutflow.CutFlow(str(tmp_path / 'out.root'))
+    path = stubs.create_path()
+    reco = reconstruction.Reconstruction(path, cf = cf, multi = True)
+    added = []
+    path.add_module = added.append
+    reco.gate([SIGMA_V6, LAMBDAC])
+    begin, end = [module for module in added if type(module).__name__ in ('StageBegin', 'StageEnd')][-2:]
+    # Ten events in, the event cut ends the path of all but three
+    for event in range(10):
+        begin.event()
+        if event < 3:
+            end.event()
+    gate = cf.stages['event gate']
+    assert (gate['events'], gate['events_out'], gate['cand_in'], gate['cand_out']) == (10, 3, 10, 3)
+    cutflow.print_gate(cf.stages)
+    assert capsys.readouterr().out.startswith('event gate: 30.0% of 10 events pass')
@@ -0,0 +1,53 @@
+# sampling.py downsampling a Parquet file of synthetic candidates
+#
+#   python -m pytest scripts/tests
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+import columnar
+import sampling
+import synthetic
+from reconstruction import SIGMA_V7
+
+@pytest.fixture(scope = 'module')
+def part(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('sampling')
+    paths = synthetic.generate(str(tmp / 'out'), [SIGMA_V7], nfiles = 2, nevents = 2000)
+    parts, _ = columnar.convert(paths, 'good', str(tmp / 'parquet'), row_group_size = 1000)
+    return parts[0]
+
+def sample(part, dest, fraction, seed):
+    sampling.sample_file(part, dest, fraction, seed)
+    return pq.read_table(dest).to_pandas()
+
+def test_reproducible(part, tmp_path):
+    first = sample(part, str(tmp_path / 'a.parquet'), 0.1, 1)
+    again = sample(part, str(tmp_path / 'b.parquet'), 0.1, 1)
+    other = sample(part, str(tmp_path / 'c.parquet'), 0.1, 2)
+    key = ['__run__', '__event__', '__candidate__']
+    assert first.equals(again)
+    assert not first[key].equals(other[key])
+
+    # All signal kept, the weighted background estimates what was dropped
+    original = pq.read_table(part, columns = ['isSignal']).to_pandas()['isSignal']
+    assert (first['isSignal'] == 1).sum() == (original == 1).sum()
+    background = first[first['isSignal'] == 0][sampling.WEIGHT]
+    assert (background == np.float32(10)).all()
+    assert first[sampling.WEIGHT].sum() == pytest.approx(len(original), rel = 0.1)
+
+def test_fraction():
+    assert sampling.check_fraction(1.0) == 1.0
+    for fraction in [0.0, -0.5, 1.5]:
+        with pytest.raises(ValueError):
+            sampling.check_fraction(fraction)
+
+def test_fraction_arg(tmp_path):
+    proc = subprocess.run([sys.executable, os.path.abspath(sampling.__file__), str(tmp_path), str(tmp_path / 'out'),
+                           '--fraction', '0'], stderr = subprocess.PIPE, universal_newlines = True)
+    assert proc.returncode == 2
+    assert 'must be in (0, 1]' in proc.stderr